@@ -64,6 +64,7 @@ SERVER_URL = None
 USERNAME = None
 PASSWORD = None
 ACCOUNT_ID = None
+DEVICE_KEY = None
 HEADERS = None
 
 
@@ -119,7 +120,7 @@ def register_pico():
     Generates random device name based on owner's username.
     Account ID is saved to a file for future use in creating Device objects.
     """
-    global ACCOUNT_ID, USERNAME, PASSWORD
+    global ACCOUNT_ID, USERNAME, PASSWORD, DEVICE_KEY
 
     response = None
     device_name = USERNAME + random_characters()
@@ -135,6 +136,7 @@ def register_pico():
 
     if response and response.status_code == 201:
         ACCOUNT_ID = response.json()["id"]
+        DEVICE_KEY = response.json().get("device_key")
         USERNAME = device_name
         PASSWORD = PASSWORD
         save_config()
@@ -156,12 +158,14 @@ DATA_PAYLOAD = {
                 "actions": ["on", "off", "toggle"],
                 "has_input_action": True,
                 "is_output": False,
+                "supersedes": ["on", "off"],
             },
             {
                 "name": "Movement detector",
                 "actions": ["detected"],
                 "has_input_action": False,
                 "is_output": True,
+                "debounce": 60,
             },
             {
                 "name": "Servo",
@@ -203,22 +207,27 @@ def perform_actions(data):
 
 def get_commands():
     """Gets list of potential Commands from the server and performs them.
-    If the command is performed successfully, it is deleted from the server.
+    Commands are leased to the device while it performs them,
+    then all of them are acknowledged with a single request.
     """
     while True:
         try:
             gc.collect()
-            request = requests.get(SERVER_URL + f"/api/commands/get/", headers=HEADERS)
+            request = requests.get(
+                SERVER_URL + "/api/commands/poll/?lease=1", headers=HEADERS
+            )
             if request.status_code == 200:
                 data = request.json()
                 request.close()
                 for command in data:
                     perform_actions(command["data"])
-                    del_req = requests.delete(
-                        f"{SERVER_URL}/api/commands/{command['id']}/", headers=HEADERS
+                if data:
+                    ack_req = requests.post(
+                        SERVER_URL + "/api/commands/ack/",
+                        json={"ids": [command["id"] for command in data]},
+                        headers=HEADERS,
                     )
-                    del_req.close()
-                    sleep(1)
+                    ack_req.close()
             else:
                 print("Failed to get commands. Status code:", request.status_code)
                 request.close()
@@ -246,17 +255,15 @@ def define_devices():
 
 
 def create_command(data):
-    """Creates a self executed command - input from the device to the system
+    """Reports an input event from the device to the system
 
     Args:
         data ({"name": componentName, "action": action}): command data
     """
-    command_data = {
-        "description": "Auto created",
-        "data": data,
-        "self_execute": True,
-    }
-    requests.post(SERVER_URL + "/api/commands/", json=command_data, headers=HEADERS)
+    request = requests.post(
+        SERVER_URL + "/api/events/", json={"data": data}, headers=HEADERS
+    )
+    request.close()
 
 
 def file_exists(filename):
@@ -289,9 +296,27 @@ def random_characters(length=12):
     return "".join(chars[random.getrandbits(6) % len(chars)] for _ in range(length))
 
 
+def fetch_device_key():
+    """Exchanges Basic credentials for a device key, used by devices registered before device keys existed.
+    Device key authentication is much cheaper for the server than Basic authentication.
+    """
+    global DEVICE_KEY
+    request = requests.post(SERVER_URL + "/api/device-key/", headers=HEADERS)
+    if request.status_code == 200:
+        DEVICE_KEY = request.json()["device_key"]
+        save_config()
+        set_auth_headers()
+    else:
+        print("Failed to get device key. Status code:", request.status_code)
+    request.close()
+
+
 def set_auth_headers():
     global HEADERS
     HEADERS = {"Content-Type": "application/json"}
+    if DEVICE_KEY:
+        HEADERS["Authorization"] = f"Device {ACCOUNT_ID}:{DEVICE_KEY}"
+        return
     auth_string = f"{USERNAME}:{PASSWORD}"
     auth_bytes = auth_string.encode("ascii")
     base64_bytes = ubinascii.b2a_base64(auth_bytes)
@@ -308,13 +333,14 @@ def save_config():
                 "username": USERNAME,
                 "password": PASSWORD,
                 "account_id": ACCOUNT_ID,
+                "device_key": DEVICE_KEY,
             },
             file,
         )
 
 
 def load_config():
-    global SSID, WIFI_PASSWORD, SERVER_URL, USERNAME, PASSWORD, ACCOUNT_ID
+    global SSID, WIFI_PASSWORD, SERVER_URL, USERNAME, PASSWORD, ACCOUNT_ID, DEVICE_KEY
     with open("conf.txt", "r") as file:
         data = json.load(file)
         SSID = data["wifi"]["ssid"]
@@ -323,6 +349,7 @@ def load_config():
         USERNAME = data["username"]
         PASSWORD = data["password"]
         ACCOUNT_ID = data["account_id"]
+        DEVICE_KEY = data.get("device_key")
 
 
 def main():
@@ -340,6 +367,8 @@ def main():
     if not registered:
         register_pico()
         define_devices()
+    elif not DEVICE_KEY:
+        fetch_device_key()
 
     pir.irq(trigger=machine.Pin.IRQ_RISING, handler=movement_detector_handler)
     led.on()
@@ -0,0 +1,132 @@
+import operator
+import threading
+import time
+from functools import reduce
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Q
+
+from .models.models import Device, DeviceAccess
+
+CACHE_PREFIX = "device_access:"
+
+# backends whose entries other processes cannot see or drop
+PROCESS_LOCAL_CACHES = (DummyCache, LocMemCache)
+
+
+def expected_access(device_ids):
+    """(user_id, device_id) pairs that should exist for the devices, read
+    with one query."""
+    access = set()
+    for device_id, owner_id, user_id in Device.objects.filter(
+        id__in=device_ids
+    ).values_list("id", "owner_id", "space__users"):
+        access.add((owner_id, device_id))
+        if user_id is not None:
+            access.add((user_id, device_id))
+    return access
+
+
+def refresh_device_access(device_ids):
+    """Brings the `DeviceAccess` rows of the devices up to date and drops the
+    cached device sets of the users whose access changed."""
+    device_ids = set(device_ids)
+    if not device_ids:
+        return
+
+    current = set(
+        DeviceAccess.objects.filter(device_id__in=device_ids).values_list(
+            "user_id", "device_id"
+        )
+    )
+    expected = expected_access(device_ids)
+    removed = current - expected
+    added = expected - current
+
+    if removed:
+        DeviceAccess.objects.filter(
+            reduce(
+                operator.or_,
+                (
+                    Q(user_id=user_id, device_id=device_id)
+                    for user_id, device_id in removed
+                ),
+            )
+        ).delete()
+    if added:
+        DeviceAccess.objects.bulk_create(
+            (
+                DeviceAccess(user_id=user_id, device_id=device_id)
+                for user_id, device_id in added
+            ),
+            ignore_conflicts=True,
+        )
+    device_access_cache.invalidate({user_id for user_id, _ in removed | added})
+
+
+class DeviceAccessCache:
+    """Device ids each user can access, cached in the process for `ttl`
+    seconds and in the shared Django cache until the access changes.
+
+    Changes drop both copies right away and again when the transaction
+    commits, so a concurrent reader cannot keep a set from before the
+    commit. Other processes see a change at the latest after `ttl`. The
+    Django cache is only used when it is shared between processes (see
+    CACHE_URL in settings), a per-process cache would keep revoked access
+    in the other processes for `shared_timeout`.
+    """
+
+    def __init__(self, ttl=5, shared_timeout=300):
+        self.ttl = ttl
+        self.shared_timeout = shared_timeout
+        self._lock = threading.Lock()
+        self._local = {}
+
+    @property
+    def shared(self):
+        return not isinstance(caches[DEFAULT_CACHE_ALIAS], PROCESS_LOCAL_CACHES)
+
+    def device_ids(self, user_id):
+        ids, valid_until = self._local.get(user_id, (None, 0))
+        if ids is not None and time.monotonic() < valid_until:
+            return ids
+
+        key = f"{CACHE_PREFIX}{user_id}"
+        shared = self.shared
+        ids = cache.get(key) if shared else None
+        if ids is None:
+            ids = list(
+                DeviceAccess.objects.filter(user_id=user_id).values_list(
+                    "device_id", flat=True
+                )
+            )
+            if shared:
+                cache.set(key, ids, self.shared_timeout)
+        ids = frozenset(ids)
+        with self._lock:
+            self._local[user_id] = (ids, time.monotonic() + self.ttl)
+        return ids
+
+    def invalidate(self, user_ids):
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+
+        def drop():
+            with self._lock:
+                for user_id in user_ids:
+                    self._local.pop(user_id, None)
+            cache.delete_many([f"{CACHE_PREFIX}{user_id}" for user_id in user_ids])
+
+        drop()
+        transaction.on_commit(drop)
+
+    def clear(self):
+        with self._lock:
+            self._local = {}
+
+
+device_access_cache = DeviceAccessCache()
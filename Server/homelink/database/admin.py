@@ -28,18 +28,64 @@ class CommandAdmin(admin.ModelAdmin):
         "description",
         "repeat_interval",
         "scheduled_at",
+        "expires_at",
+        "expired",
     ]
     search_fields = ["description", "author__username"]
     autocomplete_fields = ["author", "device"]
-    list_filter = ["author", "scheduled_at"]
+    list_filter = ["author", "scheduled_at", "expired"]
     list_editable = ["executed"]
 
 
+@admin.register(CommandHistory)
+class CommandHistoryAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "author",
+        "device",
+        "data",
+        "executed",
+        "expired",
+        "created_at",
+        "archived_at",
+    ]
+    list_filter = ["executed", "expired", "created_at"]
+    date_hierarchy = "created_at"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(CommandsLink)
 class CommandsLink(admin.ModelAdmin):
     list_display = ["ttl"]
 
 
+@admin.register(DeviceEvent)
+class DeviceEventAdmin(admin.ModelAdmin):
+    list_display = ["device", "data", "created_at"]
+    autocomplete_fields = ["device"]
+    list_filter = ["device"]
+
+
+@admin.register(LinkEvent)
+class LinkEventAdmin(admin.ModelAdmin):
+    list_display = ["device_id", "data", "partition", "created_at"]
+    list_filter = ["partition"]
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ["title", "owner", "updated_at"]
+    list_filter = ["owner"]
+
+
 @admin.register(CustomUser)
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ["username", "is_device"]
@@ -0,0 +1,139 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models.models import Command
+
+HISTORY_TABLE = "database_commandhistory"
+DEFAULT_PARTITION = f"{HISTORY_TABLE}_default"
+
+# columns copied from database_command, in the order of the history table
+HISTORY_COLUMNS = [
+    "id",
+    "author_id",
+    "device_id",
+    "description",
+    "data",
+    "self_execute",
+    "executed",
+    "expired",
+    "created_at",
+]
+
+
+def month_start(moment):
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(start):
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def months_before(start, months):
+    index = start.year * 12 + start.month - 1 - months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start):
+    return f"{HISTORY_TABLE}_p{start:%Y%m}"
+
+
+def ensure_partition(start):
+    """Creates the monthly history partition starting at `start` if it is
+    missing. Rows of that month that reached the default partition are moved
+    into it, Postgres refuses to add the partition while they are there."""
+    name = partition_name(start)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0] is not None:
+            return
+        cursor.execute(f"CREATE TABLE {name} (LIKE {HISTORY_TABLE} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE created_at >= %s AND created_at < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            [start, next_month(start)],
+        )
+        cursor.execute(
+            f"ALTER TABLE {HISTORY_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [start, next_month(start)],
+        )
+
+
+def archivable_commands(before):
+    """Delivered commands and dead-lettered ones created before `before`."""
+    return Command.objects.filter(Q(executed=True) | Q(expired=True)).filter(
+        created_at__lt=before
+    )
+
+
+def archive_commands(before, batch_size=1000):
+    """Moves archivable commands from `database_command` to the partitioned
+    history table, `batch_size` rows per transaction. Returns the number of
+    moved commands."""
+    columns = ", ".join(HISTORY_COLUMNS)
+    moved = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            batch = list(
+                archivable_commands(before)
+                .order_by("id")
+                .select_for_update()
+                .values_list("id", "created_at")[:batch_size]
+            )
+            if not batch:
+                return moved
+            # partitions are added as the batches need them, so no row of a
+            # month without one ends up in the default partition
+            for month in {month_start(created_at) for _, created_at in batch}:
+                ensure_partition(month)
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {Command._meta.db_table} "
+                f"WHERE id = ANY(%s) RETURNING {columns}) "
+                f"INSERT INTO {HISTORY_TABLE} ({columns}, archived_at) "
+                f"SELECT {columns}, %s FROM moved",
+                [[id for id, _ in batch], timezone.now()],
+            )
+            moved += cursor.rowcount
+
+
+def history_partitions():
+    """Attached monthly partitions as (name, month start), oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [HISTORY_TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = re.fullmatch(rf"{HISTORY_TABLE}_p(\d{{4}})(\d{{2}})", name)
+        if match:
+            start = datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)
+            partitions.append((name, start))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def expire_partitions(before, drop=False):
+    """Detaches the history partitions that end before `before`. Detached
+    tables are kept for export unless `drop` is set. Returns their names."""
+    expired = [
+        name for name, start in history_partitions() if next_month(start) <= before
+    ]
+    with connection.cursor() as cursor:
+        for name in expired:
+            cursor.execute(f"ALTER TABLE {HISTORY_TABLE} DETACH PARTITION {name}")
+            if drop:
+                cursor.execute(f"DROP TABLE {name}")
+    return expired
@@ -0,0 +1,78 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models.models import Command
+from .notifications import AsyncWaiter, command_notifier, user_key
+from .serializers import CommandForDeviceSerializer
+
+
+def _authenticate(request):
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    return drf_request.user
+
+
+async def authenticate(request):
+    """Authenticates a plain Django request with the configured DRF
+    authentication classes. Returns `None` if the request is anonymous or the
+    credentials are invalid."""
+    try:
+        user = await sync_to_async(_authenticate)(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
+
+
+def _pending_commands(user, lease=False):
+    if lease:
+        commands = Command.objects.lease_for(user)
+    else:
+        commands = Command.objects.pending_for(user)
+    return CommandForDeviceSerializer(commands, many=True).data
+
+
+class CommandPollView(View):
+    """Async counterpart of `GET /api/commands/get/`.
+
+    Each waiting device is parked as a coroutine on the command notifier
+    instead of holding a worker thread, and the response has the same shape.
+    With `?lease=1` the returned commands are leased to the caller (see
+    `CommandQuerySet.lease_for`) and should be acknowledged with
+    `POST /api/commands/ack/`.
+    """
+
+    timeout = 120
+
+    async def get(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=401,
+            )
+
+        lease = bool(request.GET.get("lease"))
+        deadline = time.monotonic() + self.timeout
+        with command_notifier.listen([user_key(user.pk)], AsyncWaiter()) as woken:
+            while True:
+                result = await sync_to_async(_pending_commands)(user, lease)
+                if result:
+                    return JsonResponse(result, safe=False)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return JsonResponse([], safe=False)
+                await woken.wait(
+                    await sync_to_async(Command.objects.poll_timeout_for)(
+                        user, remaining
+                    )
+                )
+                woken.clear()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+
+from .access import device_access_cache
+from .models.models import Device, estimate_tokens
+
+CACHE_PREFIX = "device_catalog:"
+
+
+class DeviceCatalog:
+    """Compact description of the devices a user can access, for LLM prompts.
+
+    Only ids, names, components and actions are kept. The `input`/`output`
+    flags of a component are written only when they are set.
+    """
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.text = json.dumps(devices, separators=(",", ":"), ensure_ascii=False)
+        self.hash = hashlib.sha1(self.text.encode()).hexdigest()
+
+    @property
+    def tokens(self):
+        return estimate_tokens(self.text)
+
+    @classmethod
+    def from_devices(cls, devices):
+        return cls([encode_device(device) for device in devices])
+
+
+def encode_device(device):
+    components = []
+    data = device.data if isinstance(device.data, dict) else {}
+    entries = data.get("components")
+    for component in entries if isinstance(entries, list) else []:
+        # device data is edited by users and the LLM, entries may be anything
+        if not isinstance(component, dict):
+            continue
+        actions = component.get("actions")
+        encoded = {
+            "name": component.get("name"),
+            "actions": actions if isinstance(actions, list) else [],
+        }
+        if component.get("has_input_action"):
+            encoded["input"] = True
+        if component.get("is_output"):
+            encoded["output"] = True
+        components.append(encoded)
+    return {"id": device.pk, "name": device.name, "components": components}
+
+
+class CatalogCache:
+    """Per-user `DeviceCatalog` kept in the Django cache.
+
+    An entry is rebuilt when the user's device access set or the newest
+    `updated_at` of the devices changes, so a process that missed the
+    invalidation of an edited device (database/signals.py) does not use it.
+    """
+
+    def __init__(self, timeout=3600):
+        self.timeout = timeout
+
+    def get(self, user_id):
+        device_ids = device_access_cache.device_ids(user_id)
+        devices = Device.objects.filter(id__in=device_ids)
+        version = (device_ids, devices.aggregate(Max("updated_at"))["updated_at__max"])
+        key = f"{CACHE_PREFIX}{user_id}"
+        cached = cache.get(key)
+        if cached is not None and cached[0] == version:
+            return DeviceCatalog(cached[1])
+
+        catalog = DeviceCatalog.from_devices(devices.order_by("id"))
+        cache.set(key, (version, catalog.devices), self.timeout)
+        return catalog
+
+    def invalidate(self, user_ids):
+        keys = [f"{CACHE_PREFIX}{user_id}" for user_id in set(user_ids)]
+        if keys:
+            cache.delete_many(keys)
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,99 @@
+import math
+import threading
+import time
+
+from .models.models import Device
+
+# longest accepted window, in seconds
+MAX_WINDOW = 24 * 60 * 60
+
+
+def debounce_window(value):
+    """Seconds of a component's `debounce` setting, `None` if it is not a
+    positive number. Device data is user-editable, so anything is possible."""
+    try:
+        window = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(window) or window <= 0:
+        return None
+    return min(window, MAX_WINDOW)
+
+
+class EventDebouncer:
+    """Drops repeated input events before they are stored.
+
+    A component may declare `"debounce": seconds` in `Device.data["components"]`.
+    After an event of that component is accepted, identical events (same
+    device, component and action) are dropped until the window has passed.
+    The windows of each device are read once and cached until the device is
+    saved or deleted (see database/signals.py), so a dropped event costs a
+    dictionary lookup. The state is kept per process, so windows cached by
+    other processes are also refreshed every `config_ttl` seconds.
+    """
+
+    def __init__(self, max_entries=10000, config_ttl=60):
+        self.max_entries = max_entries
+        self.config_ttl = config_ttl
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._until = {}
+
+    def windows(self, device_id):
+        now = time.monotonic()
+        windows, loaded_at = self._windows.get(device_id, (None, 0))
+        if windows is None or now - loaded_at > self.config_ttl:
+            data = (
+                Device.objects.filter(pk=device_id)
+                .values_list("data", flat=True)
+                .first()
+            )
+            components = (data or {}).get("components") or []
+            windows = {}
+            for component in components:
+                if not isinstance(component, dict) or "name" not in component:
+                    continue
+                window = debounce_window(component.get("debounce"))
+                if window is not None:
+                    windows[component["name"]] = window
+            with self._lock:
+                if len(self._windows) >= self.max_entries:
+                    self._windows = {
+                        key: entry
+                        for key, entry in self._windows.items()
+                        if now - entry[1] <= self.config_ttl
+                    }
+                while len(self._windows) >= self.max_entries:
+                    del self._windows[next(iter(self._windows))]
+                self._windows[device_id] = (windows, now)
+        return windows
+
+    def accept(self, device_id, data, now=None):
+        """Returns whether the event should be stored, and opens its window if so."""
+        window = self.windows(device_id).get(data["name"])
+        if not window:
+            return True
+
+        now = time.monotonic() if now is None else now
+        key = (device_id, data["name"], data["action"])
+        with self._lock:
+            if self._until.get(key, 0) > now:
+                return False
+            if len(self._until) >= self.max_entries:
+                self._until = {k: t for k, t in self._until.items() if t > now}
+            while len(self._until) >= self.max_entries:
+                # all windows still open, give up the oldest one
+                del self._until[next(iter(self._until))]
+            self._until[key] = now + window
+        return True
+
+    def forget_device(self, device_id):
+        self._windows.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._windows = {}
+            self._until = {}
+
+
+event_debouncer = EventDebouncer()
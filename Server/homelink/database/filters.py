@@ -1,4 +1,4 @@
-from .models.models import Device, Command
+from .models.models import Device, Command, CommandHistory
 import django_filters
 
 
@@ -14,3 +14,11 @@ class CommandFilter(django_filters.FilterSet):
     class Meta:
         model = Command
         fields = ["executed"]
+
+
+class CommandHistoryFilter(django_filters.FilterSet):
+    executed = django_filters.BooleanFilter()
+
+    class Meta:
+        model = CommandHistory
+        fields = ["executed"]
@@ -0,0 +1,88 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models.models import CommandsLink, LinkEvent
+from .notifications import LINK_EVENTS_KEY, command_notifier
+
+logger = logging.getLogger(__name__)
+
+# first key of the two-key advisory locks that guard LinkEvent partitions
+PARTITION_LOCK_CLASS = 0x4C4E4B
+
+
+class LinkEventWorker:
+    """Evaluates `CommandsLink` triggers for the events in the `LinkEvent` outbox.
+
+    A partition is processed by at most one worker at a time: the worker takes
+    a transaction-level advisory lock on it and skips it if another worker
+    holds it, so any number of workers can run side by side while the events
+    of each device are still evaluated in the order they were recorded. Events
+    are evaluated at the time they were recorded, not the time they are
+    processed, so queue lag does not affect `CommandsLink.ttl`. A link with
+    triggers on devices of different partitions can be reached by two
+    workers at once; `evaluate_stored` locks its rows, so they take turns.
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+
+    def process_partition(self, partition):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_try_advisory_xact_lock(%s, %s)",
+                    [PARTITION_LOCK_CLASS, partition],
+                )
+                if not cursor.fetchone()[0]:
+                    return 0
+
+            events = list(
+                LinkEvent.objects.filter(partition=partition).order_by("id")[
+                    : self.batch_size
+                ]
+            )
+            if not events:
+                return 0
+
+            CommandsLink.evaluate_triggers(
+                [
+                    (event.device_id, event.data, event.created_at.timestamp())
+                    for event in events
+                ]
+            )
+            LinkEvent.objects.filter(id__in=[event.id for event in events]).delete()
+        return len(events)
+
+    def run_once(self):
+        processed = 0
+        for partition in range(settings.LINK_EVENT_PARTITIONS):
+            try:
+                processed += self.process_partition(partition)
+            except Exception:
+                # the batch is rolled back and retried on the next run
+                logger.exception(
+                    "Evaluating link events of partition %d failed", partition
+                )
+        return processed
+
+    def run_forever(self, idle_timeout=5, stats_interval=60):
+        next_stats = time.monotonic()
+        with command_notifier.listen([LINK_EVENTS_KEY]) as woken:
+            while True:
+                woken.clear()
+                processed = self.run_once()
+
+                if time.monotonic() >= next_stats:
+                    stats = LinkEvent.objects.stats()
+                    logger.info(
+                        "Link event queue depth %d, lag %.1fs",
+                        stats["depth"],
+                        stats["lag"],
+                    )
+                    next_stats = time.monotonic() + stats_interval
+
+                if not processed:
+                    woken.wait(idle_timeout)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from database.archive import (
+    archive_commands,
+    expire_partitions,
+    month_start,
+    months_before,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves old delivered and expired commands to the partitioned command "
+        "history and detaches history partitions past the retention period. "
+        "Meant to be run periodically, e.g. daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=30,
+            help="Archive commands created more than this many days ago",
+        )
+        parser.add_argument(
+            "--keep-months",
+            type=int,
+            default=12,
+            help="Detach history partitions older than this many whole months",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop detached partitions instead of keeping them for export",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of commands moved per transaction",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        moved = archive_commands(
+            now - timezone.timedelta(days=options["older_than"]),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(f"Archived {moved} commands")
+
+        detached = expire_partitions(
+            months_before(month_start(now), options["keep_months"]),
+            drop=options["drop"],
+        )
+        for name in detached:
+            self.stdout.write(f"{'Dropped' if options['drop'] else 'Detached'} {name}")
@@ -0,0 +1,55 @@
+import base64
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from database.authentication import DeviceKeyAuthentication, make_device_key
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Measures the per-request cost of Basic and device key authentication"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+
+        with transaction.atomic():
+            owner = User.objects.create_user(username="benchmark-owner")
+            device = User.objects.create_user(
+                username="benchmark-device",
+                password="benchmark-password",
+                is_device=True,
+                owner=owner,
+            )
+            basic = base64.b64encode(b"benchmark-device:benchmark-password").decode()
+            schemes = [
+                (BasicAuthentication(), f"Basic {basic}"),
+                (
+                    DeviceKeyAuthentication(),
+                    f"Device {device.pk}:{make_device_key(device)}",
+                ),
+            ]
+
+            for authenticator, header in schemes:
+                request = Request(
+                    factory.get("/api/commands/poll/", HTTP_AUTHORIZATION=header)
+                )
+                start = time.perf_counter()
+                for _ in range(options["requests"]):
+                    user, _ = authenticator.authenticate(request)
+                    assert user.pk == device.pk
+                elapsed = (time.perf_counter() - start) / options["requests"]
+                self.stdout.write(
+                    f"{authenticator.__class__.__name__}: {elapsed * 1e6:.0f} us/request"
+                )
+
+            transaction.set_rollback(True)
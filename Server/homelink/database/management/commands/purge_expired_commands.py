@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from database.models.models import Command as DeviceCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes pending commands whose expires_at has passed, in bounded "
+        "batches. Meant to be run periodically, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of commands deleted per statement",
+        )
+        parser.add_argument(
+            "--dead-letter",
+            action="store_true",
+            help="Keep expired commands and flag them as expired instead of deleting them",
+        )
+
+    def handle(self, *args, **options):
+        purged = DeviceCommand.objects.purge_expired(
+            batch_size=options["batch_size"], dead_letter=options["dead_letter"]
+        )
+        self.stdout.write(f"Purged {purged} expired commands")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from database.link_worker import LinkEventWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluates CommandsLink triggers for queued device events "
+        "(LINK_EVALUATION_QUEUE). Run several processes to evaluate "
+        "partitions in parallel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Maximum number of events of one partition evaluated per transaction",
+        )
+        parser.add_argument(
+            "--stats-interval",
+            type=int,
+            default=60,
+            help="Seconds between queue depth and lag log lines",
+        )
+
+    def handle(self, *args, **options):
+        worker = LinkEventWorker(batch_size=options["batch_size"])
+        self.stdout.write("Link worker started")
+        worker.run_forever(stats_interval=options["stats_interval"])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from database.scheduler import CommandScheduler
+
+
+class Command(BaseCommand):
+    help = "Runs the scheduler that releases scheduled and repeating commands"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--horizon",
+            type=int,
+            default=600,
+            help="Seconds ahead for which schedules are kept in memory",
+        )
+
+    def handle(self, *args, **options):
+        scheduler = CommandScheduler(
+            horizon=timezone.timedelta(seconds=options["horizon"])
+        )
+        self.stdout.write("Scheduler started")
+        scheduler.run_forever()
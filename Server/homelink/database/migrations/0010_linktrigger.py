@@ -0,0 +1,58 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:33
+
+from datetime import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_trigger_rows(apps, schema_editor):
+    CommandsLink = apps.get_model("database", "CommandsLink")
+    LinkTrigger = apps.get_model("database", "LinkTrigger")
+
+    for link in CommandsLink.objects.all():
+        rows = []
+        for position, trigger in enumerate(link.triggers):
+            satisfied_at = trigger.get("satisfied_at")
+            rows.append(
+                LinkTrigger(
+                    link=link,
+                    position=position,
+                    device_id=trigger["device_id"],
+                    component_name=trigger["component_name"],
+                    action=trigger["action"],
+                    satisfied_at=(
+                        datetime.fromisoformat(satisfied_at) if satisfied_at else None
+                    ),
+                )
+            )
+            trigger["satisfied_at"] = None
+        LinkTrigger.objects.bulk_create(rows)
+        link.save(update_fields=["triggers"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0009_command_executed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkTrigger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('device_id', models.BigIntegerField()),
+                ('component_name', models.TextField()),
+                ('action', models.TextField()),
+                ('satisfied_at', models.DateTimeField(blank=True, null=True)),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigger_rows', to='database.commandslink')),
+            ],
+            options={
+                'ordering': ['position'],
+                'indexes': [models.Index(fields=['device_id', 'component_name', 'action'], name='linktrigger_event_idx')],
+            },
+        ),
+        migrations.RunPython(create_trigger_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0010_linktrigger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='leased_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0011_command_leased_until"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LinkEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("partition", models.PositiveSmallIntegerField()),
+                ("device_id", models.BigIntegerField()),
+                ("data", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["partition", "id"], name="linkevent_partition_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0013_deviceevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="command",
+            name="expired",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="command",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="device",
+            name="command_ttl",
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="command",
+            index=models.Index(
+                condition=models.Q(("executed", False), ("expired", False)),
+                fields=["expires_at"],
+                name="command_expiry_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_target_account(apps, schema_editor):
+    Command = apps.get_model("database", "Command")
+    Device = apps.get_model("database", "Device")
+    Command.objects.filter(executed=False).update(
+        target_account=models.Subquery(
+            Device.objects.filter(pk=models.OuterRef("device")).values("account")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0014_command_expiry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="command",
+            name="target_account",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(populate_target_account, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="command",
+            index=models.Index(
+                condition=models.Q(("executed", False), ("scheduled_at__isnull", True)),
+                fields=["target_account", "id"],
+                include=("leased_until", "expires_at"),
+                name="command_pending_account_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="command",
+            index=models.Index(
+                condition=models.Q(("executed", False), ("scheduled_at__isnull", True)),
+                fields=["device", "id"],
+                include=("leased_until", "expires_at"),
+                name="command_pending_device_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+CREATE_HISTORY_TABLE = """
+CREATE TABLE database_commandhistory (
+    id bigint NOT NULL,
+    author_id bigint NOT NULL,
+    device_id bigint NULL,
+    description text NULL,
+    data jsonb NOT NULL,
+    self_execute boolean NOT NULL,
+    executed boolean NOT NULL,
+    expired boolean NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    archived_at timestamp with time zone NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE database_commandhistory_default
+    PARTITION OF database_commandhistory DEFAULT;
+CREATE INDEX commandhistory_device_idx ON database_commandhistory (device_id, id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0015_command_target_account"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            CREATE_HISTORY_TABLE, "DROP TABLE database_commandhistory CASCADE;"
+        ),
+        migrations.CreateModel(
+            name="CommandHistory",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("description", models.TextField(blank=True, null=True)),
+                ("data", models.JSONField()),
+                ("self_execute", models.BooleanField()),
+                ("executed", models.BooleanField()),
+                ("expired", models.BooleanField()),
+                ("created_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name_plural": "command history",
+                "db_table": "database_commandhistory",
+                "managed": False,
+            },
+        ),
+        migrations.AddField(
+            model_name="command",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="command",
+            index=models.Index(
+                condition=models.Q(
+                    ("executed", True), ("expired", True), _connector="OR"
+                ),
+                fields=["created_at"],
+                name="command_archivable_idx",
+            ),
+        ),
+    ]
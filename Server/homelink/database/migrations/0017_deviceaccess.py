@@ -0,0 +1,69 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_device_access(apps, schema_editor):
+    Device = apps.get_model("database", "Device")
+    DeviceAccess = apps.get_model("database", "DeviceAccess")
+    access = set()
+    for device_id, owner_id, user_id in Device.objects.values_list(
+        "id", "owner_id", "space__users"
+    ):
+        access.add((owner_id, device_id))
+        if user_id is not None:
+            access.add((user_id, device_id))
+    DeviceAccess.objects.bulk_create(
+        DeviceAccess(user_id=user_id, device_id=device_id)
+        for user_id, device_id in access
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0016_command_history"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceAccess",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "device",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="access",
+                        to="database.device",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="deviceaccess",
+            constraint=models.UniqueConstraint(
+                fields=("user", "device"), name="deviceaccess_user_device_uniq"
+            ),
+        ),
+        migrations.RunPython(populate_device_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0018_conversations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="device",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.11 on 2026-10-18 19:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0019_device_updated_at"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="command",
+            name="command_pending_account_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="command",
+            name="command_pending_device_idx",
+        ),
+        migrations.AddField(
+            model_name="command",
+            name="released_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+        # commands already pending were released when they were created
+        migrations.RunSQL(
+            "UPDATE database_command SET released_at = created_at",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="command",
+            index=models.Index(
+                condition=models.Q(("executed", False), ("scheduled_at__isnull", True)),
+                fields=["target_account", "released_at", "id"],
+                include=("leased_until", "expires_at"),
+                name="command_pending_account_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="command",
+            index=models.Index(
+                condition=models.Q(("executed", False), ("scheduled_at__isnull", True)),
+                fields=["device", "released_at", "id"],
+                include=("leased_until", "expires_at"),
+                name="command_pending_device_idx",
+            ),
+        ),
+    ]
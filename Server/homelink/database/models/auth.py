@@ -8,12 +8,12 @@ class CustomUser(AbstractUser):
     owner = models.ForeignKey("self", on_delete=models.CASCADE, null=True, blank=True)
 
     def get_user_devices(self):
-        Device = apps.get_model("database", "Device")
-        Space = apps.get_model("database", "Space")
+        from ..access import device_access_cache
 
-        result = list(Device.objects.filter(owner=self))
-        for s in Space.objects.filter(users=self):
-            for d in s.device_set.all():
-                result.append(d)
+        Device = apps.get_model("database", "Device")
 
-        return list(set(result))
+        return list(
+            Device.objects.filter(
+                id__in=device_access_cache.device_ids(self.pk)
+            ).order_by("id")
+        )
@@ -1,8 +1,13 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import models, transaction
+from django.db.models import Count, Min, Q
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import datetime
 
+from ..notifications import LINK_EVENTS_KEY, command_notifier, notify_command_recipients
+
 User = get_user_model()
 
 
@@ -27,6 +32,9 @@ class Device(models.Model):
     # [{
     # "name": "LED", "actions": ["on", "off", "toggle"], "has_input_action": True, is_output: False
     # }]
+    # an input component may add "debounce": seconds to drop repeated identical events,
+    # an output component may add "supersedes": [action, ...], actions that replace
+    # all older pending commands of the component (e.g. ["on", "off"] for a LED)
     # }
     data = models.JSONField(null=True, blank=True)
 
@@ -38,6 +46,10 @@ class Device(models.Model):
         blank=True,
     )
     added_at = models.DateTimeField(auto_now_add=True)
+    # versions the cached device catalogs (database/catalog.py)
+    updated_at = models.DateTimeField(auto_now=True)
+    # commands not delivered within this time expire, unless they set expires_at
+    command_ttl = models.DurationField(null=True, blank=True)
 
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="devices")
     space = models.ForeignKey(Space, on_delete=models.SET_NULL, null=True, blank=True)
@@ -45,6 +57,167 @@ class Device(models.Model):
     def __str__(self):
         return f"{self.name} | {self.owner.username}"
 
+    def get_component(self, name):
+        # device data is edited by users and the LLM, entries may be anything
+        data = self.data if isinstance(self.data, dict) else {}
+        components = data.get("components")
+        for component in components if isinstance(components, list) else []:
+            if isinstance(component, dict) and component.get("name") == name:
+                return component
+        return {}
+
+
+class DeviceAccess(models.Model):
+    """Materialized "user can use device" relation: the owner of the device
+    and the users of its space. Maintained by database/access.py."""
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", db_index=False
+    )
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="access")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "device"], name="deviceaccess_user_device_uniq"
+            )
+        ]
+
+
+class CommandQuerySet(models.QuerySet):
+    def for_user(self, user):
+        return self.filter(Q(device__owner=user.pk) | Q(device__account=user.pk))
+
+    def pending_for(self, user):
+        """Commands waiting for delivery to `user`. A device account is matched
+        on the denormalized `target_account` and an owner on the ids of their
+        devices, so both use a partial index on pending commands instead of
+        joining `Device` with an OR."""
+        return (
+            self._deliverable_for(user)
+            .filter(Q(leased_until__isnull=True) | Q(leased_until__lt=timezone.now()))
+            .order_by("released_at", "id")
+        )
+
+    def poll_timeout_for(self, user, timeout):
+        """Seconds a poll of `user` waits for a notification: `timeout`, or
+        less when the lease of one of its commands expires sooner, since an
+        expired lease sends no notification."""
+        now = timezone.now()
+        released = (
+            self._deliverable_for(user)
+            .filter(leased_until__gte=now)
+            .aggregate(Min("leased_until"))["leased_until__min"]
+        )
+        if released is None:
+            return timeout
+        return min(timeout, max((released - now).total_seconds(), 0))
+
+    def _deliverable_for(self, user):
+        # scheduled commands are released by the scheduler (database/scheduler.py)
+        if user.is_device:
+            target = Q(target_account=user.pk)
+        else:
+            target = Q(device__in=Device.objects.filter(owner=user.pk).values("id"))
+        return (
+            self.filter(target)
+            .filter(executed=False, scheduled_at__isnull=True)
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+        )
+
+    def expired(self):
+        return self.filter(
+            executed=False, expired=False, expires_at__lte=timezone.now()
+        )
+
+    def purge_expired(self, batch_size=1000, dead_letter=False):
+        """Deletes expired commands, or only flags them as `expired` with
+        `dead_letter`, in batches of `batch_size` rows so that no statement
+        locks a large part of the table. Returns the number of commands."""
+        purged = 0
+        while True:
+            ids = list(
+                self.expired().order_by("id").values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return purged
+            batch = Command.objects.filter(id__in=ids)
+            if dead_letter:
+                batch.update(expired=True)
+            else:
+                batch.delete()
+            purged += len(ids)
+
+    def acknowledge(self):
+        """Marks the commands executed with one UPDATE and evaluates link
+        triggers for all of them in one pass. Returns the acknowledged ids."""
+        with transaction.atomic():
+            commands = list(
+                self.filter(executed=False)
+                .select_for_update(of=("self",))
+                .order_by("id")
+            )
+            Command.objects.filter(id__in=[c.id for c in commands]).update(
+                executed=True
+            )
+            CommandsLink.check_triggers_batch(
+                [(c.device_id, c.data) for c in commands if c.device_id is not None]
+            )
+        return [c.id for c in commands]
+
+    def supersede(self, commands):
+        """Deletes pending commands replaced by the newer `commands`: a command
+        whose action is listed in its component's "supersedes" replaces all
+        older pending commands of the same device component. Leased commands
+        are being performed and are kept. Returns the number of deleted rows."""
+        replaced = Q()
+        for command in commands:
+            if (
+                command.device is None
+                or command.self_execute
+                or command.scheduled_at
+                or not isinstance(command.data, dict)
+            ):
+                continue
+            supersedes = command.device.get_component(command.data.get("name")).get(
+                "supersedes"
+            )
+            # a string would match its substrings
+            if not isinstance(supersedes, list) or (
+                command.data.get("action") not in supersedes
+            ):
+                continue
+            replaced |= Q(device=command.device_id, data__name=command.data["name"]) & (
+                Q(released_at__lt=command.released_at)
+                | Q(released_at=command.released_at, id__lt=command.id)
+            )
+        if not replaced:
+            return 0
+
+        return (
+            self.filter(replaced)
+            .filter(executed=False, scheduled_at__isnull=True, self_execute=False)
+            .filter(Q(leased_until__isnull=True) | Q(leased_until__lt=timezone.now()))
+            .delete()[0]
+        )
+
+    def lease_for(self, user, visibility_timeout=None, limit=None):
+        """Atomically leases pending commands to the caller. Leased commands are
+        hidden from other polls until they are acknowledged or the lease expires."""
+        leased_until = timezone.now() + timezone.timedelta(
+            seconds=visibility_timeout or settings.COMMAND_LEASE_TIMEOUT
+        )
+        with transaction.atomic():
+            commands = list(
+                self.pending_for(user).select_for_update(
+                    skip_locked=True, of=("self",)
+                )[:limit]
+            )
+            Command.objects.filter(id__in=[c.id for c in commands]).update(
+                leased_until=leased_until
+            )
+        return commands
+
 
 class Command(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -59,17 +232,137 @@ class Command(models.Model):
     repeat_interval = models.DurationField(null=True, blank=True)
     self_execute = models.BooleanField(default=False)
     executed = models.BooleanField(default=False)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    # copy of device.account: save() sets it whenever the device changes and
+    # database/signals.py updates it when the account of the device changes
+    target_account = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        # looked up through command_pending_account_idx
+        db_index=False,
+    )
+    # undelivered commands are not sent after expires_at, the purge_expired_commands
+    # job deletes them or flags them as expired
+    expires_at = models.DateTimeField(null=True, blank=True)
+    expired = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    # when the command became pending, set again by the scheduler when it
+    # releases a schedule. Orders delivery and decides which command
+    # supersedes which, ids only tell when the rows were created
+    released_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = CommandQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["expires_at"],
+                condition=Q(executed=False, expired=False),
+                name="command_expiry_idx",
+            ),
+            # pending_for(): the other filtered columns are included so that
+            # looking up the pending ids does not need to read the table
+            models.Index(
+                fields=["target_account", "released_at", "id"],
+                include=["leased_until", "expires_at"],
+                condition=Q(executed=False, scheduled_at__isnull=True),
+                name="command_pending_account_idx",
+            ),
+            models.Index(
+                fields=["device", "released_at", "id"],
+                include=["leased_until", "expires_at"],
+                condition=Q(executed=False, scheduled_at__isnull=True),
+                name="command_pending_device_idx",
+            ),
+            # rows moved to CommandHistory by archive_commands
+            models.Index(
+                fields=["created_at"],
+                condition=Q(executed=True) | Q(expired=True),
+                name="command_archivable_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_device_id = instance.__dict__.get("device_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        saves_device = update_fields is None or "device" in update_fields
+        if saves_device and (
+            self._state.adding
+            or self.device_id != getattr(self, "_loaded_device_id", None)
+        ):
+            self.target_account_id = self.device.account_id if self.device else None
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "target_account"}
+        if self._state.adding and not self.scheduled_at:
+            self.apply_device_ttl()
+        super().save(*args, **kwargs)
+        if saves_device:
+            self._loaded_device_id = self.device_id
+
+    def apply_device_ttl(self, now=None):
+        """Sets `expires_at` from the device's `command_ttl` if it is not set."""
+        if self.expires_at is None and self.device and self.device.command_ttl:
+            self.expires_at = (now or timezone.now()) + self.device.command_ttl
 
     def get_next_scheduled_at(self):
         return self.scheduled_at + self.repeat_interval
 
+    def acknowledge(self):
+        CommandsLink.check_triggers(self.device.pk, self.data)
+        self.executed = True
+        self.save()
+
+
+class CommandHistory(models.Model):
+    """Read-only archive of delivered and expired commands.
+
+    The table is partitioned by month of `created_at` with Postgres
+    declarative partitioning and is not managed by Django (see migration
+    0016). Rows are moved here by `manage.py archive_commands`, which also
+    detaches partitions past the retention period.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    author = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    description = models.TextField(null=True, blank=True)
+    data = models.JSONField()
+    self_execute = models.BooleanField()
+    executed = models.BooleanField()
+    expired = models.BooleanField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = "database_commandhistory"
+        verbose_name_plural = "command history"
+
 
 class CommandsLink(models.Model):
     # [{
     #     "device_id": deviceId,
     #     "component_name": componentName,
     #     "action": action,
-    #     "satisfied_at": None,
+    #     "satisfied_at": None,  # kept in LinkTrigger rows, see save()
     # }]
     triggers = models.JSONField()
 
@@ -84,67 +377,283 @@ class CommandsLink(models.Model):
     # }]
     results = models.JSONField()
 
-    def check_all_satisfied(self):
-        all_satisfied = all(
-            trigger.get("satisfied_at") is not None for trigger in self.triggers
-        )
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "triggers" not in update_fields:
+            return super().save(*args, **kwargs)
 
-        if all_satisfied:
-            if self.ttl:
-                first_satisfied = min(
-                    datetime.fromisoformat(trigger["satisfied_at"])
-                    for trigger in self.triggers
-                )
-                last_satisfied = max(
-                    datetime.fromisoformat(trigger["satisfied_at"])
-                    for trigger in self.triggers
-                )
-
-                time_diff = last_satisfied - first_satisfied
-
-                if time_diff <= self.ttl:
-                    self.execute_linked_commands()
-                else:  # TODO keep satisfied triggers that are within the ttl
-                    self.reset_triggers()
-            else:
-                self.execute_linked_commands()
+        # satisfaction state lives in LinkTrigger rows, the JSON only defines the triggers
+        satisfied = [trigger.get("satisfied_at") for trigger in self.triggers]
+        self.triggers = [{**trigger, "satisfied_at": None} for trigger in self.triggers]
+        # a link without its trigger rows would never fire
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.sync_triggers(satisfied)
+
+    def sync_triggers(self, satisfied=None):
+        """Brings the `LinkTrigger` rows in line with `triggers`. The rows are
+        only rebuilt when the trigger definition changed, so saving other
+        fields keeps the satisfaction state. Timestamps given in `satisfied`
+        are applied to the rows."""
+        satisfied = [
+            (
+                datetime.fromisoformat(satisfied_at)
+                if isinstance(satisfied_at, str)
+                else satisfied_at
+            )
+            for satisfied_at in (satisfied or [None] * len(self.triggers))
+        ]
+        rows = list(self.trigger_rows.all())
+        if [(str(row.device_id), row.component_name, row.action) for row in rows] == [
+            (str(trigger["device_id"]), trigger["component_name"], trigger["action"])
+            for trigger in self.triggers
+        ]:
+            changed = []
+            for row, satisfied_at in zip(rows, satisfied):
+                if satisfied_at is not None:
+                    row.satisfied_at = satisfied_at
+                    changed.append(row)
+            LinkTrigger.objects.bulk_update(changed, ["satisfied_at"])
+            return
 
-    def execute_linked_commands(self):
-        for result in self.results:
-            device = Device.objects.get(id=result["device_id"])
-            Command.objects.create(
-                author=device.owner, device=device, data=result["data"]
+        self.trigger_rows.all().delete()
+        LinkTrigger.objects.bulk_create(
+            LinkTrigger(
+                link=self,
+                position=position,
+                device_id=trigger["device_id"],
+                component_name=trigger["component_name"],
+                action=trigger["action"],
+                satisfied_at=satisfied_at,
+            )
+            for position, (trigger, satisfied_at) in enumerate(
+                zip(self.triggers, satisfied)
             )
+        )
+
+    def get_triggers_state(self):
+        rows = {row.position: row for row in self.trigger_rows.all()}
+        return [
+            {
+                **trigger,
+                "satisfied_at": (
+                    f"{rows[position].satisfied_at}"
+                    if position in rows and rows[position].satisfied_at
+                    else None
+                ),
+            }
+            for position, trigger in enumerate(self.triggers)
+        ]
 
-        self.reset_triggers()
+    def create_result_commands(self):
+        # ids may be stored as strings, the serializer checks they are numbers
+        results = [
+            (int(result["device_id"]), result["data"]) for result in self.results
+        ]
+        devices = Device.objects.in_bulk({device_id for device_id, _ in results})
+        commands = [
+            Command(
+                author_id=devices[device_id].owner_id,
+                device=devices[device_id],
+                target_account_id=devices[device_id].account_id,
+                data=data,
+            )
+            for device_id, data in results
+            if device_id in devices
+        ]
+        for command in commands:
+            command.apply_device_ttl()
+        commands = Command.objects.bulk_create(commands)
+        # bulk_create does not send post_save
+        Command.objects.supersede(commands)
+        notify_command_recipients(commands)
+        return commands
 
     def reset_triggers(self):
-        for trigger in self.triggers:
-            trigger["satisfied_at"] = None
-        self.save()
+        self.trigger_rows.update(satisfied_at=None)
 
     @classmethod
     def check_triggers(cls, device_id, data):
-        for cl in CommandsLink.objects.filter(
-            triggers__contains=[
-                {
-                    "device_id": device_id,
-                    "component_name": data["name"],
-                    "action": data["action"],
-                    "satisfied_at": None,
-                }
-            ]
-        ):
-            for t in cl.triggers:
-                if (
-                    t["component_name"] == data["name"]
-                    and t["action"] == data["action"]
-                    and t["device_id"] == device_id
-                    and not t["satisfied_at"]
-                ):
-                    t["satisfied_at"] = f"{timezone.now()}"
-                    cl.save()
-                    break
-            else:
-                continue
-            cl.check_all_satisfied()
+        return cls.check_triggers_batch([(device_id, data)])
+
+    @classmethod
+    def check_triggers_batch(cls, events):
+        """Evaluates `(device_id, data)` events, in order, in one pass.
+
+        With LINK_EVALUATION_QUEUE the events are only recorded in the
+        `LinkEvent` outbox and evaluated later by `run_link_worker`.
+        """
+        if settings.LINK_EVALUATION_QUEUE:
+            LinkEvent.objects.enqueue(events)
+            return []
+        return cls.evaluate_triggers(events)
+
+    @classmethod
+    def evaluate_triggers(cls, events):
+        """Evaluates events right away. An event may carry the timestamp it
+        happened at as a third item, `(device_id, data, timestamp)`."""
+        from ..rules import evaluate_stored, rule_engine
+
+        if settings.COMMANDS_LINK_ENGINE == "memory":
+            return rule_engine.evaluate_many(events)
+        return evaluate_stored(events)
+
+
+class LinkTrigger(models.Model):
+    """Indexed copy of one entry of `CommandsLink.triggers` with its satisfaction state."""
+
+    link = models.ForeignKey(
+        CommandsLink, on_delete=models.CASCADE, related_name="trigger_rows"
+    )
+    position = models.PositiveIntegerField()
+
+    device_id = models.BigIntegerField()
+    component_name = models.TextField()
+    action = models.TextField()
+    satisfied_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["position"]
+        indexes = [
+            models.Index(
+                fields=["device_id", "component_name", "action"],
+                name="linktrigger_event_idx",
+            )
+        ]
+
+
+class LinkEventQuerySet(models.QuerySet):
+    def enqueue(self, events):
+        events = self.bulk_create(
+            LinkEvent(
+                partition=device_id % settings.LINK_EVENT_PARTITIONS,
+                device_id=device_id,
+                data=data,
+            )
+            for device_id, data in events
+        )
+        if events:
+            transaction.on_commit(lambda: command_notifier.notify([LINK_EVENTS_KEY]))
+        return events
+
+    def stats(self):
+        """Queue depth and lag (age of the oldest waiting event, in seconds)."""
+        stats = self.aggregate(depth=Count("id"), oldest=Min("created_at"))
+        oldest = stats.pop("oldest")
+        stats["lag"] = (
+            (timezone.now() - oldest).total_seconds() if oldest is not None else 0
+        )
+        return stats
+
+
+class LinkEvent(models.Model):
+    """Outbox of device events waiting for `CommandsLink` evaluation.
+
+    Events of one device always land in the same partition, which is
+    processed by one worker at a time in id order (see database/link_worker.py).
+    """
+
+    partition = models.PositiveSmallIntegerField()
+    device_id = models.BigIntegerField()
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LinkEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["partition", "id"], name="linkevent_partition_idx")
+        ]
+
+
+class DeviceEventQuerySet(models.QuerySet):
+    def record(self, device, events):
+        """Stores input events of `device` with one multi-row INSERT and
+        feeds them to the `CommandsLink` triggers."""
+        with transaction.atomic():
+            events = self.bulk_create(
+                DeviceEvent(device=device, data=data) for data in events
+            )
+            CommandsLink.check_triggers_batch(
+                [(device.pk, event.data) for event in events]
+            )
+        return events
+
+
+class DeviceEvent(models.Model):
+    """Append-only log of input events reported by devices.
+
+    Kept apart from `Command`, so reporting an input never grows the table
+    the pending-command polls read. Rows are only ever appended in time
+    order, so `created_at` is indexed with a small BRIN index.
+    """
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="events")
+
+    # {"name": componentName, "action": action}
+    data = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = DeviceEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [BrinIndex(fields=["created_at"], name="deviceevent_created_brin")]
+
+
+def estimate_tokens(text):
+    # rough estimate for English and JSON text, about 4 characters per token
+    return (len(text) + 3) // 4
+
+
+class Conversation(models.Model):
+    """A chat with the LLM kept on the server, so clients send only the new
+    message of each turn.
+
+    Messages older than `summarized_until` are folded into `summary` and no
+    longer sent to the model (see homelink/conversations.py).
+    """
+
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="conversations"
+    )
+    title = models.CharField(max_length=255, blank=True)
+    summary = models.TextField(blank=True)
+    summarized_until = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.title or f"Conversation {self.pk}"
+
+    def add_message(self, role, content):
+        message = self.messages.create(role=role, content=content)
+        if not self.title and role == ConversationMessage.USER:
+            self.title = content[:60]
+        self.save(update_fields=["title", "updated_at"])
+        return message
+
+
+class ConversationMessage(models.Model):
+    USER = "user"
+    ASSISTANT = "assistant"
+    ROLES = [(USER, "User"), (ASSISTANT, "Assistant")]
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="messages"
+    )
+    role = models.CharField(max_length=16, choices=ROLES)
+    content = models.TextField()
+    tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["conversation", "id"], name="conversation_message_idx")
+        ]
+
+    def save(self, *args, **kwargs):
+        self.tokens = estimate_tokens(self.content)
+        super().save(*args, **kwargs)
+
+    def to_prompt(self):
+        return {"role": self.role, "content": self.content}
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "homelink_commands"
+
+
+SCHEDULER_KEY = "scheduler"
+LINK_EVENTS_KEY = "link_events"
+
+
+LINK_KEY_PREFIX = "link:"
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+def link_key(link_id):
+    return f"{LINK_KEY_PREFIX}{link_id}"
+
+
+class AsyncWaiter:
+    """`threading.Event`-like waiter for coroutines, safe to `set()` from any thread."""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    def clear(self):
+        self._event.clear()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class CommandNotifier:
+    """Wakes up waiting device pollers when commands for them are created.
+
+    Waiters subscribe to keys (see `user_key`). On PostgreSQL the keys are
+    published with NOTIFY, so pollers served by other processes are woken too;
+    every process runs one LISTEN thread that dispatches to its local waiters.
+    On other databases the wakeup stays within the current process.
+    """
+
+    # seconds before the LISTEN connection is retried, doubled after each failure
+    reconnect_delay = 1
+    max_reconnect_delay = 30
+
+    def __init__(self, channel=CHANNEL):
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._handlers = {}
+        self._connected = threading.Event()
+        self._listener = None
+
+    @contextmanager
+    def listen(self, keys, waiter=None):
+        """Subscribes `waiter` (anything with a `set()` method, a fresh
+        `threading.Event` by default) to `keys` for the duration of the block."""
+        waiter = waiter if waiter is not None else threading.Event()
+        with self._lock:
+            for key in keys:
+                self._waiters.setdefault(key, set()).add(waiter)
+        self._ensure_listener()
+        try:
+            yield waiter
+        finally:
+            with self._lock:
+                for key in keys:
+                    waiters = self._waiters.get(key)
+                    if waiters is None:
+                        continue
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[key]
+
+    def subscribe(self, prefix, callback):
+        """Calls `callback(key)` for every notified key that starts with
+        `prefix`, and `callback(None)` when the listener (re)connects, as
+        notifications may have been missed. Callbacks run on the listener
+        thread and must not block."""
+        with self._lock:
+            self._handlers.setdefault(prefix, set()).add(callback)
+        self._ensure_listener()
+
+    def wait_connected(self, timeout):
+        """Waits until the listener receives notifications sent from now on."""
+        if not self._uses_postgres():
+            return True
+        self._ensure_listener()
+        return self._connected.wait(timeout)
+
+    def wait(self, keys, timeout):
+        with self.listen(keys) as event:
+            return event.wait(timeout)
+
+    def notify(self, keys):
+        keys = [key for key in keys if key]
+        if not keys:
+            return
+        if self._uses_postgres():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_notify(%s, %s)", [self.channel, ",".join(keys)]
+                )
+        else:
+            self.dispatch(keys)
+
+    def dispatch(self, keys):
+        with self._lock:
+            waiters = set()
+            handled = []
+            for key in keys:
+                waiters.update(self._waiters.get(key, ()))
+                for prefix, callbacks in self._handlers.items():
+                    if key.startswith(prefix):
+                        handled.extend((callback, key) for callback in callbacks)
+        for waiter in waiters:
+            waiter.set()
+        for callback, key in handled:
+            callback(key)
+
+    def _uses_postgres(self):
+        return connection.vendor == "postgresql"
+
+    def _ensure_listener(self):
+        if self._listener is not None or not self._uses_postgres():
+            return
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(
+                target=self._listen_forever,
+                args=(connection.get_connection_params(),),
+                name="command-notifier",
+                daemon=True,
+            )
+            self._listener.start()
+
+    def _connect(self, params):
+        conn = psycopg2.connect(**params)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    def _listen_forever(self, params):
+        # any error reconnects, the thread must outlive it or wakeups stop
+        delay = self.reconnect_delay
+        while True:
+            conn = None
+            try:
+                conn = self._connect(params)
+                delay = self.reconnect_delay
+                # notifications may have been missed while (re)connecting
+                with self._lock:
+                    keys = list(self._waiters)
+                    callbacks = [
+                        callback
+                        for callbacks in self._handlers.values()
+                        for callback in callbacks
+                    ]
+                self.dispatch(keys)
+                for callback in callbacks:
+                    callback(None)
+                self._connected.set()
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(conn.notifies.pop(0).payload.split(","))
+            except Exception:
+                self._connected.clear()
+                logger.exception(
+                    "Command notifier listener failed, reconnecting in %s s", delay
+                )
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+command_notifier = CommandNotifier()
+
+
+def notify_command_recipients(commands):
+    """Wakes the pollers of the devices `commands` are for once the current
+    transaction commits. Used by the post_save hook and by bulk inserts,
+    which do not send signals."""
+    keys = set()
+    for command in commands:
+        if command.device is None or command.executed or command.self_execute:
+            continue
+        keys.add(user_key(command.device.owner_id))
+        keys.add(user_key(command.device.account_id))
+    keys.discard(user_key(None))
+    if keys:
+        transaction.on_commit(lambda: command_notifier.notify(sorted(keys)))
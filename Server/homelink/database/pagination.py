@@ -0,0 +1,41 @@
+from rest_framework import exceptions
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Opt-in keyset pagination, newest first.
+
+    Requests without `cursor`, `page_size` or `since` keep getting the full
+    list. Otherwise the response is a page of `results` with `next` and
+    `previous` links. The pages are selected with `id < last seen id`, so a
+    deep page costs the same as the first one. `since=<id>` limits the
+    results to rows newer than an id the client already has.
+    """
+
+    ordering = "-id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    since_query_param = "since"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if not any(
+            param in params
+            for param in (
+                self.cursor_query_param,
+                self.page_size_query_param,
+                self.since_query_param,
+            )
+        ):
+            return None
+
+        if params.get(self.since_query_param):
+            try:
+                since = int(params[self.since_query_param])
+            except ValueError:
+                raise exceptions.ValidationError(
+                    {self.since_query_param: "Must be an id."}
+                )
+            queryset = queryset.filter(id__gt=since)
+        return super().paginate_queryset(queryset, request, view)
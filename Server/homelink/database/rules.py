@@ -0,0 +1,293 @@
+import operator
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models.models import CommandsLink, LinkTrigger
+from .notifications import LINK_KEY_PREFIX, command_notifier
+
+
+def event_key(device_id, component_name, action):
+    return (int(device_id), component_name, action)
+
+
+class LinkRule:
+    """Compiled `CommandsLink`: trigger keys by position and the time each
+    trigger was satisfied (`None` while waiting)."""
+
+    __slots__ = ("link", "keys", "ttl", "satisfied")
+
+    def __init__(self, link):
+        self.link = link
+        self.keys = [
+            event_key(t["device_id"], t["component_name"], t["action"])
+            for t in link.triggers
+        ]
+        self.ttl = link.ttl.total_seconds() if link.ttl else None
+        self.satisfied = [None] * len(self.keys)
+
+    def is_waiting(self, position, now):
+        satisfied_at = self.satisfied[position]
+        return satisfied_at is None or (
+            self.ttl is not None and satisfied_at < now - self.ttl
+        )
+
+    def satisfy(self, position, now):
+        """Marks the trigger as satisfied and returns whether the link fires."""
+        self.satisfied[position] = now
+        if any(satisfied_at is None for satisfied_at in self.satisfied):
+            return False
+
+        if (
+            self.ttl is not None
+            and max(self.satisfied) - min(self.satisfied) > self.ttl
+        ):
+            # slide the window: keep triggers within ttl of the newest one
+            cutoff = max(self.satisfied) - self.ttl
+            self.satisfied = [
+                satisfied_at if satisfied_at >= cutoff else None
+                for satisfied_at in self.satisfied
+            ]
+            return False
+
+        self.satisfied = [None] * len(self.keys)
+        return True
+
+
+class RuleEngine:
+    """In-process dispatch index over all `CommandsLink` rows.
+
+    Links are compiled once into a mapping of event key -> (link, trigger
+    position), so evaluating an event only touches the triggers it matches
+    and the database is used only to create the commands of a link that
+    fires. Saved or deleted links are recompiled individually: the saving
+    process right away, the others when the `link:<id>` notification sent
+    by the signals arrives (they reload the link before their next
+    evaluation). The trigger state is kept in memory only, so links should
+    be evaluated by a single process (COMMANDS_LINK_ENGINE = "memory").
+    """
+
+    # seconds load() waits for the notification listener, so that no change
+    # of a link made after the links were read is missed
+    listen_timeout = 5
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rules = None
+        self._index = {}
+        self._subscribed = False
+        self._stale = set()
+        self._stale_all = False
+
+    def clear(self):
+        with self._lock:
+            self._rules = None
+            self._index = {}
+
+    def load(self):
+        self._subscribe()
+        with self._lock:
+            self._load()
+
+    def reload_link(self, link):
+        with self._lock:
+            if self._rules is not None:
+                self._reload(link)
+
+    def remove_link(self, link_id):
+        with self._lock:
+            if self._rules is not None:
+                self._remove(link_id)
+
+    def evaluate(self, device_id, data, now=None):
+        return self.evaluate_many([(device_id, data)], now)
+
+    def evaluate_many(self, events, now=None):
+        """Runs `(device_id, data)` or `(device_id, data, timestamp)` events
+        in order and creates the result commands of the links that fired."""
+        if self._rules is None:
+            self.load()
+        with self._lock:
+            self._refresh()
+            fired = self._dispatch(events, time.time() if now is None else now)
+
+        fire_links(fired)
+        return fired
+
+    def _dispatch(self, events, now):
+        fired = []
+        for device_id, data, *occurred_at in events:
+            at = occurred_at[0] if occurred_at else now
+            matched = set()
+            key = event_key(device_id, data["name"], data["action"])
+            for link_id, position in self._index.get(key, ()):
+                rule = self._rules[link_id]
+                # one event satisfies at most one trigger per link
+                if link_id in matched or not rule.is_waiting(position, at):
+                    continue
+                matched.add(link_id)
+                if rule.satisfy(position, at):
+                    fired.append(rule.link)
+        return fired
+
+    def _subscribe(self):
+        # outside of the lock, the listener thread takes it to mark links stale
+        if not self._subscribed:
+            self._subscribed = True
+            command_notifier.subscribe(LINK_KEY_PREFIX, self._link_changed)
+        command_notifier.wait_connected(self.listen_timeout)
+
+    def _link_changed(self, key):
+        with self._lock:
+            if self._rules is None:
+                return
+            if key is None:
+                self._stale_all = True
+            else:
+                self._stale.add(int(key.removeprefix(LINK_KEY_PREFIX)))
+
+    def _load(self):
+        self._rules = {}
+        self._index = {}
+        self._stale = set()
+        self._stale_all = False
+        for link in CommandsLink.objects.all():
+            self._add(LinkRule(link))
+
+    def _refresh(self):
+        """Reloads the links changed by other processes, keeping the state
+        of triggers that did not change."""
+        if self._rules is None:
+            self._load()
+            return
+        if not self._stale and not self._stale_all:
+            return
+
+        links = CommandsLink.objects.all()
+        if self._stale_all:
+            stale = set(self._rules)
+        else:
+            stale = self._stale
+            links = links.filter(pk__in=stale)
+        links = {link.pk: link for link in links}
+        self._stale = set()
+        self._stale_all = False
+        for link_id in stale - set(links):
+            self._remove(link_id)
+        for link in links.values():
+            self._reload(link)
+
+    def _reload(self, link):
+        previous = self._remove(link.pk)
+        rule = LinkRule(link)
+        if previous is not None and previous.keys == rule.keys:
+            rule.satisfied = previous.satisfied
+        self._add(rule)
+
+    def _add(self, rule):
+        self._rules[rule.link.pk] = rule
+        for position, key in enumerate(rule.keys):
+            self._index.setdefault(key, []).append((rule.link.pk, position))
+
+    def _remove(self, link_id):
+        rule = self._rules.pop(link_id, None)
+        if rule is None:
+            return None
+        for key in set(rule.keys):
+            slots = [slot for slot in self._index[key] if slot[0] != link_id]
+            if slots:
+                self._index[key] = slots
+            else:
+                del self._index[key]
+        return rule
+
+
+def fire_links(links):
+    for link in links:
+        with transaction.atomic():
+            link.create_result_commands()
+
+
+def evaluate_stored(events, now=None):
+    """Evaluates events against the trigger state stored in `LinkTrigger`
+    rows (COMMANDS_LINK_ENGINE = "db").
+
+    Only the links the events can match are loaded, with one query on the
+    indexed trigger table, and compiled into a throwaway `RuleEngine`. The
+    whole batch is evaluated in memory, then the changed trigger rows are
+    written back with a single `bulk_update`. The links and their trigger
+    rows stay locked until the transaction ends.
+    """
+    keys = {
+        event_key(device_id, data["name"], data["action"])
+        for device_id, data, *_ in events
+    }
+    if not keys:
+        return []
+
+    matching = reduce(
+        operator.or_,
+        (
+            Q(device_id=device_id, component_name=component_name, action=action)
+            for device_id, component_name, action in keys
+        ),
+    )
+
+    with transaction.atomic(savepoint=False):
+        # other API or link workers may evaluate the same links concurrently:
+        # lock them, in id order, before reading their trigger state so no
+        # update of satisfied_at is lost
+        links = list(
+            CommandsLink.objects.filter(
+                id__in=LinkTrigger.objects.filter(matching).values("link_id")
+            )
+            .select_for_update()
+            .order_by("id")
+        )
+        if not links:
+            return []
+        rows = {link.pk: [] for link in links}
+        for row in (
+            LinkTrigger.objects.filter(link__in=links)
+            .select_for_update()
+            .order_by("link_id", "position")
+        ):
+            rows[row.link_id].append(row)
+
+        engine = RuleEngine()
+        engine._rules = {}
+        for link in links:
+            rule = LinkRule(link)
+            rule.satisfied = [
+                row.satisfied_at.timestamp() if row.satisfied_at else None
+                for row in rows[link.pk]
+            ]
+            engine._add(rule)
+
+        fired = engine._dispatch(
+            events, timezone.now().timestamp() if now is None else now
+        )
+
+        changed = []
+        for link_id, rule in engine._rules.items():
+            for row, satisfied_at in zip(rows[link_id], rule.satisfied):
+                previous = row.satisfied_at.timestamp() if row.satisfied_at else None
+                if previous != satisfied_at:
+                    row.satisfied_at = (
+                        datetime.fromtimestamp(satisfied_at, tz=dt_timezone.utc)
+                        if satisfied_at is not None
+                        else None
+                    )
+                    changed.append(row)
+        LinkTrigger.objects.bulk_update(changed, ["satisfied_at"])
+
+        fire_links(fired)
+    return fired
+
+
+rule_engine = RuleEngine()
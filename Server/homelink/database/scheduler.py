@@ -0,0 +1,105 @@
+import heapq
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models.models import Command
+from .notifications import SCHEDULER_KEY, command_notifier, notify_command_recipients
+
+logger = logging.getLogger(__name__)
+
+
+class CommandScheduler:
+    """Materializes scheduled commands when they are due.
+
+    A command with `scheduled_at` is a schedule. Only schedules due within
+    `horizon` are kept in a heap ordered by fire time; they are loaded with a
+    range query on the `scheduled_at` index, so the rest of the table is never
+    scanned. When a schedule fires, a one-off command becomes a regular
+    pending command and a repeating one creates an occurrence and is re-armed
+    at its next time. Either way the target device is woken up.
+    """
+
+    def __init__(self, horizon=timezone.timedelta(minutes=10)):
+        self.horizon = horizon
+        self.heap = []
+        self.loaded_until = None
+
+    def load(self, now):
+        self.loaded_until = now + self.horizon
+        self.heap = [
+            (scheduled_at, command_id)
+            for command_id, scheduled_at in Command.objects.filter(
+                executed=False,
+                scheduled_at__isnull=False,
+                scheduled_at__lt=self.loaded_until,
+            ).values_list("id", "scheduled_at")
+        ]
+        heapq.heapify(self.heap)
+
+    def run_due(self, now):
+        fired = 0
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, command_id = heapq.heappop(self.heap)
+            if self.fire(command_id, fire_at, now):
+                fired += 1
+        return fired
+
+    def fire(self, command_id, fire_at, now):
+        with transaction.atomic():
+            command = (
+                Command.objects.select_for_update(skip_locked=True, of=("self",))
+                .select_related("device")
+                .filter(pk=command_id, executed=False, scheduled_at=fire_at)
+                .first()
+            )
+            # deleted, rescheduled or handled by another scheduler in the meantime
+            if command is None:
+                return False
+
+            if command.repeat_interval and command.repeat_interval.total_seconds() > 0:
+                Command.objects.create(
+                    author_id=command.author_id,
+                    device=command.device,
+                    description=command.description,
+                    data=command.data,
+                )
+                # occurrences missed while the scheduler was down are skipped
+                while command.scheduled_at <= now:
+                    command.scheduled_at = command.get_next_scheduled_at()
+                command.save(update_fields=["scheduled_at"])
+                if command.scheduled_at < self.loaded_until:
+                    heapq.heappush(self.heap, (command.scheduled_at, command.pk))
+            else:
+                command.scheduled_at = None
+                # delivered and superseded as a command created now, and the
+                # ttl of a schedule counts from the time it is released
+                command.released_at = now
+                command.apply_device_ttl(now)
+                command.save(
+                    update_fields=["scheduled_at", "released_at", "expires_at"]
+                )
+                Command.objects.supersede([command])
+                notify_command_recipients([command])
+        return True
+
+    def run_forever(self):
+        with command_notifier.listen([SCHEDULER_KEY]) as woken:
+            self.load(timezone.now())
+            while True:
+                now = timezone.now()
+                if now >= self.loaded_until:
+                    self.load(now)
+                fired = self.run_due(now)
+                if fired:
+                    logger.info("Fired %d scheduled commands", fired)
+
+                next_at = self.loaded_until
+                if self.heap:
+                    next_at = min(next_at, self.heap[0][0])
+                timeout = max((next_at - timezone.now()).total_seconds(), 0)
+                if woken.wait(timeout):
+                    # new schedules were created
+                    woken.clear()
+                    self.load(timezone.now())
@@ -55,6 +55,7 @@ class DeviceSerializer(serializers.ModelSerializer):
             "owner",
             "data",
             "account",
+            "command_ttl",
         ]
 
 
@@ -73,6 +74,31 @@ class CommandSerializer(serializers.ModelSerializer):
             "data",
             "self_execute",
             "executed",
+            "expires_at",
+            "expired",
+            "created_at",
+            "device__name",
+        ]
+        read_only_fields = ["expired", "created_at"]
+
+
+class CommandHistorySerializer(serializers.ModelSerializer):
+    device__name = serializers.CharField(
+        source="device.name", allow_null=True, required=False
+    )
+
+    class Meta:
+        model = CommandHistory
+        fields = [
+            "id",
+            "description",
+            "device",
+            "data",
+            "self_execute",
+            "executed",
+            "expired",
+            "created_at",
+            "archived_at",
             "device__name",
         ]
 
@@ -83,7 +109,66 @@ class CommandForDeviceSerializer(serializers.ModelSerializer):
         fields = ["id", "data"]
 
 
+class DeviceEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeviceEvent
+        fields = ["id", "device", "data", "created_at"]
+        read_only_fields = ["created_at"]
+        extra_kwargs = {"device": {"required": False}}
+
+    def validate_data(self, value):
+        if not isinstance(value, dict) or not {"name", "action"} <= value.keys():
+            raise serializers.ValidationError("data must contain name and action")
+        return {"name": value["name"], "action": value["action"]}
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = ["id", "title", "summary", "created_at", "updated_at"]
+        read_only_fields = ["summary", "created_at", "updated_at"]
+
+
+class ConversationMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ConversationMessage
+        fields = ["id", "role", "content", "tokens", "created_at"]
+        read_only_fields = ["role", "tokens", "created_at"]
+
+
+def validate_device_ids(entries):
+    """Checks link triggers or results and turns their device ids into numbers."""
+    if not isinstance(entries, list) or not all(
+        isinstance(entry, dict) for entry in entries
+    ):
+        raise serializers.ValidationError("Must be a list of objects")
+    try:
+        return [{**entry, "device_id": int(entry["device_id"])} for entry in entries]
+    except (KeyError, TypeError, ValueError):
+        raise serializers.ValidationError("device_id must be a device id")
+
+
 class CommandsLinkSerializer(serializers.ModelSerializer):
     class Meta:
         model = CommandsLink
         fields = ["id", "triggers", "results", "ttl", "owner"]
+
+    def validate_triggers(self, value):
+        triggers = validate_device_ids(value)
+        for trigger in triggers:
+            if not all(
+                isinstance(trigger.get(field), str) and trigger[field]
+                for field in ("component_name", "action")
+            ):
+                raise serializers.ValidationError(
+                    "Each trigger needs a component_name and an action"
+                )
+        return triggers
+
+    def validate_results(self, value):
+        return validate_device_ids(value)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["triggers"] = instance.get_triggers_state()
+        return data
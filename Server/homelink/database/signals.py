@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .access import device_access_cache, refresh_device_access
+from .catalog import catalog_cache
+from .debounce import event_debouncer
+from .models.models import Command, CommandsLink, Device, DeviceAccess, Space
+from .notifications import (
+    SCHEDULER_KEY,
+    command_notifier,
+    link_key,
+    notify_command_recipients,
+)
+from .rules import rule_engine
+
+
+@receiver(post_save, sender=Command)
+def command_post_save(sender, instance, created, **kwargs):
+    if created and instance.self_execute:
+        instance.acknowledge()
+
+
+@receiver(post_save, sender=Command)
+def supersede_pending_commands(sender, instance, created, **kwargs):
+    if created:
+        Command.objects.supersede([instance])
+
+
+@receiver(post_save, sender=Command)
+def wake_command_pollers(sender, instance, created, **kwargs):
+    if created and not instance.scheduled_at:
+        notify_command_recipients([instance])
+
+
+@receiver(post_save, sender=Command)
+def wake_scheduler(sender, instance, created, update_fields=None, **kwargs):
+    # the scheduler itself saves with update_fields and does not need to be woken
+    if instance.scheduled_at and not instance.executed and update_fields is None:
+        transaction.on_commit(lambda: command_notifier.notify([SCHEDULER_KEY]))
+
+
+@receiver(post_save, sender=CommandsLink)
+def recompile_saved_link(sender, instance, **kwargs):
+    transaction.on_commit(lambda: rule_engine.reload_link(instance))
+    notify_link_changed(instance.pk)
+
+
+@receiver(post_delete, sender=CommandsLink)
+def drop_deleted_link(sender, instance, **kwargs):
+    link_id = instance.pk
+    transaction.on_commit(lambda: rule_engine.remove_link(link_id))
+    notify_link_changed(link_id)
+
+
+def notify_link_changed(link_id):
+    # the other processes evaluating links in memory reload it
+    if settings.COMMANDS_LINK_ENGINE == "memory":
+        transaction.on_commit(lambda: command_notifier.notify([link_key(link_id)]))
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def forget_debounce_windows(sender, instance, **kwargs):
+    event_debouncer.forget_device(instance.pk)
+
+
+@receiver(post_save, sender=Device)
+def sync_command_target_account(sender, instance, created, **kwargs):
+    if not created:
+        Command.objects.filter(device=instance, executed=False).exclude(
+            target_account=instance.account_id
+        ).update(target_account=instance.account_id)
+
+
+@receiver(pre_delete, sender=Device)
+def drop_command_target_account(sender, instance, **kwargs):
+    # the commands are kept without a device and must not reach the account
+    Command.objects.filter(device=instance).update(target_account=None)
+
+
+@receiver(post_save, sender=Device)
+def refresh_access_of_saved_device(sender, instance, **kwargs):
+    refresh_device_access([instance.pk])
+    # catalogs are rebuilt when the access set changes, not when a device is edited
+    catalog_cache.invalidate(
+        DeviceAccess.objects.filter(device=instance).values_list("user_id", flat=True)
+    )
+
+
+@receiver(pre_delete, sender=Device)
+def forget_access_of_deleted_device(sender, instance, **kwargs):
+    # the DeviceAccess rows are removed by the cascade
+    device_access_cache.invalidate(
+        DeviceAccess.objects.filter(device=instance).values_list("user_id", flat=True)
+    )
+
+
+@receiver(m2m_changed, sender=Space.users.through)
+def refresh_access_of_space_devices(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        devices = Device.objects.filter(space=instance)
+    elif pk_set:
+        devices = Device.objects.filter(space__in=pk_set)
+    else:
+        # user.spaces.clear() can only take away devices the user has now
+        devices = Device.objects.filter(access__user=instance)
+    refresh_device_access(devices.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Space)
+def remember_space_devices(sender, instance, **kwargs):
+    # Device.space is cleared with an UPDATE that sends no post_save
+    instance._device_ids = list(instance.device_set.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Space)
+def refresh_access_of_deleted_space(sender, instance, **kwargs):
+    refresh_device_access(getattr(instance, "_device_ids", []))
@@ -0,0 +1,142 @@
+import asyncio
+import io
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+from .async_views import authenticate
+from .debounce import event_debouncer
+from .models.models import Command, DeviceEvent
+from .notifications import AsyncWaiter, command_notifier, user_key
+from .serializers import CommandForDeviceSerializer
+
+# Messages sent by the server:
+#   {"type": "commands", "commands": [{"id": commandId, "data": {...}}]}
+#   {"type": "acked", "ids": [commandId, ...]}
+#   {"type": "event_accepted", "id": eventId}
+#   {"type": "event_debounced"}
+#   {"type": "error", "error": message}
+# Messages accepted from the client:
+#   {"type": "ack", "ids": [commandId, ...]}
+#   {"type": "event", "data": {"name": componentName, "action": action}}
+
+
+def _request_from_scope(scope):
+    headers = list(scope.get("headers", []))
+    token = parse_qs(scope.get("query_string", b"").decode()).get("token")
+    if token:
+        headers.append((b"authorization", f"Token {token[0]}".encode()))
+    return ASGIRequest({**scope, "method": "GET", "headers": headers}, io.BytesIO())
+
+
+def _pending_commands(user, sent_ids):
+    commands = Command.objects.pending_for(user).exclude(id__in=sent_ids)
+    return CommandForDeviceSerializer(commands, many=True).data
+
+
+def _acknowledge(user, ids):
+    return Command.objects.for_user(user).filter(id__in=ids).acknowledge()
+
+
+def _create_event(user, data):
+    device = user.account_devices.first()
+    if device is None:
+        raise ValueError("No device is registered for this account")
+    data = {"name": data["name"], "action": data["action"]}
+    if not event_debouncer.accept(device.pk, data):
+        return None
+    (event,) = DeviceEvent.objects.record(device, [data])
+    return event.id
+
+
+class CommandSocket:
+    """Bidirectional channel for devices and clients at `/ws/commands/`.
+
+    New commands are pushed the moment they are saved (same notifier as the
+    long-poll endpoints) and the client acknowledges them and reports input
+    events on the same connection. Authentication uses the same credentials
+    as the REST API, sent as an `Authorization` header or a `?token=` query.
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.sent_ids = set()
+
+    async def send_json(self, message):
+        await self.send({"type": "websocket.send", "text": json.dumps(message)})
+
+    async def run(self):
+        if (await self.receive())["type"] != "websocket.connect":
+            return
+        await sync_to_async(close_old_connections)()
+        try:
+            user = await authenticate(_request_from_scope(self.scope))
+            if user is None:
+                await self.send({"type": "websocket.close", "code": 4401})
+                return
+            await self.send({"type": "websocket.accept"})
+            await self.serve(user)
+        finally:
+            await sync_to_async(close_old_connections)()
+
+    async def serve(self, user):
+        with command_notifier.listen([user_key(user.pk)], AsyncWaiter()) as woken:
+            await self.push_pending(user)
+            receiving = asyncio.ensure_future(self.receive())
+            waking = asyncio.ensure_future(woken.wait())
+            try:
+                while True:
+                    done, _ = await asyncio.wait(
+                        {receiving, waking}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if waking in done:
+                        woken.clear()
+                        await self.push_pending(user)
+                        waking = asyncio.ensure_future(woken.wait())
+                    if receiving in done:
+                        message = receiving.result()
+                        if message["type"] == "websocket.disconnect":
+                            return
+                        await self.handle(user, message)
+                        receiving = asyncio.ensure_future(self.receive())
+            finally:
+                receiving.cancel()
+                waking.cancel()
+
+    async def push_pending(self, user):
+        commands = await sync_to_async(_pending_commands)(user, self.sent_ids)
+        if commands:
+            self.sent_ids.update(command["id"] for command in commands)
+            await self.send_json({"type": "commands", "commands": commands})
+
+    async def handle(self, user, message):
+        try:
+            payload = json.loads(message.get("text") or message.get("bytes") or "")
+            if payload["type"] == "ack":
+                acked = await sync_to_async(_acknowledge)(user, payload["ids"])
+                self.sent_ids.difference_update(acked)
+                await self.send_json({"type": "acked", "ids": acked})
+            elif payload["type"] == "event":
+                event_id = await sync_to_async(_create_event)(user, payload["data"])
+                if event_id is None:
+                    await self.send_json({"type": "event_debounced"})
+                else:
+                    await self.send_json({"type": "event_accepted", "id": event_id})
+            else:
+                await self.send_json(
+                    {
+                        "type": "error",
+                        "error": f"Unknown message type {payload['type']}",
+                    }
+                )
+        except (ValueError, KeyError, TypeError) as e:
+            await self.send_json({"type": "error", "error": str(e)})
+
+
+async def command_socket(scope, receive, send):
+    await CommandSocket(scope, receive, send).run()
@@ -0,0 +1,98 @@
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from ..access import CACHE_PREFIX, device_access_cache
+from ..models.models import Device, DeviceAccess, Space
+
+User = get_user_model()
+
+FILE_CACHE = "django.core.cache.backends.filebased.FileBasedCache"
+
+
+class DeviceAccessTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.guest = User.objects.create_user(username="guest", password="password")
+        self.space = Space.objects.create(name="Home", owner=self.owner)
+        self.space.users.add(self.owner)
+        self.device = Device.objects.create(
+            name="Pico", owner=self.owner, space=self.space
+        )
+
+    def accessible(self, user):
+        return set(device_access_cache.device_ids(user.pk))
+
+    def test_owner_and_space_users_have_access(self):
+        self.assertEqual(self.accessible(self.owner), {self.device.id})
+        self.assertEqual(self.accessible(self.guest), set())
+
+        self.space.users.add(self.guest)
+        self.assertEqual(self.accessible(self.guest), {self.device.id})
+
+        self.space.users.remove(self.guest)
+        self.assertEqual(self.accessible(self.guest), set())
+
+    def test_reverse_membership_changes_are_tracked(self):
+        self.guest.spaces.add(self.space)
+        self.assertEqual(self.accessible(self.guest), {self.device.id})
+
+        self.guest.spaces.clear()
+        self.assertEqual(self.accessible(self.guest), set())
+
+    def test_moving_and_deleting_devices(self):
+        self.space.users.add(self.guest)
+        self.device.space = None
+        self.device.save()
+        self.assertEqual(self.accessible(self.guest), set())
+
+        self.device.delete()
+        self.assertEqual(self.accessible(self.owner), set())
+
+    def test_deleting_space_revokes_access(self):
+        self.space.users.add(self.guest)
+
+        self.space.delete()
+
+        self.assertEqual(self.accessible(self.guest), set())
+        self.assertEqual(self.accessible(self.owner), {self.device.id})
+
+    def test_cached_lookup_does_not_query(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={"default": {"BACKEND": FILE_CACHE, "LOCATION": location}}
+        ):
+            self.accessible(self.owner)
+            device_access_cache.clear()
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self.accessible(self.owner), {self.device.id})
+
+    def test_process_local_cache_is_not_trusted_past_ttl(self):
+        self.space.users.add(self.guest)
+        # the copy kept by a process that did not see the change
+        cache.set(f"{CACHE_PREFIX}{self.guest.pk}", [], 300)
+        device_access_cache.clear()
+
+        self.assertEqual(self.accessible(self.guest), {self.device.id})
+
+    def test_listings_use_access_set(self):
+        other = Device.objects.create(name="Lamp", owner=self.guest)
+        self.space.users.add(self.guest)
+        client = APIClient()
+        client.force_authenticate(self.guest)
+
+        response = client.get("/api/devices/")
+
+        self.assertEqual(
+            sorted(device["id"] for device in response.data),
+            sorted([self.device.id, other.id]),
+        )
+        self.assertEqual(
+            self.guest.get_user_devices(),
+            sorted([self.device, other], key=lambda device: device.id),
+        )
+        self.assertEqual(DeviceAccess.objects.filter(user=self.guest).count(), 2)
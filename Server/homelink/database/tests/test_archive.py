@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..archive import (
+    archive_commands,
+    expire_partitions,
+    history_partitions,
+    months_before,
+)
+from ..models.models import Device, Command, CommandHistory
+
+User = get_user_model()
+
+
+class CommandArchiveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.device = Device.objects.create(name="Pico", owner=self.user)
+        self.now = timezone.now()
+
+    def command(self, age, **kwargs):
+        return Command.objects.create(
+            author=self.user,
+            device=self.device,
+            data={"name": "LED", "action": "on"},
+            created_at=self.now - age,
+            **kwargs,
+        )
+
+    def test_old_delivered_commands_are_moved_to_history(self):
+        old = [self.command(timedelta(days=days), executed=True) for days in [40, 70]]
+        dead_letter = self.command(timedelta(days=40), expired=True)
+        recent = self.command(timedelta(days=1), executed=True)
+        pending = self.command(timedelta(days=40))
+
+        moved = archive_commands(self.now - timedelta(days=30), batch_size=2)
+
+        self.assertEqual(moved, 3)
+        self.assertEqual(
+            set(Command.objects.values_list("id", flat=True)), {recent.id, pending.id}
+        )
+        self.assertEqual(
+            set(CommandHistory.objects.values_list("id", flat=True)),
+            {old[0].id, old[1].id, dead_letter.id},
+        )
+        self.assertTrue(CommandHistory.objects.get(id=dead_letter.id).expired)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM database_commandhistory_default")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_rows_in_default_partition_are_moved_to_new_partition(self):
+        command = self.command(timedelta(days=40), executed=True)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO database_commandhistory_default "
+                "(id, author_id, data, self_execute, executed, expired, created_at, "
+                "archived_at) "
+                "VALUES (%s, %s, '{}', false, true, false, %s, %s)",
+                [command.id + 1000, self.user.id, command.created_at, self.now],
+            )
+
+        moved = archive_commands(self.now - timedelta(days=30))
+
+        self.assertEqual(moved, 1)
+        self.assertEqual(CommandHistory.objects.count(), 2)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM database_commandhistory_default")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_partitions_past_retention_are_detached(self):
+        self.command(timedelta(days=400), executed=True)
+        self.command(timedelta(days=40), executed=True)
+        archive_commands(self.now - timedelta(days=30))
+        cutoff = months_before(
+            datetime(self.now.year, self.now.month, 1, tzinfo=dt_timezone.utc), 12
+        )
+
+        detached = expire_partitions(cutoff)
+
+        self.assertEqual(len(detached), 1)
+        self.assertNotIn(detached[0], [name for name, _ in history_partitions()])
+        self.assertEqual(CommandHistory.objects.count(), 1)
+
+    def test_archive_command(self):
+        self.command(timedelta(days=40), executed=True)
+        out = StringIO()
+
+        call_command("archive_commands", "--older-than", "30", stdout=out)
+
+        self.assertIn("Archived 1 commands", out.getvalue())
+
+    def test_archived_history_is_listed_on_demand(self):
+        command = self.command(timedelta(days=40), executed=True)
+        archive_commands(self.now - timedelta(days=30))
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        self.assertEqual(client.get("/api/commands/?all=1").data, [])
+        response = client.get("/api/commands/?all=1&archived=1")
+
+        self.assertEqual([c["id"] for c in response.data], [command.id])
+        self.assertEqual(response.data[0]["device__name"], "Pico")
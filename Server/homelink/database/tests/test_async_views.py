@@ -0,0 +1,58 @@
+import base64
+from unittest import mock
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from ..async_views import CommandPollView
+from ..models.models import Device, Command
+from ..notifications import CommandNotifier
+
+User = get_user_model()
+
+
+def basic_auth(username, password):
+    credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return {"Authorization": f"Basic {credentials}"}
+
+
+# keep wakeups in-process, a LISTEN connection would outlive the test database
+@mock.patch.object(CommandNotifier, "_uses_postgres", lambda self: False)
+class CommandPollViewTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.account = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.device = Device.objects.create(
+            name="Pico", owner=self.owner, account=self.account
+        )
+
+    async def test_returns_pending_commands_in_device_format(self):
+        command = await Command.objects.acreate(
+            author=self.owner, device=self.device, data={"name": "LED", "action": "on"}
+        )
+
+        response = await self.async_client.get(
+            "/api/commands/poll/", headers=basic_auth("pico", "password")
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), [{"id": command.id, "data": {"name": "LED", "action": "on"}}]
+        )
+
+    async def test_times_out_with_empty_list(self):
+        with mock.patch.object(CommandPollView, "timeout", 0.05):
+            response = await self.async_client.get(
+                "/api/commands/poll/", headers=basic_auth("pico", "password")
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    async def test_rejects_invalid_credentials(self):
+        response = await self.async_client.get(
+            "/api/commands/poll/", headers=basic_auth("pico", "wrong")
+        )
+
+        self.assertEqual(response.status_code, 401)
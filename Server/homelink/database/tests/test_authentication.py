@@ -0,0 +1,55 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from ..authentication import DeviceKeyAuthentication, make_device_key
+
+User = get_user_model()
+
+
+class DeviceKeyAuthenticationTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.device = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.factory = APIRequestFactory()
+
+    def authenticate(self, header):
+        request = Request(self.factory.get("/", HTTP_AUTHORIZATION=header))
+        return DeviceKeyAuthentication().authenticate(request)
+
+    def test_valid_key_authenticates_device(self):
+        user, _ = self.authenticate(
+            f"Device {self.device.pk}:{make_device_key(self.device)}"
+        )
+        self.assertEqual(user, self.device)
+
+    def test_other_schemes_are_ignored(self):
+        self.assertIsNone(self.authenticate("Basic cGljbzpwYXNzd29yZA=="))
+
+    def test_wrong_key_is_rejected(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(f"Device {self.device.pk}:{'0' * 64}")
+
+    def test_non_device_account_is_rejected(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(f"Device {self.owner.pk}:{make_device_key(self.owner)}")
+
+    def test_password_change_revokes_key(self):
+        key = make_device_key(self.device)
+        self.device.set_password("changed")
+        self.device.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(f"Device {self.device.pk}:{key}")
+
+    def test_device_key_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.device)
+
+        response = client.post("/api/device-key/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["device_key"], make_device_key(self.device))
@@ -0,0 +1,121 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from ..access import device_access_cache
+from ..catalog import catalog_cache
+from ..models.models import Device, Space
+from ..serializers import DeviceSerializer
+
+User = get_user_model()
+
+
+class DeviceCatalogTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.space = Space.objects.create(name="Home", owner=self.user)
+        self.space.users.add(self.user)
+        self.device = Device.objects.create(
+            name="Pico",
+            owner=self.user,
+            space=self.space,
+            data={
+                "components": [
+                    {
+                        "name": "LED",
+                        "actions": ["on", "off"],
+                        "has_input_action": False,
+                        "is_output": False,
+                        "supersedes": ["on", "off"],
+                    },
+                    {
+                        "name": "Display",
+                        "actions": [],
+                        "has_input_action": True,
+                        "is_output": False,
+                    },
+                ]
+            },
+        )
+
+    def test_catalog_keeps_only_what_the_prompt_needs(self):
+        catalog = catalog_cache.get(self.user.pk)
+
+        self.assertEqual(
+            json.loads(catalog.text),
+            [
+                {
+                    "id": self.device.id,
+                    "name": "Pico",
+                    "components": [
+                        {"name": "LED", "actions": ["on", "off"]},
+                        {"name": "Display", "actions": [], "input": True},
+                    ],
+                }
+            ],
+        )
+        serialized = json.dumps(DeviceSerializer([self.device], many=True).data)
+        self.assertLess(len(catalog.text), len(serialized) / 2)
+        self.assertEqual(catalog.tokens, (len(catalog.text) + 3) // 4)
+
+    def test_malformed_components_are_left_out(self):
+        self.device.data = {
+            "components": ["LED", {"name": "Servo", "actions": "left"}]
+        }
+        self.device.save()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get("/api/devices/catalog/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            catalog_cache.get(self.user.pk).devices[0]["components"],
+            [{"name": "Servo", "actions": []}],
+        )
+
+    def test_catalog_is_cached_until_a_device_changes(self):
+        first = catalog_cache.get(self.user.pk)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(catalog_cache.get(self.user.pk).hash, first.hash)
+
+        self.device.name = "Kitchen Pico"
+        self.device.save()
+
+        self.assertIn("Kitchen Pico", catalog_cache.get(self.user.pk).text)
+
+    def test_catalog_missed_invalidation_is_not_served(self):
+        catalog_cache.get(self.user.pk)
+        # edited by another process whose invalidation this one did not see
+        with mock.patch("database.signals.catalog_cache.invalidate"):
+            self.device.name = "Kitchen Pico"
+            self.device.save()
+
+        self.assertIn("Kitchen Pico", catalog_cache.get(self.user.pk).text)
+
+    def test_catalog_follows_access_changes(self):
+        guest = User.objects.create_user(username="guest", password="password")
+        self.assertEqual(catalog_cache.get(guest.pk).devices, [])
+
+        self.space.users.add(guest)
+
+        self.assertEqual(
+            [device["id"] for device in catalog_cache.get(guest.pk).devices],
+            [self.device.id],
+        )
+
+    def test_catalog_endpoint_reports_token_size(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get("/api/devices/catalog/")
+
+        catalog = catalog_cache.get(self.user.pk)
+        self.assertEqual(response.data["tokens"], catalog.tokens)
+        self.assertEqual(response.data["hash"], catalog.hash)
@@ -0,0 +1,209 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from ..debounce import EventDebouncer, event_debouncer
+from ..models.models import Device, Command, CommandsLink, DeviceEvent
+
+User = get_user_model()
+
+
+class DeviceEventTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.account = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.device = Device.objects.create(
+            name="Pico", owner=self.owner, account=self.account
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.account)
+
+    def test_event_is_stored_outside_commands(self):
+        response = self.client.post(
+            "/api/events/",
+            {"data": {"name": "Movement detector", "action": "detected"}},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["device"], self.device.id)
+        self.assertEqual(
+            list(DeviceEvent.objects.values_list("data", flat=True)),
+            [{"name": "Movement detector", "action": "detected"}],
+        )
+        self.assertFalse(Command.objects.exists())
+
+    def test_batch_is_inserted_at_once_and_feeds_triggers(self):
+        CommandsLink.objects.create(
+            triggers=[
+                {
+                    "device_id": self.device.id,
+                    "component_name": "Button",
+                    "action": action,
+                    "satisfied_at": None,
+                }
+                for action in ["press", "release"]
+            ],
+            results=[
+                {"device_id": self.device.id, "data": {"name": "LED", "action": "on"}}
+            ],
+            owner=self.owner,
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/events/",
+                [
+                    {"data": {"name": "Button", "action": "press"}},
+                    {"data": {"name": "Button", "action": "release"}},
+                ],
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(
+            len(
+                [
+                    q
+                    for q in queries
+                    if q["sql"].startswith('INSERT INTO "database_deviceevent"')
+                ]
+            ),
+            1,
+        )
+        self.assertEqual(
+            list(Command.objects.pending_for(self.account).values_list("data", flat=True)),
+            [{"name": "LED", "action": "on"}],
+        )
+
+    def test_events_of_foreign_devices_are_rejected(self):
+        stranger = User.objects.create_user(username="stranger", password="password")
+        self.client.force_authenticate(stranger)
+
+        response = self.client.post(
+            "/api/events/",
+            {"device": self.device.id, "data": {"name": "Button", "action": "press"}},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(DeviceEvent.objects.exists())
+
+    def test_invalid_data_is_rejected(self):
+        response = self.client.post(
+            "/api/events/", {"data": {"name": "Button"}}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_empty_batch_or_missing_device_is_rejected(self):
+        self.assertEqual(
+            self.client.post("/api/events/", [], format="json").status_code, 400
+        )
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(
+            "/api/events/", {"data": {"name": "Button", "action": "press"}}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_device_filter_is_rejected(self):
+        self.assertEqual(self.client.get("/api/events/?device=pico").status_code, 400)
+
+
+class EventDebounceTest(TestCase):
+    def setUp(self):
+        event_debouncer.clear()
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.account = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.device = Device.objects.create(
+            name="Pico",
+            owner=self.owner,
+            account=self.account,
+            data={
+                "components": [
+                    {"name": "Movement detector", "actions": ["detected"], "debounce": 60},
+                    {"name": "Button", "actions": ["press"]},
+                ]
+            },
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.account)
+
+    def post_event(self, name, action):
+        return self.client.post(
+            "/api/events/", {"data": {"name": name, "action": action}}, format="json"
+        )
+
+    def test_repeated_event_inside_window_is_dropped(self):
+        self.assertEqual(self.post_event("Movement detector", "detected").status_code, 201)
+
+        with self.assertNumQueries(1):
+            response = self.post_event("Movement detector", "detected")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"debounced": True})
+        self.assertEqual(DeviceEvent.objects.count(), 1)
+
+    def test_components_without_window_are_not_debounced(self):
+        self.post_event("Button", "press")
+        self.post_event("Button", "press")
+
+        self.assertEqual(DeviceEvent.objects.count(), 2)
+
+    def test_window_expires(self):
+        data = {"name": "Movement detector", "action": "detected"}
+
+        self.assertTrue(event_debouncer.accept(self.device.id, data, now=0))
+        self.assertFalse(event_debouncer.accept(self.device.id, data, now=59))
+        self.assertTrue(event_debouncer.accept(self.device.id, data, now=61))
+
+    def test_invalid_windows_are_ignored(self):
+        self.device.data["components"][1]["debounce"] = "soon"
+        self.device.data["components"].append({"debounce": 5})
+        self.device.save()
+
+        self.assertEqual(self.post_event("Button", "press").status_code, 201)
+        self.assertEqual(self.post_event("Button", "press").status_code, 201)
+
+    def test_state_stays_bounded(self):
+        debouncer = EventDebouncer(max_entries=2)
+        data = {"name": "Movement detector", "action": "detected"}
+        for device_id in [self.device.id, 0, -1, -2]:
+            debouncer.accept(device_id, data, now=0)
+        for action in ["a", "b", "c"]:
+            debouncer.accept(self.device.id, {**data, "action": action}, now=0)
+
+        self.assertLessEqual(len(debouncer._windows), 2)
+        self.assertLessEqual(len(debouncer._until), 2)
+
+    def test_saving_device_reloads_windows(self):
+        self.post_event("Button", "press")
+        self.device.data["components"][1]["debounce"] = 10
+        self.device.save()
+
+        self.post_event("Button", "press")
+        self.post_event("Button", "press")
+
+        self.assertEqual(DeviceEvent.objects.count(), 2)
+
+    def test_self_executed_commands_are_debounced(self):
+        self.client.force_authenticate(self.owner)
+        command = {
+            "device": self.device.id,
+            "data": {"name": "Movement detector", "action": "detected"},
+            "self_execute": True,
+        }
+
+        first = self.client.post("/api/commands/?all=1", command, format="json")
+        second = self.client.post("/api/commands/?all=1", command, format="json")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.data, {"debounced": True})
+        self.assertEqual(Command.objects.count(), 1)
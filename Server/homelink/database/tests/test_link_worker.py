@@ -0,0 +1,151 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..link_worker import LinkEventWorker
+from ..models.models import Device, Command, CommandsLink, LinkEvent
+
+User = get_user_model()
+
+
+@override_settings(LINK_EVALUATION_QUEUE=True, LINK_EVENT_PARTITIONS=4)
+class LinkEventWorkerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.device = Device.objects.create(name="Pico", owner=self.user)
+        self.link = CommandsLink.objects.create(
+            triggers=[
+                {
+                    "device_id": self.device.id,
+                    "component_name": "Button",
+                    "action": action,
+                    "satisfied_at": None,
+                }
+                for action in ["press", "release"]
+            ],
+            results=[
+                {"device_id": self.device.id, "data": {"name": "LED", "action": "toggle"}}
+            ],
+            ttl=timedelta(seconds=5),
+            owner=self.user,
+        )
+        self.worker = LinkEventWorker()
+
+    def create_event(self, action):
+        return Command.objects.create(
+            author=self.user,
+            device=self.device,
+            data={"name": "Button", "action": action},
+            self_execute=True,
+        )
+
+    def result_commands(self):
+        return Command.objects.filter(data={"name": "LED", "action": "toggle"})
+
+    def test_events_are_only_recorded_on_the_request_path(self):
+        self.create_event("press")
+        self.create_event("release")
+
+        self.assertFalse(self.result_commands().exists())
+        self.assertEqual(
+            list(LinkEvent.objects.values_list("partition", flat=True)),
+            [self.device.id % 4] * 2,
+        )
+
+        self.assertEqual(self.worker.run_once(), 2)
+
+        self.assertEqual(self.result_commands().count(), 1)
+        self.assertFalse(LinkEvent.objects.exists())
+
+    def test_events_are_evaluated_at_the_time_they_were_recorded(self):
+        self.create_event("press")
+        self.create_event("release")
+        LinkEvent.objects.filter(data__action="press").update(
+            created_at=timezone.now() - timedelta(seconds=10)
+        )
+
+        self.worker.run_once()
+
+        self.assertFalse(self.result_commands().exists())
+
+    def test_events_of_a_device_are_evaluated_in_order(self):
+        self.create_event("release")
+        self.create_event("press")
+        self.worker.batch_size = 1
+
+        self.assertEqual(self.worker.run_once(), 1)
+        self.assertEqual(
+            list(LinkEvent.objects.values_list("data__action", flat=True)), ["press"]
+        )
+        self.worker.run_once()
+
+        self.assertEqual(self.result_commands().count(), 1)
+
+    def test_stats_report_depth_and_lag(self):
+        self.assertEqual(LinkEvent.objects.stats(), {"depth": 0, "lag": 0})
+
+        self.create_event("press")
+        LinkEvent.objects.update(created_at=timezone.now() - timedelta(seconds=30))
+
+        stats = LinkEvent.objects.stats()
+        self.assertEqual(stats["depth"], 1)
+        self.assertGreaterEqual(stats["lag"], 30)
+
+    def test_stats_endpoint_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get("/api/link-events/stats/").status_code, 403)
+
+        admin = User.objects.create_superuser(username="admin", password="password")
+        client.force_authenticate(admin)
+        response = client.get("/api/link-events/stats/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["depth"], 0)
+
+
+@override_settings(LINK_EVALUATION_QUEUE=True, LINK_EVENT_PARTITIONS=4)
+class CrossPartitionLinkTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.sensors = [
+            Device.objects.create(name=f"Sensor {i}", owner=self.user) for i in range(2)
+        ]
+        CommandsLink.objects.create(
+            triggers=[
+                {"device_id": sensor.id, "component_name": "Button", "action": "press"}
+                for sensor in self.sensors
+            ],
+            results=[
+                {"device_id": self.sensors[0].id, "data": {"name": "LED", "action": "on"}}
+            ],
+            owner=self.user,
+        )
+        LinkEvent.objects.enqueue(
+            [(sensor.id, {"name": "Button", "action": "press"}) for sensor in self.sensors]
+        )
+
+    def test_workers_of_different_partitions_do_not_lose_triggers(self):
+        first, second = [sensor.id % 4 for sensor in self.sensors]
+
+        def process_second():
+            try:
+                LinkEventWorker().process_partition(second)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            LinkEventWorker().process_partition(first)
+            # the link stays locked until this worker commits
+            other = threading.Thread(target=process_second)
+            other.start()
+            time.sleep(0.2)
+        other.join()
+
+        self.assertFalse(LinkEvent.objects.exists())
+        self.assertEqual(Command.objects.filter(data__action="on").count(), 1)
@@ -1,6 +1,12 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from rest_framework.test import APIClient
 from datetime import timedelta, datetime
 from ..models.models import Space, Device, Command, CommandsLink
 
@@ -82,40 +88,411 @@ class ModelsTestCase(TestCase):
         self.commands_link.refresh_from_db()
         self.assertIsNone(self.commands_link.triggers[0]["satisfied_at"])
 
-    def test_commands_link_check_all_satisfied_without_ttl(self):
-        self.commands_link.triggers[0]["satisfied_at"] = f"{timezone.now()}"
+    def satisfy_first_of_two_triggers(self, age, ttl=None):
+        self.commands_link.triggers = [
+            {
+                "device_id": self.device.id,
+                "component_name": "LED",
+                "action": "on",
+                "satisfied_at": f"{(timezone.now() - age).isoformat()}",
+            },
+            {
+                "device_id": self.device.id,
+                "component_name": "LED",
+                "action": "toggle",
+                "satisfied_at": None,
+            },
+        ]
+        self.commands_link.ttl = ttl
         self.commands_link.save()
+        CommandsLink.check_triggers(self.device.id, {"name": "LED", "action": "toggle"})
+        return Command.objects.filter(
+            author=self.user, device=self.device, data={"name": "LED", "action": "off"}
+        )
 
-        self.commands_link.check_all_satisfied()
+    def test_commands_link_check_triggers_without_ttl(self):
+        self.assertTrue(self.satisfy_first_of_two_triggers(timedelta(days=1)).exists())
+        self.assertEqual(
+            [row.satisfied_at for row in self.commands_link.trigger_rows.all()],
+            [None, None],
+        )
+
+    def test_commands_link_check_triggers_with_ttl(self):
+        self.assertTrue(
+            self.satisfy_first_of_two_triggers(
+                timedelta(seconds=5), ttl=timedelta(seconds=10)
+            ).exists()
+        )
+
+    def test_commands_link_check_triggers_outside_ttl(self):
+        self.assertFalse(
+            self.satisfy_first_of_two_triggers(
+                timedelta(seconds=60), ttl=timedelta(seconds=10)
+            ).exists()
+        )
+
+    def test_commands_link_keeps_trigger_state_out_of_json(self):
+        self.commands_link.triggers[0]["satisfied_at"] = f"{timezone.now()}"
+        self.commands_link.save()
 
-        new_command = Command.objects.filter(
-            author=self.user, device=self.device, data={"name": "LED", "action": "off"}
-        ).first()
-        self.assertIsNotNone(new_command)
         self.commands_link.refresh_from_db()
         self.assertIsNone(self.commands_link.triggers[0]["satisfied_at"])
+        self.assertIsNotNone(self.commands_link.trigger_rows.get().satisfied_at)
 
-    def test_commands_link_check_all_satisfied_with_ttl(self):
-        self.commands_link.triggers = [
+    def test_commands_link_save_keeps_trigger_state(self):
+        self.commands_link.trigger_rows.update(satisfied_at=timezone.now())
+
+        self.commands_link.ttl = timedelta(seconds=30)
+        self.commands_link.save()
+        self.assertIsNotNone(self.commands_link.trigger_rows.get().satisfied_at)
+
+        self.commands_link.triggers[0]["action"] = "toggle"
+        self.commands_link.save()
+        self.assertIsNone(self.commands_link.trigger_rows.get().satisfied_at)
+
+    def test_commands_link_is_not_saved_without_its_trigger_rows(self):
+        with self.assertRaises(KeyError):
+            CommandsLink.objects.create(
+                owner=self.user,
+                triggers=[{"device_id": self.device.id, "component_name": "LED"}],
+                results=[],
+            )
+
+        self.assertEqual(CommandsLink.objects.count(), 1)
+
+    def test_commands_link_check_triggers_executes_matching_link(self):
+        CommandsLink.check_triggers(self.device.id, {"name": "LED", "action": "on"})
+
+        self.assertTrue(
+            Command.objects.filter(
+                device=self.device, data={"name": "LED", "action": "off"}
+            ).exists()
+        )
+        self.assertIsNone(self.commands_link.trigger_rows.get().satisfied_at)
+
+    def test_commands_link_check_triggers_waits_for_all_triggers(self):
+        self.commands_link.triggers.append(
             {
                 "device_id": self.device.id,
                 "component_name": "LED",
-                "action": "on",
-                "satisfied_at": f"{(timezone.now()).isoformat()}"
-            },
+                "action": "toggle",
+                "satisfied_at": None,
+            }
+        )
+        self.commands_link.save()
+
+        CommandsLink.check_triggers(self.device.id, {"name": "LED", "action": "on"})
+
+        rows = list(self.commands_link.trigger_rows.all())
+        self.assertIsNotNone(rows[0].satisfied_at)
+        self.assertIsNone(rows[1].satisfied_at)
+        self.assertFalse(
+            Command.objects.filter(data={"name": "LED", "action": "off"}).exists()
+        )
+
+    def test_commands_link_check_triggers_is_one_query_without_match(self):
+        for _ in range(20):
+            CommandsLink.objects.create(
+                triggers=[
+                    {
+                        "device_id": self.device.id,
+                        "component_name": "LED",
+                        "action": "off",
+                        "satisfied_at": None,
+                    }
+                ],
+                results=[],
+                owner=self.user,
+            )
+
+        with self.assertNumQueries(1):
+            CommandsLink.check_triggers(
+                self.device.id, {"name": "LED", "action": "toggle"}
+            )
+
+    def test_commands_link_ttl_window_slides_instead_of_resetting(self):
+        self.commands_link.triggers.append(
             {
                 "device_id": self.device.id,
                 "component_name": "LED",
-                "action": "off",
-                "satisfied_at": f"{(timezone.now() + timedelta(seconds=5)).isoformat()}"
-            },
-        ]
+                "action": "toggle",
+                "satisfied_at": f"{timezone.now() - timedelta(seconds=60)}",
+            }
+        )
         self.commands_link.ttl = timedelta(seconds=10)
         self.commands_link.save()
 
-        self.commands_link.check_all_satisfied()
+        CommandsLink.check_triggers(self.device.id, {"name": "LED", "action": "on"})
 
-        new_command = Command.objects.filter(
-            author=self.user, device=self.device, data={"name": "LED", "action": "off"}
-        ).first()
-        self.assertIsNotNone(new_command)
+        rows = list(self.commands_link.trigger_rows.all())
+        self.assertIsNotNone(rows[0].satisfied_at)
+        self.assertIsNone(rows[1].satisfied_at)
+
+        CommandsLink.check_triggers(self.device.id, {"name": "LED", "action": "toggle"})
+
+        self.assertTrue(
+            Command.objects.filter(data={"name": "LED", "action": "off"}).exists()
+        )
+
+    def test_commands_link_fan_out_query_count_is_constant(self):
+        devices = [
+            Device.objects.create(name=f"Lamp {i}", owner=self.user2)
+            for i in range(20)
+        ]
+
+        def count_queries(results_count):
+            self.commands_link.results = [
+                {"device_id": device.id, "data": {"name": "LED", "action": "on"}}
+                for device in devices[:results_count]
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                self.commands_link.create_result_commands()
+            return len(queries)
+
+        self.assertEqual(count_queries(1), count_queries(20))
+        self.assertEqual(
+            Command.objects.filter(device__in=devices, author=self.user2).count(), 21
+        )
+
+    def test_commands_link_results_accept_string_device_ids(self):
+        self.commands_link.results = [
+            {"device_id": str(self.device.id), "data": {"name": "LED", "action": "on"}}
+        ]
+
+        commands = self.commands_link.create_result_commands()
+
+        self.assertEqual([command.device for command in commands], [self.device])
+
+
+class CommandSupersedeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.device = Device.objects.create(
+            name="Pico",
+            owner=self.user,
+            data={
+                "components": [
+                    {
+                        "name": "LED",
+                        "actions": ["on", "off", "toggle"],
+                        "supersedes": ["on", "off"],
+                    },
+                    {"name": "Servo", "actions": ["left", "right"]},
+                ]
+            },
+        )
+
+    def command(self, name, action, **kwargs):
+        return Command.objects.create(
+            author=self.user,
+            device=self.device,
+            data={"name": name, "action": action},
+            **kwargs,
+        )
+
+    def pending_actions(self):
+        return [
+            (command.data["name"], command.data["action"])
+            for command in Command.objects.pending_for(self.user).order_by("id")
+        ]
+
+    def test_superseding_action_replaces_older_pending_commands(self):
+        self.command("LED", "on")
+        self.command("LED", "toggle")
+        self.command("Servo", "left")
+        self.command("LED", "off")
+
+        self.assertEqual(self.pending_actions(), [("Servo", "left"), ("LED", "off")])
+
+    def test_other_actions_and_components_accumulate(self):
+        self.command("LED", "toggle")
+        self.command("LED", "toggle")
+        self.command("Servo", "left")
+        self.command("Servo", "right")
+
+        self.assertEqual(len(self.pending_actions()), 4)
+
+    def test_leased_and_scheduled_commands_are_kept(self):
+        leased = self.command(
+            "LED", "on", leased_until=timezone.now() + timedelta(minutes=1)
+        )
+        scheduled = self.command(
+            "LED", "on", scheduled_at=timezone.now() + timedelta(hours=1)
+        )
+        self.command("LED", "off")
+
+        self.assertTrue(Command.objects.filter(pk=leased.pk).exists())
+        self.assertTrue(Command.objects.filter(pk=scheduled.pk).exists())
+
+    def test_malformed_device_data_does_not_break_commands(self):
+        for data in [
+            {"components": ["LED"]},
+            {"components": "LED"},
+            {"components": [{"name": "LED", "supersedes": "on"}]},
+            ["LED"],
+        ]:
+            self.device.data = data
+            self.device.save()
+            self.command("LED", "o")
+            self.command("LED", "on")
+
+        self.assertEqual(len(self.pending_actions()), 8)
+
+    def test_commands_api_accepts_devices_with_malformed_components(self):
+        self.device.data = {"components": ["LED"]}
+        self.device.save()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post(
+            "/api/commands/?all=1",
+            {"device": self.device.id, "data": {"name": "LED", "action": "on"}},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+
+    def test_link_results_supersede_pending_commands(self):
+        self.command("LED", "on")
+        link = CommandsLink.objects.create(
+            triggers=[],
+            results=[
+                {"device_id": self.device.id, "data": {"name": "LED", "action": "off"}}
+            ],
+        )
+
+        link.create_result_commands()
+
+        self.assertEqual(self.pending_actions(), [("LED", "off")])
+
+
+class CommandExpiryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.device = Device.objects.create(
+            name="Pico", owner=self.user, command_ttl=timedelta(minutes=5)
+        )
+
+    def command(self, **kwargs):
+        return Command.objects.create(
+            author=self.user,
+            device=self.device,
+            data={"name": "LED", "action": "toggle"},
+            **kwargs,
+        )
+
+    def test_device_ttl_sets_expiry(self):
+        command = self.command()
+
+        self.assertAlmostEqual(
+            command.expires_at,
+            timezone.now() + timedelta(minutes=5),
+            delta=timedelta(seconds=5),
+        )
+
+    def test_expired_commands_are_not_delivered(self):
+        self.command(expires_at=timezone.now() - timedelta(seconds=1))
+        fresh = self.command()
+
+        self.assertEqual(list(Command.objects.pending_for(self.user)), [fresh])
+
+    def test_purge_deletes_expired_commands_in_batches(self):
+        for _ in range(5):
+            self.command(expires_at=timezone.now() - timedelta(seconds=1))
+        fresh = self.command()
+
+        with CaptureQueriesContext(connection) as queries:
+            purged = Command.objects.purge_expired(batch_size=2)
+
+        self.assertEqual(purged, 5)
+        self.assertEqual(
+            len([q for q in queries if q["sql"].startswith("DELETE")]), 3
+        )
+        self.assertEqual(list(Command.objects.all()), [fresh])
+
+    def test_purge_can_dead_letter_expired_commands(self):
+        expired = self.command(expires_at=timezone.now() - timedelta(seconds=1))
+
+        call_command("purge_expired_commands", "--dead-letter", stdout=StringIO())
+
+        expired.refresh_from_db()
+        self.assertTrue(expired.expired)
+        self.assertFalse(expired.executed)
+        self.assertFalse(Command.objects.expired().exists())
+
+
+class PendingCommandIndexTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.account = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.device = Device.objects.create(
+            name="Pico", owner=self.owner, account=self.account
+        )
+        others = [
+            Device.objects.create(
+                name=f"Pico {i}",
+                owner=User.objects.create(username=f"user{i}"),
+            )
+            for i in range(20)
+        ]
+        Command.objects.bulk_create(
+            Command(
+                author=device.owner,
+                device=device,
+                target_account_id=device.account_id,
+                data={"name": "LED", "action": "toggle"},
+                executed=executed,
+            )
+            for device in [self.device] + others
+            for executed in [True] * 100 + [False] * 2
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE database_command")
+            # the table is tiny, make the planner use an index whenever it can
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_target_account_follows_device(self):
+        command = Command.objects.filter(executed=False).first()
+        self.assertEqual(command.target_account, self.account)
+
+        other = User.objects.create_user(
+            username="pico2", password="password", is_device=True, owner=self.owner
+        )
+        self.device.account = other
+        self.device.save()
+
+        self.assertEqual(Command.objects.pending_for(other).count(), 2)
+        self.assertFalse(Command.objects.pending_for(self.account).exists())
+
+    def test_target_account_follows_command_moved_to_other_device(self):
+        other = User.objects.create_user(
+            username="pico2", password="password", is_device=True, owner=self.owner
+        )
+        lamp = Device.objects.create(name="Lamp", owner=self.owner, account=other)
+        command = Command.objects.filter(executed=False).first()
+
+        command.device = lamp
+        command.save()
+
+        self.assertEqual(list(Command.objects.pending_for(other)), [command])
+        self.assertEqual(Command.objects.pending_for(self.account).count(), 1)
+
+    def test_device_poll_uses_partial_index_without_join(self):
+        plan = Command.objects.pending_for(self.account).explain()
+
+        self.assertIn("command_pending_account_idx", plan)
+        self.assertNotIn("database_device", plan)
+        self.assertEqual(Command.objects.pending_for(self.account).count(), 2)
+
+    def test_device_poll_ids_are_read_from_the_index_only(self):
+        plan = Command.objects.pending_for(self.account).values("id").explain()
+
+        self.assertIn("Index Only Scan using command_pending_account_idx", plan)
+
+    def test_owner_poll_uses_partial_device_index(self):
+        plan = Command.objects.pending_for(self.owner).explain()
+
+        self.assertIn("command_pending_device_idx", plan)
+        self.assertEqual(Command.objects.pending_for(self.owner).count(), 2)
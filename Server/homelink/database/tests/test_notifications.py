@@ -0,0 +1,96 @@
+import threading
+from unittest import mock
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from ..models.models import Device, Command
+from ..notifications import CommandNotifier, command_notifier, link_key, user_key
+
+User = get_user_model()
+
+
+class CommandNotifierTest(TestCase):
+    def setUp(self):
+        self.notifier = CommandNotifier()
+
+    def test_wait_times_out_without_notification(self):
+        with mock.patch.object(CommandNotifier, "_uses_postgres", return_value=False):
+            self.assertFalse(self.notifier.wait([user_key(1)], timeout=0.05))
+
+    def test_dispatch_wakes_only_matching_waiters(self):
+        with mock.patch.object(CommandNotifier, "_uses_postgres", return_value=False):
+            with self.notifier.listen([user_key(1)]) as first, self.notifier.listen(
+                [user_key(2)]
+            ) as second:
+                threading.Timer(0.01, self.notifier.notify, [[user_key(1)]]).start()
+                self.assertTrue(first.wait(1))
+                self.assertFalse(second.is_set())
+
+        self.assertEqual(self.notifier._waiters, {})
+
+    def test_listener_survives_any_error_with_backoff(self):
+        class Stop(BaseException):
+            pass
+
+        with mock.patch.object(
+            CommandNotifier, "_connect", side_effect=RuntimeError("boom")
+        ), mock.patch(
+            "database.notifications.time.sleep", side_effect=[None, None, Stop()]
+        ) as sleep, self.assertLogs(
+            "database.notifications", "ERROR"
+        ):
+            with self.assertRaises(Stop):
+                self.notifier._listen_forever({})
+
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1, 2, 4])
+
+    def test_subscribers_get_matching_keys(self):
+        changed = []
+        with mock.patch.object(CommandNotifier, "_uses_postgres", return_value=False):
+            self.notifier.subscribe("link:", changed.append)
+            self.notifier.notify([link_key(3), user_key(1)])
+
+        self.assertEqual(changed, [link_key(3)])
+
+    def test_subscribers_are_told_about_missed_notifications(self):
+        class Stop(BaseException):
+            pass
+
+        changed = []
+        with mock.patch.object(CommandNotifier, "_ensure_listener"):
+            self.notifier.subscribe("link:", changed.append)
+        with mock.patch.object(CommandNotifier, "_connect"), mock.patch(
+            "database.notifications.select.select", side_effect=OSError
+        ), mock.patch(
+            "database.notifications.time.sleep", side_effect=Stop()
+        ), self.assertLogs(
+            "database.notifications", "ERROR"
+        ):
+            with self.assertRaises(Stop):
+                self.notifier._listen_forever({})
+
+        self.assertEqual(changed, [None])
+
+
+class CommandWakeupSignalTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.account = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.device = Device.objects.create(
+            name="Pico", owner=self.owner, account=self.account
+        )
+
+    def test_created_command_notifies_owner_and_account_on_commit(self):
+        with mock.patch.object(command_notifier, "notify") as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                Command.objects.create(
+                    author=self.owner,
+                    device=self.device,
+                    data={"name": "LED", "action": "on"},
+                )
+
+        notify.assert_called_once_with(
+            sorted([user_key(self.owner.pk), user_key(self.account.pk)])
+        )
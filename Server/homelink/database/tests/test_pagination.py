@@ -0,0 +1,76 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from ..models.models import Device, Command, Space
+
+User = get_user_model()
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.space = Space.objects.create(name="Home", owner=self.user)
+        self.space.users.add(self.user)
+        self.device = Device.objects.create(
+            name="Pico", owner=self.user, space=self.space
+        )
+        self.commands = [
+            Command.objects.create(
+                author=self.user,
+                device=self.device,
+                data={"name": "LED", "action": "toggle"},
+                executed=True,
+            )
+            for _ in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ids(self, response):
+        return [item["id"] for item in response.data["results"]]
+
+    def test_lists_are_not_paginated_without_parameters(self):
+        response = self.client.get("/api/commands/?all=1")
+
+        self.assertEqual(len(response.data), 5)
+
+    def test_history_is_paged_newest_first(self):
+        newest_first = [c.id for c in reversed(self.commands)]
+
+        first = self.client.get("/api/commands/?all=1&page_size=2")
+        self.assertEqual(self.ids(first), newest_first[:2])
+
+        second = self.client.get(first.data["next"])
+        self.assertEqual(self.ids(second), newest_first[2:4])
+
+        with self.assertNumQueries(1):
+            third = self.client.get(second.data["next"])
+        self.assertEqual(self.ids(third), newest_first[4:])
+        self.assertIsNone(third.data["next"])
+
+    def test_since_returns_only_newer_rows(self):
+        response = self.client.get(f"/api/commands/?all=1&since={self.commands[2].id}")
+
+        self.assertEqual(
+            self.ids(response), [self.commands[4].id, self.commands[3].id]
+        )
+
+    def test_invalid_since_is_rejected(self):
+        response = self.client.get("/api/commands/?all=1&since=yesterday")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_devices_and_spaces_are_paginated(self):
+        other = Device.objects.create(name="Lamp", owner=self.user)
+
+        devices = self.client.get("/api/devices/?page_size=1")
+        self.assertEqual(self.ids(devices), [other.id])
+        self.assertIsNotNone(devices.data["next"])
+
+        spaces = self.client.get("/api/spaces/?page_size=1")
+        self.assertEqual(self.ids(spaces), [self.space.id])
+
+        space_devices = self.client.get(
+            f"/api/spaces/{self.space.id}/devices/?page_size=1"
+        )
+        self.assertEqual(self.ids(space_devices), [self.device.id])
@@ -0,0 +1,160 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from ..models.models import Device, Command, CommandsLink
+from ..notifications import CommandNotifier
+from ..rules import RuleEngine, evaluate_stored, rule_engine
+
+User = get_user_model()
+
+
+@override_settings(COMMANDS_LINK_ENGINE="memory")
+@mock.patch.object(CommandNotifier, "_uses_postgres", lambda self: False)
+class RuleEngineTest(TestCase):
+    def setUp(self):
+        rule_engine.clear()
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.sensor = Device.objects.create(name="Sensor", owner=self.user)
+        self.lamp = Device.objects.create(name="Lamp", owner=self.user)
+
+    def tearDown(self):
+        rule_engine.clear()
+
+    def create_link(self, actions, ttl=None):
+        return CommandsLink.objects.create(
+            triggers=[
+                {
+                    "device_id": self.sensor.id,
+                    "component_name": "Movement detector",
+                    "action": action,
+                    "satisfied_at": None,
+                }
+                for action in actions
+            ],
+            results=[{"device_id": self.lamp.id, "data": {"name": "LED", "action": "on"}}],
+            ttl=ttl,
+            owner=self.user,
+        )
+
+    def event(self, action, now=None):
+        return rule_engine.evaluate(
+            self.sensor.id, {"name": "Movement detector", "action": action}, now=now
+        )
+
+    def lamp_commands(self):
+        return Command.objects.filter(device=self.lamp).count()
+
+    def test_check_triggers_uses_engine_and_fires_results(self):
+        self.create_link(["detected"])
+
+        CommandsLink.check_triggers(
+            self.sensor.id, {"name": "Movement detector", "action": "detected"}
+        )
+
+        self.assertEqual(self.lamp_commands(), 1)
+
+    def test_events_that_do_not_fire_stay_in_memory(self):
+        self.create_link(["detected", "cleared"])
+        rule_engine.load()
+
+        with self.assertNumQueries(0):
+            self.event("detected")
+            self.event("unknown")
+
+        self.assertEqual(len(self.event("cleared")), 1)
+        self.assertEqual(self.lamp_commands(), 1)
+
+    def test_ttl_window_slides_instead_of_resetting(self):
+        self.create_link(["detected", "cleared"], ttl=timedelta(seconds=10))
+        rule_engine.load()
+
+        self.event("detected", now=0)
+        self.assertEqual(self.event("cleared", now=60), [])
+        # "cleared" at 60 is still within the window of a new "detected"
+        self.assertEqual(len(self.event("detected", now=65)), 1)
+
+    def test_expired_trigger_is_refreshed_by_a_new_event(self):
+        self.create_link(["detected", "cleared"], ttl=timedelta(seconds=10))
+        rule_engine.load()
+
+        self.event("detected", now=0)
+        self.event("detected", now=50)
+
+        self.assertEqual(len(self.event("cleared", now=55)), 1)
+
+    def test_saved_and_deleted_links_are_recompiled(self):
+        rule_engine.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            link = self.create_link(["detected"])
+
+        self.assertEqual(len(self.event("detected")), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            link.delete()
+
+        self.assertEqual(self.event("detected"), [])
+
+    def test_links_changed_in_other_processes_are_reloaded(self):
+        # the engine of a process that did not save the links
+        engine = RuleEngine()
+        engine.load()
+
+        def event(action):
+            return engine.evaluate(
+                self.sensor.id, {"name": "Movement detector", "action": action}
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            link = self.create_link(["detected"])
+        self.assertEqual(len(event("detected")), 1)
+
+        link.triggers[0]["action"] = "cleared"
+        with self.captureOnCommitCallbacks(execute=True):
+            link.save()
+        self.assertEqual(event("detected"), [])
+        self.assertEqual(len(event("cleared")), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            link.delete()
+        self.assertEqual(event("cleared"), [])
+
+
+class StoredTriggerLockTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.sensor = Device.objects.create(name="Sensor", owner=self.user)
+        self.lamp = Device.objects.create(name="Lamp", owner=self.user)
+        self.link = CommandsLink.objects.create(
+            triggers=[
+                {"device_id": self.sensor.id, "component_name": "Button", "action": a}
+                for a in ["press", "release"]
+            ],
+            results=[
+                {"device_id": self.lamp.id, "data": {"name": "LED", "action": "on"}}
+            ],
+            owner=self.user,
+        )
+
+    def test_concurrent_evaluations_of_a_link_do_not_lose_triggers(self):
+        def release():
+            try:
+                evaluate_stored(
+                    [(self.sensor.id, {"name": "Button", "action": "release"})]
+                )
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            evaluate_stored([(self.sensor.id, {"name": "Button", "action": "press"})])
+            # the second evaluation waits for the link until this one commits
+            other = threading.Thread(target=release)
+            other.start()
+            time.sleep(0.2)
+        other.join()
+
+        self.assertEqual(Command.objects.filter(device=self.lamp).count(), 1)
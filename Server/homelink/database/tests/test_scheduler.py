@@ -0,0 +1,118 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from ..models.models import Device, Command
+from ..scheduler import CommandScheduler
+
+User = get_user_model()
+
+
+class CommandSchedulerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.device = Device.objects.create(name="Lamp", owner=self.user)
+        self.now = timezone.now()
+        self.scheduler = CommandScheduler(horizon=timedelta(minutes=10))
+
+    def schedule(self, delay, repeat_interval=None):
+        return Command.objects.create(
+            author=self.user,
+            device=self.device,
+            data={"name": "LED", "action": "on"},
+            scheduled_at=self.now + delay,
+            repeat_interval=repeat_interval,
+        )
+
+    def test_scheduled_commands_are_not_pending_until_released(self):
+        command = self.schedule(timedelta(seconds=-1))
+
+        self.assertFalse(Command.objects.pending_for(self.user).exists())
+
+        self.scheduler.load(self.now)
+        self.assertEqual(self.scheduler.run_due(self.now), 1)
+
+        command.refresh_from_db()
+        self.assertIsNone(command.scheduled_at)
+        self.assertEqual(list(Command.objects.pending_for(self.user)), [command])
+
+    def test_released_command_is_newer_than_commands_created_before(self):
+        scheduled = self.schedule(timedelta(seconds=-1))
+        scheduled.data = {"name": "LED", "action": "off"}
+        scheduled.save()
+        pending = Command.objects.create(
+            author=self.user, device=self.device, data={"name": "LED", "action": "on"}
+        )
+        self.scheduler.load(self.now)
+        self.scheduler.run_due(timezone.now())
+
+        self.assertEqual(
+            list(Command.objects.pending_for(self.user)), [pending, scheduled]
+        )
+        self.assertEqual(
+            [c.id for c in Command.objects.lease_for(self.user)],
+            [pending.id, scheduled.id],
+        )
+
+    def test_released_command_supersedes_commands_created_before(self):
+        self.device.data = {
+            "components": [
+                {"name": "LED", "actions": ["on", "off"], "supersedes": ["on", "off"]}
+            ]
+        }
+        self.device.save()
+        scheduled = self.schedule(timedelta(seconds=-1))
+        scheduled.data = {"name": "LED", "action": "off"}
+        scheduled.save()
+        Command.objects.create(
+            author=self.user, device=self.device, data={"name": "LED", "action": "on"}
+        )
+        self.scheduler.load(self.now)
+        self.scheduler.run_due(timezone.now())
+
+        self.assertEqual(list(Command.objects.pending_for(self.user)), [scheduled])
+
+    def test_only_schedules_within_horizon_are_loaded(self):
+        soon = self.schedule(timedelta(minutes=5))
+        self.schedule(timedelta(hours=2))
+
+        self.scheduler.load(self.now)
+
+        self.assertEqual(self.scheduler.heap, [(soon.scheduled_at, soon.id)])
+        self.assertEqual(self.scheduler.run_due(self.now), 0)
+
+    def test_repeating_schedule_creates_occurrence_and_is_rearmed(self):
+        template = self.schedule(timedelta(seconds=-1), timedelta(minutes=1))
+        first_fire = template.scheduled_at
+
+        self.scheduler.load(self.now)
+        self.scheduler.run_due(self.now)
+
+        template.refresh_from_db()
+        self.assertEqual(template.scheduled_at, first_fire + timedelta(minutes=1))
+        self.assertFalse(template.executed)
+        self.assertEqual(Command.objects.pending_for(self.user).count(), 1)
+        self.assertIn((template.scheduled_at, template.id), self.scheduler.heap)
+
+        self.scheduler.run_due(template.scheduled_at)
+        self.assertEqual(Command.objects.pending_for(self.user).count(), 2)
+
+    def test_missed_occurrences_are_skipped(self):
+        template = self.schedule(timedelta(minutes=-30), timedelta(minutes=1))
+
+        self.scheduler.load(self.now)
+        self.scheduler.run_due(self.now)
+
+        template.refresh_from_db()
+        self.assertGreater(template.scheduled_at, self.now)
+        self.assertEqual(Command.objects.pending_for(self.user).count(), 1)
+
+    def test_rescheduled_command_is_not_fired_at_old_time(self):
+        command = self.schedule(timedelta(seconds=-1))
+        self.scheduler.load(self.now)
+        Command.objects.filter(pk=command.pk).update(
+            scheduled_at=self.now + timedelta(hours=1)
+        )
+
+        self.assertEqual(self.scheduler.run_due(self.now), 0)
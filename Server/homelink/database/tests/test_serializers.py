@@ -2,6 +2,7 @@ from django.test import TestCase
 from rest_framework.test import APIRequestFactory
 from django.contrib.auth import get_user_model
 from datetime import timedelta
+from django.utils import timezone
 from ..models.models import Space, Device, Command, CommandsLink
 from ..serializers import (
     UserSerializer,
@@ -115,4 +116,52 @@ class CommandsLinkSerializerTest(TestCase):
             owner=self.user, triggers=[], results=[], ttl=timedelta(seconds=3600)
         )
         serializer = CommandsLinkSerializer(commands_link)
-        self.assertEqual(serializer.data["ttl"], "01:00:00")
\ No newline at end of file
+        self.assertEqual(serializer.data["ttl"], "01:00:00")
+
+    def test_commands_link_serializer_round_trips_trigger_state(self):
+        satisfied_at = timezone.now()
+        data = {
+            "triggers": [
+                {
+                    "device_id": 1,
+                    "component_name": "LED",
+                    "action": "on",
+                    "satisfied_at": f"{satisfied_at}",
+                }
+            ],
+            "results": [{"device_id": 1, "data": {"name": "LED", "action": "off"}}],
+            "ttl": "00:01:00",
+            "owner": self.user.pk,
+        }
+        serializer = CommandsLinkSerializer(data=data)
+        self.assertTrue(serializer.is_valid())
+        commands_link = serializer.save()
+
+        self.assertEqual(
+            CommandsLinkSerializer(commands_link).data["triggers"], data["triggers"]
+        )
+
+    def test_commands_link_serializer_coerces_device_ids(self):
+        data = {
+            "triggers": [{"device_id": "1", "component_name": "LED", "action": "on"}],
+            "results": [{"device_id": "2", "data": {"name": "LED", "action": "off"}}],
+            "owner": self.user.pk,
+        }
+        serializer = CommandsLinkSerializer(data=data)
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data["results"][0]["device_id"], 2)
+
+        data["results"][0]["device_id"] = "lamp"
+        serializer = CommandsLinkSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("results", serializer.errors)
+
+    def test_commands_link_serializer_requires_trigger_component_and_action(self):
+        data = {
+            "triggers": [{"device_id": 1, "component_name": "LED"}],
+            "results": [],
+            "owner": self.user.pk,
+        }
+        serializer = CommandsLinkSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("triggers", serializer.errors)
@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import json
+from unittest import mock
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from ..models.models import Device, Command, DeviceEvent
+from ..notifications import CommandNotifier, command_notifier, user_key
+from ..sockets import command_socket
+
+User = get_user_model()
+
+
+@mock.patch.object(CommandNotifier, "_uses_postgres", lambda self: False)
+@mock.patch("database.sockets.close_old_connections", lambda: None)
+class CommandSocketTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.account = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.device = Device.objects.create(
+            name="Pico", owner=self.owner, account=self.account
+        )
+
+    async def connect(self, password="password"):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        credentials = base64.b64encode(f"pico:{password}".encode())
+        scope = {
+            "type": "websocket",
+            "path": "/ws/commands/",
+            "query_string": b"",
+            "headers": [(b"authorization", b"Basic " + credentials)],
+        }
+        self.task = asyncio.ensure_future(
+            command_socket(scope, self.inbox.get, self.outbox.put)
+        )
+        await self.inbox.put({"type": "websocket.connect"})
+        return await asyncio.wait_for(self.outbox.get(), 1)
+
+    async def send(self, payload):
+        await self.inbox.put({"type": "websocket.receive", "text": json.dumps(payload)})
+
+    async def recv(self):
+        message = await asyncio.wait_for(self.outbox.get(), 1)
+        return json.loads(message["text"])
+
+    async def disconnect(self):
+        await self.inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self.task, 1)
+
+    async def test_rejects_invalid_credentials(self):
+        message = await self.connect(password="wrong")
+
+        self.assertEqual(message, {"type": "websocket.close", "code": 4401})
+
+    async def test_pushes_pending_and_new_commands(self):
+        pending = await Command.objects.acreate(
+            author=self.owner, device=self.device, data={"name": "LED", "action": "on"}
+        )
+
+        self.assertEqual((await self.connect())["type"], "websocket.accept")
+        self.assertEqual(
+            await self.recv(),
+            {"type": "commands", "commands": [{"id": pending.id, "data": pending.data}]},
+        )
+
+        new = await Command.objects.acreate(
+            author=self.owner, device=self.device, data={"name": "LED", "action": "off"}
+        )
+        command_notifier.dispatch([user_key(self.account.pk)])
+
+        self.assertEqual(
+            await self.recv(),
+            {"type": "commands", "commands": [{"id": new.id, "data": new.data}]},
+        )
+        await self.disconnect()
+
+    async def test_ack_marks_commands_executed(self):
+        command = await Command.objects.acreate(
+            author=self.owner, device=self.device, data={"name": "LED", "action": "on"}
+        )
+        await self.connect()
+        await self.recv()
+
+        await self.send({"type": "ack", "ids": [command.id]})
+
+        self.assertEqual(await self.recv(), {"type": "acked", "ids": [command.id]})
+        await command.arefresh_from_db()
+        self.assertTrue(command.executed)
+        await self.disconnect()
+
+    async def test_event_is_recorded_as_device_event(self):
+        await self.connect()
+
+        await self.send(
+            {"type": "event", "data": {"name": "Movement detector", "action": "detected"}}
+        )
+
+        message = await self.recv()
+        self.assertEqual(message["type"], "event_accepted")
+        event = await DeviceEvent.objects.aget(id=message["id"])
+        self.assertEqual(event.device_id, self.device.id)
+        self.assertFalse(await Command.objects.filter(self_execute=True).aexists())
+        await self.disconnect()
@@ -0,0 +1,139 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..models.models import Device, Command, CommandsLink
+from ..notifications import CommandNotifier
+
+User = get_user_model()
+
+
+class CommandLeaseTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.account = User.objects.create_user(
+            username="pico", password="password", is_device=True, owner=self.owner
+        )
+        self.device = Device.objects.create(
+            name="Pico", owner=self.owner, account=self.account
+        )
+        self.commands = [
+            Command.objects.create(
+                author=self.owner,
+                device=self.device,
+                data={"name": "LED", "action": action},
+            )
+            for action in ["on", "off"]
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.account)
+
+    def test_leased_commands_are_hidden_from_other_polls(self):
+        response = self.client.post("/api/commands/lease/", {"limit": 1})
+
+        self.assertEqual(
+            response.data, [{"id": self.commands[0].id, "data": self.commands[0].data}]
+        )
+        self.assertEqual(
+            list(Command.objects.pending_for(self.account)), [self.commands[1]]
+        )
+        self.assertEqual(
+            [c.id for c in Command.objects.lease_for(self.account)],
+            [self.commands[1].id],
+        )
+        self.assertEqual(Command.objects.lease_for(self.account), [])
+
+    def test_expired_lease_is_delivered_again(self):
+        Command.objects.lease_for(self.account)
+        Command.objects.update(leased_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(len(Command.objects.lease_for(self.account)), 2)
+
+    def test_poll_wakes_up_when_a_lease_expires(self):
+        self.assertEqual(Command.objects.poll_timeout_for(self.account, 120), 120)
+
+        Command.objects.lease_for(self.account, visibility_timeout=5)
+
+        self.assertLessEqual(Command.objects.poll_timeout_for(self.account, 120), 5)
+
+    @mock.patch.object(CommandNotifier, "_uses_postgres", lambda self: False)
+    def test_waiting_poll_gets_commands_of_expired_lease(self):
+        Command.objects.lease_for(self.account, visibility_timeout=1)
+        started = time.monotonic()
+
+        response = self.client.get("/api/commands/")
+
+        self.assertEqual(len(response.data), 2)
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_ack_marks_commands_executed_and_checks_triggers(self):
+        leased = self.client.post("/api/commands/lease/").data
+
+        with mock.patch.object(
+            CommandsLink, "check_triggers_batch"
+        ) as check_triggers, CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/commands/ack/", {"ids": [c["id"] for c in leased]}, format="json"
+            )
+
+        self.assertEqual(response.data["acked"], [c.id for c in self.commands])
+        self.assertEqual(
+            len([q for q in queries if q["sql"].startswith("UPDATE")]), 1
+        )
+        check_triggers.assert_called_once_with(
+            [(self.device.id, c.data) for c in self.commands]
+        )
+        self.assertFalse(Command.objects.filter(executed=False).exists())
+
+    def test_ack_evaluates_links_for_the_whole_batch(self):
+        CommandsLink.objects.create(
+            triggers=[
+                {
+                    "device_id": self.device.id,
+                    "component_name": "LED",
+                    "action": action,
+                    "satisfied_at": None,
+                }
+                for action in ["on", "off"]
+            ],
+            results=[
+                {"device_id": self.device.id, "data": {"name": "LED", "action": "toggle"}}
+            ],
+            owner=self.owner,
+        )
+
+        self.client.post(
+            "/api/commands/ack/", {"ids": [c.id for c in self.commands]}, format="json"
+        )
+
+        self.assertTrue(
+            Command.objects.filter(data={"name": "LED", "action": "toggle"}).exists()
+        )
+
+    def test_ack_ignores_commands_of_other_users(self):
+        stranger = User.objects.create_user(username="stranger", password="password")
+        self.client.force_authenticate(stranger)
+
+        response = self.client.post(
+            "/api/commands/ack/", {"ids": [self.commands[0].id]}, format="json"
+        )
+
+        self.assertEqual(response.data["acked"], [])
+        self.assertFalse(Command.objects.filter(executed=True).exists())
+
+    def test_invalid_ids_and_limits_are_rejected(self):
+        for path, data in [
+            ("/api/commands/ack/", {"ids": ["first"]}),
+            ("/api/commands/ack/", {"ids": [{"id": 1}]}),
+            ("/api/commands/lease/", {"limit": "many"}),
+            ("/api/commands/lease/", {"limit": -1}),
+            ("/api/commands/lease/", {"visibility_timeout": 10**12}),
+        ]:
+            response = self.client.post(path, data, format="json")
+            self.assertEqual(response.status_code, 400, data)
@@ -1,5 +1,6 @@
 from django.urls import path
 from .views import *
+from .async_views import CommandPollView
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -8,9 +9,11 @@ router.register("commands", CommandViewSet, basename="routed-commands")
 router.register("devices", DeviceViewSet, basename="routed-devices")
 router.register("commands-links", CommandsLinkViewSet, basename="commands-links")
 router.register("spaces", SpaceViewSet, basename="spaces")
+router.register("events", DeviceEventViewSet, basename="events")
 
 urlpatterns = [
     path("user/add/", UserViewSet.as_view({"post": "create"})),
+    path("device-key/", DeviceKeyView.as_view(), name="device_key"),
     path("devices/add/", DeviceViewSet.as_view({"post": "create"})),
     path("devices/get/", DeviceViewSet.as_view({"get": "list"})),
     path("spaces/add/", SpaceViewSet.as_view({"post": "create"})),
@@ -32,6 +35,8 @@ urlpatterns = [
     ),
     path("commands/add/", CommandViewSet.as_view({"post": "create"})),
     path("commands/get/", CommandViewSet.as_view({"get": "list"})),
+    path("commands/poll/", CommandPollView.as_view()),
+    path("link-events/stats/", LinkEventStatsView.as_view(), name="link_event_stats"),
 ]
 
 urlpatterns += router.urls
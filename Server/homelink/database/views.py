@@ -1,24 +1,31 @@
 import time
-import threading
 
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.utils import timezone
-from rest_framework import viewsets, status
+from rest_framework import exceptions, mixins, viewsets, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.db.models import Q
+from .access import device_access_cache
+from .authentication import make_device_key
+from .catalog import catalog_cache
+from .debounce import event_debouncer
 from .mixins import MultiSerializerMixin
+from .pagination import KeysetPagination
+from .notifications import command_notifier, user_key
 
-from .filters import DeviceFilter, CommandFilter
+from .filters import DeviceFilter, CommandFilter, CommandHistoryFilter
 from .models.models import *
 from .serializers import *
 from django_filters.rest_framework import DjangoFilterBackend
 
 User = get_user_model()
 
+# longest visibility_timeout a lease may ask for, in COMMAND_LEASE_TIMEOUTs
+MAX_LEASE_TIMEOUTS = 10
+
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -27,6 +34,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
 class SpaceDevicesView(viewsets.ModelViewSet):
     serializer_class = DeviceSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         space_id = self.kwargs["space_id"]
@@ -50,13 +58,22 @@ class DeviceViewSet(viewsets.ModelViewSet, MultiSerializerMixin):
     }
     filter_backends = [DjangoFilterBackend]
     filterset_class = DeviceFilter
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         if self.request.query_params.get("spaceless", None):
             return Device.objects.filter(owner=self.request.user).filter(space=None)
         return Device.objects.filter(
-            Q(owner=self.request.user) | Q(space__users=self.request.user)
-        ).distinct()
+            id__in=device_access_cache.device_ids(self.request.user.pk)
+        )
+
+    @action(detail=False, methods=["get"])
+    def catalog(self, request):
+        """The compact device catalog used in LLM prompts and its size."""
+        catalog = catalog_cache.get(request.user.pk)
+        return Response(
+            {"devices": catalog.devices, "tokens": catalog.tokens, "hash": catalog.hash}
+        )
 
     def perform_create(self, serializer):
         try:
@@ -69,6 +86,7 @@ class DeviceViewSet(viewsets.ModelViewSet, MultiSerializerMixin):
 
 class SpaceViewSet(viewsets.ModelViewSet):
     serializer_class = SpaceSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Space.objects.filter(users=self.request.user)
@@ -80,92 +98,217 @@ class SpaceViewSet(viewsets.ModelViewSet):
 class CommandViewSet(viewsets.ModelViewSet):
     serializer_class = CommandSerializer
     filter_backends = [DjangoFilterBackend]
-    filterset_class = CommandFilter
+    pagination_class = KeysetPagination
+
+    def is_archive_request(self):
+        # ?all=1&archived=1 lists the archived history (read-only)
+        return bool(
+            self.request.query_params.get("all", None)
+            and self.request.query_params.get("archived", None)
+            and self.request.method == "GET"
+        )
+
+    @property
+    def filterset_class(self):
+        return CommandHistoryFilter if self.is_archive_request() else CommandFilter
 
     def get_serializer(self, *args, **kwargs):
+        if self.is_archive_request():
+            return CommandHistorySerializer(*args, **kwargs)
         if self.request.query_params.get("all", None):
             return CommandSerializer(*args, **kwargs)
         else:
             return CommandForDeviceSerializer(*args, **kwargs)
 
     def get_queryset(self):
-        xd = timezone.now() + timezone.timedelta(hours=1)
-        qs = Command.objects.filter(
-            Q(device__owner=self.request.user.pk)
-            | Q(device__account=self.request.user.pk)
+        if self.is_archive_request():
+            return (
+                CommandHistory.objects.filter(
+                    Q(device__owner=self.request.user.pk)
+                    | Q(device__account=self.request.user.pk)
+                )
+                .select_related("device")
+                .order_by("-created_at")
+            )
+        if self.request.query_params.get("all", None):
+            return Command.objects.for_user(self.request.user).select_related("device")
+        return Command.objects.pending_for(self.request.user)
+
+    def get_target_device(self, serializer):
+        return (
+            serializer.validated_data["device"]
+            if serializer.validated_data.get("device")
+            else self.request.user.account_devices.first()
         )
 
-        if self.request.query_params.get("all", None):
-            return qs
-        return qs.filter(executed=False).filter(
-            Q(scheduled_at__isnull=True) | Q(scheduled_at__lte=xd)
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        device = self.get_target_device(serializer)
+        if (
+            serializer.validated_data.get("self_execute")
+            and device is not None
+            and not event_debouncer.accept(device.pk, serializer.validated_data["data"])
+        ):
+            return Response({"debounced": True})
+
+        self.perform_create(serializer, device)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
         )
 
-    def perform_create(self, serializer):
+    def perform_create(self, serializer, device=None):
         serializer.save(
             author=(
                 self.request.user.owner
                 if self.request.user.is_device
                 else self.request.user
             ),
-            device=(
-                serializer.validated_data["device"]
-                if serializer.validated_data.get("device")
-                else self.request.user.account_devices.first()
-            ),
+            device=device or self.get_target_device(serializer),
         )
 
     def perform_destroy(self, instance: Command):
         if self.request.query_params.get("cancel", None):
             instance.delete()
             return
-        CommandsLink.check_triggers(instance.device.pk, instance.data)
-        instance.executed = True
-        instance.save()
+        instance.acknowledge()
+
+    @action(detail=False, methods=["post"])
+    def lease(self, request):
+        try:
+            visibility_timeout = int(request.data.get("visibility_timeout", 0))
+            limit = int(request.data["limit"]) if request.data.get("limit") else None
+            if visibility_timeout < 0 or (limit is not None and limit < 1):
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "visibility_timeout and limit must be positive integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        max_timeout = MAX_LEASE_TIMEOUTS * settings.COMMAND_LEASE_TIMEOUT
+        if visibility_timeout > max_timeout:
+            return Response(
+                {"error": f"visibility_timeout must be at most {max_timeout}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        commands = Command.objects.lease_for(
+            request.user, visibility_timeout=visibility_timeout, limit=limit
+        )
+        return Response(CommandForDeviceSerializer(commands, many=True).data)
+
+    @action(detail=False, methods=["post"])
+    def ack(self, request):
+        ids = request.data.get("ids")
+        try:
+            if not isinstance(ids, list):
+                raise TypeError
+            ids = [int(id) for id in ids]
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "ids must be a list of command ids"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        acked = Command.objects.for_user(request.user).filter(id__in=ids).acknowledge()
+        return Response({"acked": acked})
 
     def list(self, request, *args, **kwargs):
         if request.query_params.get("all", None):
             return super().list(request, *args, **kwargs)
         try:
             timeout = 120
-            result = []
-            stop_event = threading.Event()
+            deadline = time.monotonic() + timeout
 
-            def check_queryset():
-                nonlocal result
-                start_time = time.time()
-                while time.time() - start_time < timeout:
+            # subscribe before the first query so a command created in between is not missed
+            with command_notifier.listen([user_key(request.user.pk)]) as woken:
+                while True:
                     queryset = self.filter_queryset(self.get_queryset())
-                    if queryset.exists():
-                        result = self.get_serializer(queryset, many=True).data
-                        stop_event.set()
-                        break
-                    time.sleep(1)
+                    result = self.get_serializer(queryset, many=True).data
+                    if result:
+                        return Response(result)
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return Response([])
+                    woken.wait(
+                        Command.objects.poll_timeout_for(request.user, remaining)
+                    )
+                    woken.clear()
+        except:
+            return Response([])
 
-            thread = threading.Thread(target=check_queryset)
-            thread.start()
 
-            thread.join(timeout)
+class DeviceEventViewSet(
+    mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet
+):
+    """Input events reported by devices. Accepts one event or a list of them,
+    all of them for the same device."""
 
-            if not result:
-                return Response([])
+    serializer_class = DeviceEventSerializer
 
-            return Response(result)
-        except:
-            return Response([])
+    def get_queryset(self):
+        queryset = DeviceEvent.objects.filter(
+            Q(device__owner=self.request.user.pk)
+            | Q(device__account=self.request.user.pk)
+        ).order_by("-created_at")
+        if self.request.query_params.get("device"):
+            try:
+                device = int(self.request.query_params["device"])
+            except ValueError:
+                raise exceptions.ValidationError({"device": "Must be a device id."})
+            queryset = queryset.filter(device=device)
+        return queryset
 
+    def create(self, request, *args, **kwargs):
+        many = isinstance(request.data, list)
+        serializer = self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        events = serializer.validated_data if many else [serializer.validated_data]
+        if not events:
+            return Response(
+                {"error": "At least one event is required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-@receiver(post_save, sender=Command)
-def command_post_save(sender, instance, created, **kwargs):
-    if created and instance.self_execute:
-        CommandViewSet().perform_destroy(instance)
+        devices = {event.get("device") for event in events}
+        if len(devices) > 1:
+            return Response(
+                {"error": "All events must belong to the same device"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        device = devices.pop() or request.user.account_devices.first()
+        if device is None:
+            return Response(
+                {"error": "device is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.user.pk not in (
+            device.owner_id,
+            device.account_id,
+        ):
+            return Response(
+                {"error": "Device not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        accepted = [
+            event["data"]
+            for event in events
+            if event_debouncer.accept(device.pk, event["data"])
+        ]
+        if not accepted:
+            return Response([] if many else {"debounced": True})
+
+        created = DeviceEvent.objects.record(device, accepted)
+        data = DeviceEventSerializer(created, many=True).data
+        return Response(data if many else data[0], status=status.HTTP_201_CREATED)
 
 
 class CommandsLinkViewSet(viewsets.ModelViewSet):
     serializer_class = CommandsLinkSerializer
 
     def get_queryset(self):
-        return CommandsLink.objects.filter(owner=self.request.user.pk)
+        return CommandsLink.objects.filter(owner=self.request.user.pk).prefetch_related(
+            "trigger_rows"
+        )
 
     def create(self, request, *args, **kwargs):
         request.data["owner"] = request.user.pk
@@ -247,3 +390,25 @@ class SpaceUsersView(APIView):
         users = space.users.all()  # Retrieve all users associated with the space
         serializer = UserSerializer(users, many=True)  # Serialize the list of users
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class DeviceKeyView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not request.user.is_device:
+            return Response(
+                {"error": "Only device accounts have a device key"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            {"id": request.user.pk, "device_key": make_device_key(request.user)},
+            status=status.HTTP_200_OK,
+        )
+
+
+class LinkEventStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(LinkEvent.objects.stats(), status=status.HTTP_200_OK)
@@ -13,4 +13,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'homelink.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from database.sockets import command_socket  # noqa: E402
+
+websocket_routes = {
+    "/ws/commands/": command_socket,
+}
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        handler = websocket_routes.get(scope["path"])
+        if handler is None:
+            await receive()
+            await send({"type": "websocket.close", "code": 4404})
+            return
+        return await handler(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,179 @@
+import asyncio
+
+import jiter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai import AsyncOpenAI
+
+from .llm import (
+    MODEL,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    ModelResponse,
+    apply_model_response,
+    chat_messages,
+    get_device_catalog,
+    prompt_time,
+)
+from .response_cache import response_cache, response_key
+
+
+def partial_text(content):
+    """The `text` field of a structured answer that is still being generated.
+    The SDK only parses finished strings, so the text would arrive at once."""
+    try:
+        parsed = jiter.from_json(content.encode(), partial_mode="trailing-strings")
+    except ValueError:
+        return ""
+    text = parsed.get("text") if isinstance(parsed, dict) else None
+    return text if isinstance(text, str) else ""
+
+
+class Flight:
+    """One upstream completion, shared by every caller that asked the same
+    prompt while it was running. Keeps the streamed text so that a caller
+    joining late first receives what was already streamed."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.text = ""
+        self._changed = asyncio.Condition()
+
+    async def push(self, chunk):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, text=None, error=None):
+        async with self._changed:
+            self.done = True
+            self.text = text
+            self.error = error
+            self._changed.notify_all()
+
+    async def follow(self):
+        """Yields the streamed chunks, then raises the upstream error if any."""
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: self.done or len(self.chunks) > position
+                )
+                chunks = self.chunks[position:]
+                done = self.done
+            position += len(chunks)
+            for chunk in chunks:
+                yield chunk
+            if done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class ChatPipeline:
+    """Async chat with the model for ASGI views.
+
+    At most `max_concurrency` completions run at once and the chats of one
+    user are handled one after another, so their commands are created in
+    order. Identical prompts of a user that arrive while the first one is
+    still running share its completion and its side effects happen once.
+    The `text` field of the structured answer is streamed as it is generated.
+    """
+
+    def __init__(self, client=None, max_concurrency=None):
+        self._client = client
+        self.max_concurrency = max_concurrency or settings.LLM_MAX_CONCURRENCY
+        self._loop = None
+        self._flights = {}
+        self._user_locks = {}
+        # the event loop keeps only weak references to tasks
+        self._tasks = set()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+        return self._client
+
+    def _bind_loop(self):
+        # asyncio primitives belong to the loop they were created in
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._flights = {}
+            self._user_locks = {}
+
+    async def stream(self, messages, user):
+        """Yields pieces of the answer text, for `messages` in the model format."""
+        self._bind_loop()
+        catalog = await sync_to_async(get_device_catalog)(user)
+        now = prompt_time(messages)
+        key = response_key("chat", user.pk, catalog.hash, messages, now=now)
+        cached = response_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = Flight()
+            # runs on its own, so a disconnecting client does not cancel it
+            # for the others
+            task = asyncio.ensure_future(
+                self._run(key, flight, messages, catalog, now, user)
+            )
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        async for chunk in flight.follow():
+            yield chunk
+
+    async def _run(self, key, flight, messages, catalog, now, user):
+        # [lock, number of runs holding or waiting for it]
+        user_lock = self._user_locks.setdefault(user.pk, [asyncio.Lock(), 0])
+        user_lock[1] += 1
+        try:
+            async with user_lock[0], self._semaphore:
+                response = await self._complete(flight, messages, catalog, now)
+                await sync_to_async(apply_model_response)(response, user)
+        except Exception as e:
+            await flight.finish(error=e)
+        else:
+            if (
+                not response.commands_to_execute
+                and not response.device_data_to_override
+            ):
+                response_cache.set(key, response.text, settings.CHAT_RESPONSE_CACHE_TTL)
+            await flight.finish(text=response.text)
+        finally:
+            self._flights.pop(key, None)
+            user_lock[1] -= 1
+            if not user_lock[1]:
+                self._user_locks.pop(user.pk, None)
+
+    async def _complete(self, flight, messages, catalog, now):
+        streamed = ""
+        async with self.client.beta.chat.completions.stream(
+            model=MODEL,
+            messages=chat_messages(messages, catalog, now),
+            response_format=ModelResponse,
+        ) as stream:
+            async for event in stream:
+                if event.type != "content.delta":
+                    continue
+                text = partial_text(event.snapshot)
+                if len(text) > len(streamed):
+                    await flight.push(text[len(streamed) :])
+                    streamed = text
+            completion = await stream.get_final_completion()
+
+        response = completion.choices[0].message.parsed
+        if len(response.text) > len(streamed):
+            await flight.push(response.text[len(streamed) :])
+        return response
+
+
+chat_pipeline = ChatPipeline()
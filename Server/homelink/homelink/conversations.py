@@ -0,0 +1,79 @@
+from django.conf import settings
+
+from database.models.models import Conversation, estimate_tokens
+from .llm import summarize_conversation
+
+DROP = "drop"
+SUMMARIZE = "summarize"
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def recent_messages(conversation, budget):
+    """The newest messages after the summary that fit in `budget` tokens,
+    oldest first, and whether older ones were left out. The newest message
+    is always kept."""
+    kept = []
+    used = 0
+    messages = conversation.messages.filter(
+        id__gt=conversation.summarized_until
+    ).order_by("-id")
+    for message in messages.iterator(chunk_size=50):
+        if kept and used + message.tokens > budget:
+            kept.reverse()
+            return kept, True
+        kept.append(message)
+        used += message.tokens
+    kept.reverse()
+    return kept, False
+
+
+def conversation_prompt(conversation, budget=None, strategy=None):
+    """The messages of `conversation` to send to the model, within `budget`
+    tokens (CHAT_HISTORY_TOKENS).
+
+    With the "drop" strategy the oldest messages are left out. With
+    "summarize" they are folded into the conversation summary, which is sent
+    as a system message. Summarizing keeps only half of the budget of recent
+    messages, so the summary is rewritten every few turns rather than on
+    each one. The LLM writes the summary outside of any transaction. When
+    concurrent messages summarize at once, the first stored summary is kept.
+    """
+    budget = budget or settings.CHAT_HISTORY_TOKENS
+    strategy = strategy or settings.CHAT_HISTORY_STRATEGY
+    if strategy not in (DROP, SUMMARIZE):
+        raise ValueError(f"Unknown chat history strategy {strategy!r}")
+    while True:
+        summary_tokens = estimate_tokens(conversation.summary)
+        messages, truncated = recent_messages(conversation, budget - summary_tokens)
+        if not truncated or strategy != SUMMARIZE:
+            break
+        messages, _ = recent_messages(conversation, budget // 2)
+        folded = list(
+            conversation.messages.filter(
+                id__gt=conversation.summarized_until, id__lt=messages[0].id
+            ).order_by("id")
+        )
+        if not folded:
+            break
+        summary = summarize_conversation(
+            conversation.summary,
+            [message.to_prompt() for message in folded],
+            max_tokens=budget // 4,
+        )
+        # written only if no other message of the conversation summarized it
+        # in the meantime, otherwise the prompt is built on that summary
+        if Conversation.objects.filter(
+            pk=conversation.pk, summarized_until=conversation.summarized_until
+        ).update(summary=summary, summarized_until=folded[-1].id):
+            conversation.summary = summary
+            conversation.summarized_until = folded[-1].id
+            break
+        conversation.refresh_from_db(fields=["summary", "summarized_until"])
+
+    prompt = [message.to_prompt() for message in messages]
+    if conversation.summary:
+        prompt.insert(
+            0, {"role": "system", "content": SUMMARY_PREFIX + conversation.summary}
+        )
+    return prompt
@@ -0,0 +1,130 @@
+import re
+import threading
+from collections import OrderedDict
+
+WORD = re.compile(r"\w+")
+
+# messages with these words need the LLM: schedules, conditions, several
+# actions at once or questions about the current state
+LLM_WORDS = frozenset("""
+    at after before every each daily tomorrow tonight today later until when if
+    then and also second seconds minute minutes hour hours schedule repeat
+    what which why how is are does status not no never don dont
+    """.split())
+
+
+def tokenize(text):
+    return WORD.findall(text.lower())
+
+
+def contains(tokens, words):
+    """Whether `words` occur in `tokens` as a contiguous run."""
+    size = len(words)
+    return any(tokens[i : i + size] == words for i in range(len(tokens) - size + 1))
+
+
+class Intent:
+    __slots__ = ("device_id", "device_name", "component", "action")
+
+    def __init__(self, device_id, device_name, component, action):
+        self.device_id = device_id
+        self.device_name = device_name
+        self.component = component
+        self.action = action
+
+    @property
+    def data(self):
+        return {"name": self.component, "action": self.action}
+
+    def __repr__(self):
+        return f"Intent({self.device_name!r}, {self.component!r}, {self.action!r})"
+
+
+class IntentMatcher:
+    """Resolves simple commands ("turn on the LED in the kitchen") without the LLM.
+
+    The device catalog is compiled into an index of action words -> (device,
+    component, action) candidates. A message matches when exactly one
+    candidate has its action and component name in the message, using the
+    words of the device name to choose between devices with the same
+    component. Anything else, including components that take free-form
+    input, is left to the LLM.
+    """
+
+    def __init__(self, catalog):
+        self.index = {}
+        for device in catalog.devices:
+            device_words = tokenize(device["name"])
+            for component in device["components"]:
+                if component.get("input"):
+                    continue
+                component_words = tokenize(component["name"])
+                for action in component["actions"]:
+                    action_words = tokenize(action)
+                    if not action_words:
+                        continue
+                    self.index.setdefault(action_words[0], []).append(
+                        (
+                            action_words,
+                            component_words,
+                            device_words,
+                            Intent(
+                                device["id"], device["name"], component["name"], action
+                            ),
+                        )
+                    )
+
+    def match(self, text):
+        tokens = tokenize(text)
+        if not tokens or "?" in text or LLM_WORDS.intersection(tokens):
+            return None
+
+        candidates = [
+            (device_words, intent)
+            for token in set(tokens)
+            for action_words, component_words, device_words, intent in self.index.get(
+                token, ()
+            )
+            if contains(tokens, action_words) and contains(tokens, component_words)
+        ]
+        if len(candidates) > 1:
+            # keep the devices whose name shares the most words with the message
+            words = set(tokens)
+            scores = [
+                len(words.intersection(device_words)) for device_words, _ in candidates
+            ]
+            best = max(scores)
+            candidates = [
+                candidate
+                for candidate, score in zip(candidates, scores)
+                if best and score == best
+            ]
+        if len(candidates) != 1:
+            return None
+        return candidates[0][1]
+
+
+class MatcherCache:
+    """Compiled matchers by catalog hash, least recently used evicted first."""
+
+    def __init__(self, size=256):
+        self.size = size
+        self._lock = threading.Lock()
+        self._matchers = OrderedDict()
+
+    def get(self, catalog):
+        with self._lock:
+            matcher = self._matchers.get(catalog.hash)
+            if matcher is not None:
+                self._matchers.move_to_end(catalog.hash)
+                return matcher
+
+        matcher = IntentMatcher(catalog)
+        with self._lock:
+            self._matchers[catalog.hash] = matcher
+            while len(self._matchers) > self.size:
+                self._matchers.popitem(last=False)
+        return matcher
+
+
+matcher_cache = MatcherCache()
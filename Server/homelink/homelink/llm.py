@@ -1,14 +1,17 @@
 import os
-import json
+import re
 
+from django.conf import settings
 from openai import OpenAI
 from dotenv import load_dotenv
 
 from typing import List, Optional
 from pydantic import BaseModel
 
-from database.serializers import DeviceSerializer
+from database.catalog import DeviceCatalog, catalog_cache
 from database.models.models import Command, Device
+from .intents import matcher_cache
+from .response_cache import response_cache, response_key
 
 from datetime import datetime
 
@@ -20,7 +23,47 @@ MODEL = os.getenv("MODEL")
 if not OPENAI_API_KEY or not MODEL:
     raise Exception("OpenAI API Key and Model must be set in .env file")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# OPENAI_BASE_URL points the clients at another OpenAI compatible API
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+# digits and words of time expressions, in English and Polish
+TIME_WORDS = re.compile(
+    r"\d|\b(time|date|day|today|tomorrow|tonight|yesterday|now|when|hour|minute"
+    r"|second|morning|afternoon|evening|night|noon|midnight|week|month|year"
+    r"|schedul|every|later|o'clock|czas|godzin|minut|sekund|dzi|jutr|wczoraj"
+    r"|teraz|kiedy|rano|wiecz|noc|południ|tydz|tygodni|miesi|rok|codzienn|późn)",
+    re.IGNORECASE,
+)
+
+CATALOG_FORMAT = (
+    "Devices are listed as JSON with their components and the actions they accept. "
+    'A component marked "input" accepts any string as action, "output" marks components '
+    "that report events. "
+)
+
+
+def get_device_catalog(user=None, devices=None):
+    if devices is not None:
+        return DeviceCatalog.from_devices(devices)
+    return catalog_cache.get(user.pk)
+
+
+def execute_simple_command(text, user):
+    """Creates the command for a message the intent matcher resolves without
+    the LLM. Returns the reply, or `None` if the LLM is needed."""
+    intent = matcher_cache.get(get_device_catalog(user)).match(text)
+    if intent is None:
+        return None
+
+    Command.objects.create(
+        author=user,
+        device=Device.objects.get(id=intent.device_id),
+        description=f"{intent.component} {intent.action}",
+        data=intent.data,
+    )
+    return f"{intent.component} {intent.action} sent to {intent.device_name}."
 
 
 class CommandData(BaseModel):
@@ -36,10 +79,12 @@ class CommandClass(BaseModel):
 
 
 class ComponentData(BaseModel):
+    """A component as written in the device catalog. "output" is left out,
+    the model may not change it."""
+
     name: str
     actions: List[str]
-    is_output: bool
-    has_input_action: bool
+    input: bool
 
 
 class DeviceData(BaseModel):
@@ -56,34 +101,94 @@ class ModelResponse(BaseModel):
 def get_structured_response(
     messages, response_format=ModelResponse, devices=None, user=None
 ):
-    d = DeviceSerializer(devices, many=True).data
+    catalog = get_device_catalog(user, devices)
+    now = prompt_time(messages)
+    key = response_key(
+        "chat", user.pk if user else None, catalog.hash, messages, now=now
+    )
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = ask_model(messages, catalog, response_format, now)
+    apply_model_response(response, user)
+    # answers that created commands or changed devices must be asked again
+    if not response.commands_to_execute and not response.device_data_to_override:
+        response_cache.set(key, response.text, settings.CHAT_RESPONSE_CACHE_TTL)
+    return response.text
+
+
+def ask_model(messages, catalog, response_format=ModelResponse, now=None):
     response = client.beta.chat.completions.parse(
         model=MODEL,
+        messages=chat_messages(messages, catalog, now),
+        response_format=response_format,
+    )
+    return response.choices[0].message.parsed
+
+
+def prompt_time(messages):
+    """The time told to the model, to the minute, or `None` if the last
+    message of the user does not look like it needs it. The time is part
+    of the cache key, so the answers to such messages are reused within the
+    same minute only, the others for CHAT_RESPONSE_CACHE_TTL."""
+    last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    if not TIME_WORDS.search(last):
+        return None
+    return datetime.now().replace(second=0, microsecond=0)
+
+
+def chat_messages(messages, catalog, now=None):
+    """The conversation with the system prompt describing the user's devices."""
+    return [
+        {
+            "role": "system",
+            "content": "You are a chatbot helping user with custom smart home system. "
+            "Actions to perform on user's request put in commands_to_execute field. "
+            + CATALOG_FORMAT
+            + "Here are the devices user can access: "
+            + catalog.text
+            + " "
+            "If you want to schedule command, set scheduled_at and repeat_interval if it should repeat. "
+            + (f"Current time is: {now}. " if now else "")
+            + "User can also edit configuration of devices, if you want to override device data, set device_data_to_override field. "
+            "Make sure to pass whole data, it will be used to override device data. "
+            "You can only change the actions of components, and input only if user asks to ("
+            "it makes the mobile app show an input field for the component)."
+            " Leave it empty if you don't want to override device data."
+            " New actions should be similar to existing ones. "
+            "Avoid responding with date when asked for current time only.",
+        },
+        *messages,
+    ]
+
+
+def summarize_conversation(summary, messages, max_tokens):
+    """Folds `messages` into the running `summary` of a conversation."""
+    transcript = "\n".join(
+        f"{message['role']}: {message['content']}" for message in messages
+    )
+    response = client.chat.completions.create(
+        model=MODEL,
+        max_tokens=max_tokens,
         messages=[
             {
                 "role": "system",
-                "content": "You are a chatbot helping user with custom smart home system. "
-                "Actions to perform on user's request put in commands_to_execute field."
-                "Here are the devices user can access: "
-                + json.dumps(d)
-                + "If device has has_input_action flag set to True, you can provide any string input value in the action field "
-                "If you want to schedule command, set scheduled_at and repeat_interval if it should repeat "
-                f"current time is: {datetime.now()}. "
-                "User can also edit configuration of devices, if you want to override device data, set device_data_to_override field. "
-                "Make sure to pass whole data, it will be used to override device data. "
-                "You can only change value for actions field and change has_input_action only if user asks too ("
-                "this field is used to check if mobile app should show user input field for any action)."
-                " Leave it empty if you don't want to override device data."
-                " New actions should be similar to existing ones, description may descibe the format. "
-                "Avoid responding with date when asked for current time only.",
+                "content": "Summarize the conversation between a user and the chatbot of a smart home system. "
+                "Keep the devices, preferences and requests that later messages may refer to, "
+                "drop small talk. Answer with the summary only.",
+            },
+            {
+                "role": "user",
+                "content": f"Summary so far: {summary or 'none'}\n\nNew messages:\n{transcript}",
             },
-            *messages,
         ],
-        response_format=response_format,
     )
-    response: ModelResponse = response.choices[0].message.parsed
-    text_response = response.text
+    return response.choices[0].message.content.strip()
+
 
+def apply_model_response(response: ModelResponse, user):
+    """Creates the commands and device changes requested by the model."""
     for command in response.commands_to_execute:
         device = Device.objects.get(id=command.device_id)
         Command.objects.create(
@@ -98,21 +203,30 @@ def get_structured_response(
     if response.device_data_to_override:
         try:
             device = Device.objects.get(id=response.device_data_to_override.id)
+            data = device.data if isinstance(device.data, dict) else {}
+            components = data.get("components")
+            # settings missing from the catalog (e.g. debounce, is_output) are kept
+            current = {
+                component.get("name"): component
+                for component in (components if isinstance(components, list) else [])
+                if isinstance(component, dict)
+            }
             device.data = {
+                **data,
                 "components": [
                     {
+                        "is_output": False,
+                        **current.get(c.name, {}),
                         "name": c.name,
                         "actions": c.actions,
-                        "is_output": c.is_output,
-                        "has_input_action": c.has_input_action,
+                        "has_input_action": c.input,
                     }
                     for c in response.device_data_to_override.components
-                ]
+                ],
             }
             device.save()
         except:
             pass
-    return text_response
 
 
 class Trigger(BaseModel):
@@ -158,17 +272,23 @@ class LinkResponse(BaseModel):
 
 
 def generate_suggested_links_for_user(user):
-    devices = user.get_user_devices()
+    catalog = get_device_catalog(user)
+    # suggestions only depend on the devices and have no side effects
+    key = response_key("links", user.pk, catalog.hash)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
     response = client.beta.chat.completions.parse(
         model=MODEL,
         messages=[
             {
                 "role": "system",
                 "content": "You are a chatbot helping user with custom smart home system. "
-                "Here are the devices user can access: "
-                + json.dumps(DeviceSerializer(devices, many=True).data)
-                + "If device has has_input_action flag set to True, you can provide any string input value in the action field "
-                "Keep satisfied_at as None",
+                + CATALOG_FORMAT
+                + "Here are the devices user can access: "
+                + catalog.text
+                + " Keep satisfied_at as None",
             },
             {
                 "role": "user",
@@ -180,4 +300,6 @@ def generate_suggested_links_for_user(user):
         ],
         response_format=LinkResponse,
     )
-    return response.choices[0].message.parsed.to_dict()
+    links = response.choices[0].message.parsed.to_dict()
+    response_cache.set(key, links, settings.LINKS_RESPONSE_CACHE_TTL)
+    return links
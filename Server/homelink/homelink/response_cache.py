@@ -0,0 +1,87 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_messages(messages):
+    return [
+        {
+            "role": message["role"],
+            "content": " ".join(message["content"].lower().split()),
+        }
+        for message in messages
+    ]
+
+
+def response_key(kind, user_id, catalog_hash, messages=(), now=None):
+    """Cache key of an LLM answer: the kind of request, the user, the device
+    catalog it was given, the normalized conversation and, for prompts that
+    tell the model the time, `now`."""
+    payload = json.dumps(
+        [
+            kind,
+            user_id,
+            catalog_hash,
+            normalize_messages(messages),
+            now and now.isoformat(),
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """In-process LRU cache of LLM answers with per-entry time to live.
+
+    Only answers without side effects may be stored: a cached chat answer is
+    returned as text and never creates commands or changes devices again.
+    Values are copied in and out so callers cannot modify a cached answer.
+    """
+
+    def __init__(self, size=512, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+response_cache = ResponseCache()
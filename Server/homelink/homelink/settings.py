@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import environ, os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -133,9 +135,56 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
+        "database.authentication.DeviceKeyAuthentication",
         "rest_framework.authentication.BasicAuthentication",
         "rest_framework.authentication.TokenAuthentication",
     ]
 }
 
 AUTH_USER_MODEL = "database.CustomUser"
+
+# "db" evaluates CommandsLink triggers with LinkTrigger queries, "memory" keeps
+# all links compiled in the process (see database/rules.py)
+COMMANDS_LINK_ENGINE = env("COMMANDS_LINK_ENGINE", default="db")
+
+# seconds a leased command stays hidden from other polls until it is acknowledged
+COMMAND_LEASE_TIMEOUT = env.int("COMMAND_LEASE_TIMEOUT", default=60)
+
+# cache shared by the server processes, e.g. "dbcache://homelink_cache" (run
+# `manage.py createcachetable`) or "rediscache://host:6379/0". The default
+# cache is per process, so cached device access is then kept for a few
+# seconds only (see database/access.py)
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# record device events in the LinkEvent outbox and evaluate CommandsLink
+# triggers in `manage.py run_link_worker` instead of during the request
+LINK_EVALUATION_QUEUE = env.bool("LINK_EVALUATION_QUEUE", default=False)
+
+# events of a device always go to partition device_id % LINK_EVENT_PARTITIONS,
+# which bounds how many workers can evaluate links in parallel
+LINK_EVENT_PARTITIONS = env.int("LINK_EVENT_PARTITIONS", default=16)
+
+# resolve simple chat commands ("turn on the LED") without calling the LLM
+INTENT_FAST_PATH = env.bool("INTENT_FAST_PATH", default=True)
+
+# seconds an LLM answer without side effects is reused for the same conversation
+# and device catalog (see homelink/response_cache.py). Messages that mention
+# times or dates are answered with the current time in the prompt and their
+# answers are reused within the same minute only
+CHAT_RESPONSE_CACHE_TTL = env.int("CHAT_RESPONSE_CACHE_TTL", default=300)
+LINKS_RESPONSE_CACHE_TTL = env.int("LINKS_RESPONSE_CACHE_TTL", default=86400)
+
+# chat completions the async pipeline runs at once per process; further chats
+# wait for a free slot (see homelink/async_llm.py)
+LLM_MAX_CONCURRENCY = env.int("LLM_MAX_CONCURRENCY", default=8)
+
+# tokens of conversation history sent with each chat message of a server-side
+# conversation. Older messages are left out ("drop") or folded into a summary
+# written by the LLM ("summarize"), see homelink/conversations.py
+CHAT_HISTORY_TOKENS = env.int("CHAT_HISTORY_TOKENS", default=2000)
+CHAT_HISTORY_STRATEGY = env("CHAT_HISTORY_STRATEGY", default="drop")
+if CHAT_HISTORY_STRATEGY not in ("drop", "summarize"):
+    raise ImproperlyConfigured(
+        f"CHAT_HISTORY_STRATEGY must be 'drop' or 'summarize', "
+        f"not {CHAT_HISTORY_STRATEGY!r}"
+    )
@@ -0,0 +1,219 @@
+import asyncio
+import json
+from datetime import datetime
+
+import httpx
+from django.core.cache import cache
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from openai import AsyncOpenAI
+from unittest import mock
+from database.access import device_access_cache
+from database.models.models import Command, Device
+from database.tests.test_async_views import basic_auth
+from ..async_llm import ChatPipeline
+from ..response_cache import response_cache
+
+UserModel = get_user_model()
+
+
+def chunk(content, finish_reason=None):
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "x",
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }
+        ],
+    }
+
+
+class FakeOpenAI:
+    """Streams `answer` as chat completion chunks of a few characters."""
+
+    def __init__(self, answer, delay=0):
+        self.answer = json.dumps(answer)
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def handle(self, request):
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        parts = [self.answer[i : i + 8] for i in range(0, len(self.answer), 8)]
+        lines = [f"data: {json.dumps(chunk(part))}\n\n" for part in parts]
+        lines.append(f"data: {json.dumps(chunk('', 'stop'))}\n\n")
+        lines.append("data: [DONE]\n\n")
+        return httpx.Response(
+            200,
+            content="".join(lines).encode(),
+            headers={"content-type": "text/event-stream"},
+        )
+
+    def client(self):
+        return AsyncOpenAI(
+            api_key="x",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)),
+        )
+
+
+def answer(text, commands=()):
+    return {
+        "text": text,
+        "commands_to_execute": list(commands),
+        "device_data_to_override": None,
+    }
+
+
+class ChatPipelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        response_cache.clear()
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+        self.device = Device.objects.create(
+            name="Pico",
+            owner=self.user,
+            data={"components": [{"name": "LED", "actions": ["on", "off"]}]},
+        )
+        # cached answers are keyed by the minute of the prompt
+        patcher = mock.patch(
+            "homelink.async_llm.prompt_time", return_value=datetime(2024, 6, 1, 12, 0)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def collect(self, pipeline, content, user=None):
+        messages = [{"role": "user", "content": content}]
+        return [chunk async for chunk in pipeline.stream(messages, user or self.user)]
+
+    async def test_text_is_streamed_in_pieces(self):
+        fake = FakeOpenAI(answer("You have one device called Pico."))
+
+        chunks = await self.collect(ChatPipeline(fake.client()), "What do I have?")
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), "You have one device called Pico.")
+
+    async def test_identical_concurrent_prompts_share_one_completion(self):
+        fake = FakeOpenAI(
+            answer(
+                "Done.",
+                [
+                    {
+                        "device_id": self.device.id,
+                        "data": {"name": "LED", "action": "on"},
+                        "scheduled_at": None,
+                        "repeat_interval": None,
+                    }
+                ],
+            ),
+            delay=0.1,
+        )
+        pipeline = ChatPipeline(fake.client())
+
+        results = await asyncio.gather(
+            self.collect(pipeline, "Turn on the LED"),
+            self.collect(pipeline, "turn on the  LED"),
+        )
+
+        self.assertEqual(["".join(chunks) for chunks in results], ["Done.", "Done."])
+        self.assertEqual(fake.calls, 1)
+        self.assertEqual(await Command.objects.acount(), 1)
+
+    async def test_runs_are_kept_until_they_finish(self):
+        fake = FakeOpenAI(answer("Hi."), delay=0.05)
+        pipeline = ChatPipeline(fake.client())
+
+        first = asyncio.ensure_future(self.collect(pipeline, "Hello"))
+        second = asyncio.ensure_future(self.collect(pipeline, "How are you?"))
+        while fake.calls < 1:
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(len(pipeline._tasks), 2)
+        self.assertEqual(pipeline._user_locks[self.user.pk][1], 2)
+        await asyncio.gather(first, second)
+        self.assertEqual(pipeline._tasks, set())
+        self.assertEqual(pipeline._user_locks, {})
+
+    async def test_concurrency_is_limited(self):
+        fake = FakeOpenAI(answer("Hi."), delay=0.05)
+        other = await UserModel.objects.acreate(username="other")
+        pipeline = ChatPipeline(fake.client(), max_concurrency=1)
+
+        await asyncio.gather(
+            self.collect(pipeline, "Hello"),
+            self.collect(pipeline, "Hello", user=other),
+        )
+
+        self.assertEqual(fake.calls, 2)
+        self.assertEqual(fake.max_running, 1)
+
+    async def test_answers_without_side_effects_are_cached(self):
+        fake = FakeOpenAI(answer("Hi."))
+        pipeline = ChatPipeline(fake.client())
+
+        await self.collect(pipeline, "Hello")
+        chunks = await self.collect(pipeline, "hello")
+
+        self.assertEqual(chunks, ["Hi."])
+        self.assertEqual(fake.calls, 1)
+
+
+class ChatStreamViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        response_cache.clear()
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+
+    async def post(self, messages):
+        return await self.async_client.post(
+            "/api/chat/stream/",
+            messages,
+            content_type="application/json",
+            headers=basic_auth("owner", "pass"),
+        )
+
+    async def test_answer_is_sent_as_server_sent_events(self):
+        fake = FakeOpenAI(answer("Hello there, how can I help?"))
+        with mock.patch("homelink.views.chat_pipeline", ChatPipeline(fake.client())):
+            response = await self.post([{"author": "Author.user", "content": "Hi"}])
+            body = b"".join([part async for part in response.streaming_content])
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = [
+            (lines[0].removeprefix("event: "), json.loads(lines[1][len("data: ") :]))
+            for lines in (event.split("\n") for event in body.decode().split("\n\n"))
+            if lines[0]
+        ]
+        self.assertEqual(
+            "".join(data["text"] for event, data in events if event == "delta"),
+            "Hello there, how can I help?",
+        )
+        self.assertEqual(
+            events[-1], ("done", {"response": "Hello there, how can I help?"})
+        )
+
+    async def test_anonymous_requests_are_rejected(self):
+        response = await self.async_client.post(
+            "/api/chat/stream/", [], content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_empty_prompt_is_rejected(self):
+        response = await self.post([])
+
+        self.assertEqual(response.status_code, 400)
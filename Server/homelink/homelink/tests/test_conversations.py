@@ -0,0 +1,200 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from database.access import device_access_cache
+from database.models.models import Conversation, ConversationMessage
+from ..conversations import SUMMARY_PREFIX, conversation_prompt
+
+UserModel = get_user_model()
+
+
+class ConversationPromptTest(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+        self.conversation = Conversation.objects.create(owner=self.user)
+        # 10 turns of 100 tokens each
+        for i in range(10):
+            role = (
+                ConversationMessage.USER
+                if i % 2 == 0
+                else ConversationMessage.ASSISTANT
+            )
+            self.conversation.add_message(role, f"{i}".ljust(400, "."))
+
+    def contents(self, prompt):
+        return [message["content"][0] for message in prompt]
+
+    def test_short_conversation_is_sent_whole(self):
+        prompt = conversation_prompt(self.conversation, budget=1000, strategy="drop")
+
+        self.assertEqual(self.contents(prompt), list("0123456789"))
+        self.assertEqual(prompt[1]["role"], "assistant")
+
+    def test_oldest_messages_are_dropped(self):
+        prompt = conversation_prompt(self.conversation, budget=350, strategy="drop")
+
+        self.assertEqual(self.contents(prompt), list("789"))
+
+    def test_newest_message_is_kept_over_budget(self):
+        prompt = conversation_prompt(self.conversation, budget=10, strategy="drop")
+
+        self.assertEqual(self.contents(prompt), ["9"])
+
+    def test_unknown_strategy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            conversation_prompt(self.conversation, strategy="truncate")
+
+    @mock.patch("homelink.conversations.summarize_conversation", return_value="S")
+    def test_old_messages_are_summarized(self, summarize):
+        prompt = conversation_prompt(
+            self.conversation, budget=600, strategy="summarize"
+        )
+
+        self.assertEqual(prompt[0], {"role": "system", "content": SUMMARY_PREFIX + "S"})
+        self.assertEqual(self.contents(prompt[1:]), list("789"))
+        folded = summarize.call_args.args[1]
+        self.assertEqual([message["content"][0] for message in folded], list("0123456"))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, "S")
+
+        # the next turns fit next to the summary without summarizing again
+        self.conversation.add_message(ConversationMessage.USER, "a".ljust(400, "."))
+        prompt = conversation_prompt(
+            self.conversation, budget=600, strategy="summarize"
+        )
+
+        summarize.assert_called_once()
+        self.assertEqual(self.contents(prompt[1:]), list("789a"))
+
+
+class ConversationViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.conversation = self.client.post("/api/conversations/", {}).data
+
+    def send(self, content):
+        return self.client.post(
+            f"/api/conversations/{self.conversation['id']}/messages/",
+            {"content": content},
+            format="json",
+        )
+
+    @mock.patch("homelink.views.get_structured_response", return_value="Hi")
+    def test_only_new_message_is_sent_and_history_is_kept(self, llm):
+        self.send("Hello")
+        response = self.send("What devices do I have?")
+
+        self.assertEqual(response.data, {"response": "Hi"})
+        self.assertEqual(
+            llm.call_args.args[0],
+            [
+                {"role": "user", "content": "Hello"},
+                {"role": "assistant", "content": "Hi"},
+                {"role": "user", "content": "What devices do I have?"},
+            ],
+        )
+        messages = self.client.get(
+            f"/api/conversations/{self.conversation['id']}/messages/"
+        ).data
+        self.assertEqual(
+            [message["role"] for message in messages], ["user", "assistant"] * 2
+        )
+        self.assertEqual(
+            self.client.get("/api/conversations/").data[0]["title"], "Hello"
+        )
+
+    @mock.patch(
+        "homelink.views.get_structured_response", side_effect=Exception("timeout")
+    )
+    def test_failed_message_is_not_stored(self, llm):
+        response = self.send("Hello")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(ConversationMessage.objects.exists())
+
+    def test_conversations_of_other_users_are_hidden(self):
+        other = UserModel.objects.create_user(username="other", password="pass")
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.send("Hello").status_code, 404)
+        self.assertEqual(self.client.get("/api/conversations/").data, [])
+
+
+@override_settings(CHAT_HISTORY_TOKENS=600, CHAT_HISTORY_STRATEGY="summarize")
+class ConcurrentConversationMessageTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+        self.conversation = Conversation.objects.create(owner=self.user)
+        for i in range(10):
+            self.conversation.add_message(
+                ConversationMessage.USER, f"{i}".ljust(400, ".")
+            )
+
+    def send(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            client.post(
+                f"/api/conversations/{self.conversation.id}/messages/",
+                {"content": "Hi"},
+                format="json",
+            )
+        finally:
+            connection.close()
+
+    @mock.patch("homelink.views.get_structured_response", return_value="Hi")
+    @mock.patch("homelink.conversations.summarize_conversation")
+    def test_concurrent_messages_share_one_summary(self, summarize, llm):
+        summaries = iter(["S1", "S2"])
+
+        def slow_summary(*args, **kwargs):
+            summary = next(summaries)
+            time.sleep(0.3)
+            return summary
+
+        summarize.side_effect = slow_summary
+        threads = [threading.Thread(target=self.send) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.conversation.refresh_from_db()
+        self.assertIn(self.conversation.summary, ["S1", "S2"])
+        self.assertEqual(
+            [call.args[0][0]["content"] for call in llm.call_args_list],
+            [SUMMARY_PREFIX + self.conversation.summary] * 2,
+        )
+        self.assertEqual(self.conversation.messages.count(), 14)
+
+    @mock.patch("homelink.views.get_structured_response")
+    @mock.patch(
+        "homelink.conversations.summarize_conversation",
+        side_effect=Exception("timeout"),
+    )
+    def test_failed_summary_is_reported(self, summarize, llm):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post(
+            f"/api/conversations/{self.conversation.id}/messages/",
+            {"content": "Hi"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data, {"error": "timeout"})
+        llm.assert_not_called()
+        self.assertEqual(self.conversation.messages.count(), 10)
@@ -0,0 +1,111 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from database.access import device_access_cache
+from database.catalog import DeviceCatalog
+from database.models.models import Command, Device
+from ..intents import IntentMatcher
+
+UserModel = get_user_model()
+
+LED = {"name": "LED", "actions": ["on", "off", "toggle"]}
+
+
+class IntentMatcherTest(TestCase):
+    def setUp(self):
+        self.matcher = IntentMatcher(
+            DeviceCatalog(
+                [
+                    {"id": 1, "name": "Kitchen Pico", "components": [LED]},
+                    {"id": 2, "name": "Bedroom Pico", "components": [LED]},
+                    {
+                        "id": 3,
+                        "name": "Servo 3",
+                        "components": [{"name": "Servo", "actions": ["left", "right"]}],
+                    },
+                    {
+                        "id": 4,
+                        "name": "Display",
+                        "components": [{"name": "Text", "actions": [], "input": True}],
+                    },
+                ]
+            )
+        )
+
+    def assertMatches(self, text, device_id, component, action):
+        intent = self.matcher.match(text)
+        self.assertIsNotNone(intent, text)
+        self.assertEqual(
+            (intent.device_id, intent.component, intent.action),
+            (device_id, component, action),
+        )
+
+    def test_unambiguous_commands_are_resolved(self):
+        self.assertMatches("Turn on the LED in the kitchen", 1, "LED", "on")
+        self.assertMatches("bedroom led off", 2, "LED", "off")
+        self.assertMatches("servo 3 left", 3, "Servo", "left")
+
+    def test_ambiguous_or_complex_messages_are_left_to_the_llm(self):
+        for text in [
+            "turn on the LED",
+            "turn on the kitchen LED and the bedroom LED",
+            "turn on the kitchen LED at 7pm",
+            "is the kitchen LED on?",
+            "don't turn on the kitchen LED",
+            "show hello on the display",
+            "make it cosy in here",
+        ]:
+            self.assertIsNone(self.matcher.match(text), text)
+
+    def test_matching_is_fast(self):
+        start = time.perf_counter()
+        for _ in range(1000):
+            self.matcher.match("Turn on the LED in the kitchen")
+
+        self.assertLess((time.perf_counter() - start) / 1000, 0.001)
+
+
+class ChatFastPathTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+        self.device = Device.objects.create(
+            name="Kitchen Pico", owner=self.user, data={"components": [LED]}
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def chat(self, content):
+        return self.client.post(
+            "/api/chat/", [{"author": "Author.user", "content": content}], format="json"
+        )
+
+    @mock.patch("homelink.views.get_structured_response")
+    def test_simple_command_bypasses_llm(self, llm):
+        response = self.chat("turn the led on")
+
+        self.assertEqual(response.status_code, 200)
+        llm.assert_not_called()
+        command = Command.objects.get()
+        self.assertEqual(command.device, self.device)
+        self.assertEqual(command.data, {"name": "LED", "action": "on"})
+
+    @mock.patch("homelink.views.get_structured_response", return_value="Sure")
+    def test_other_messages_go_to_llm(self, llm):
+        response = self.chat("turn on the led every evening")
+
+        self.assertEqual(response.data, {"response": "Sure"})
+        llm.assert_called_once()
+        self.assertFalse(Command.objects.exists())
+
+    @override_settings(INTENT_FAST_PATH=False)
+    @mock.patch("homelink.views.get_structured_response", return_value="Sure")
+    def test_fast_path_can_be_disabled(self, llm):
+        self.chat("turn the led on")
+
+        llm.assert_called_once()
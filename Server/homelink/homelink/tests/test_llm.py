@@ -0,0 +1,66 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from database.models.models import Device
+from ..llm import ComponentData, DeviceData, ModelResponse, apply_model_response
+
+UserModel = get_user_model()
+
+
+class ApplyModelResponseTest(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+        self.device = Device.objects.create(
+            name="Pico",
+            owner=self.user,
+            data={
+                "components": [
+                    "broken",
+                    {
+                        "name": "Button",
+                        "actions": ["pressed"],
+                        "is_output": True,
+                        "has_input_action": False,
+                        "debounce": 1,
+                    },
+                ]
+            },
+        )
+
+    def override(self, *components):
+        apply_model_response(
+            ModelResponse(
+                text="Done.",
+                commands_to_execute=[],
+                device_data_to_override=DeviceData(
+                    id=self.device.id, components=list(components)
+                ),
+            ),
+            self.user,
+        )
+        self.device.refresh_from_db()
+        return self.device.data["components"]
+
+    def test_override_maps_catalog_fields_and_keeps_the_rest(self):
+        components = self.override(
+            ComponentData(name="Button", actions=["pressed", "held"], input=True),
+            ComponentData(name="LED", actions=["on", "off"], input=False),
+        )
+
+        self.assertEqual(
+            components,
+            [
+                {
+                    "name": "Button",
+                    "actions": ["pressed", "held"],
+                    "is_output": True,
+                    "has_input_action": True,
+                    "debounce": 1,
+                },
+                {
+                    "name": "LED",
+                    "actions": ["on", "off"],
+                    "is_output": False,
+                    "has_input_action": False,
+                },
+            ],
+        )
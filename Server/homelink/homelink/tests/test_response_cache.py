@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from database.access import device_access_cache
+from database.models.models import Command, Device
+from ..llm import (
+    CommandClass,
+    CommandData,
+    LinkResponse,
+    ModelResponse,
+    generate_suggested_links_for_user,
+    get_structured_response,
+    prompt_time,
+)
+from ..response_cache import ResponseCache, response_cache, response_key
+
+UserModel = get_user_model()
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def parsed(value):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(parsed=value))])
+
+
+class ResponseCacheTest(TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        responses = ResponseCache(size=2)
+        responses.set("a", 1)
+        responses.set("b", 2)
+        responses.get("a")
+        responses.set("c", 3)
+
+        self.assertEqual(responses.get("a"), 1)
+        self.assertIsNone(responses.get("b"))
+        self.assertEqual(responses.stats(), {"size": 2, "hits": 2, "misses": 1})
+
+    def test_entries_expire(self):
+        responses = ResponseCache()
+        responses.set("a", 1, ttl=-1)
+
+        self.assertIsNone(responses.get("a"))
+
+    def test_time_is_given_only_to_messages_that_need_it(self):
+        def ask(content):
+            return prompt_time([{"role": "user", "content": content}])
+
+        self.assertIsNone(ask("What devices do I have?"))
+        self.assertIsNone(ask("Turn on the LED"))
+        for content in [
+            "What time is it?",
+            "Turn on the LED at 8",
+            "Turn off the lamp tomorrow morning",
+            "Włącz światło jutro rano",
+        ]:
+            self.assertIsNotNone(ask(content), content)
+
+    def test_key_ignores_case_and_whitespace(self):
+        self.assertEqual(
+            response_key("chat", 1, "h", [{"role": "user", "content": "What  devices?"}]),
+            response_key("chat", 1, "h", [{"role": "user", "content": "what devices?"}]),
+        )
+
+
+@mock.patch("homelink.llm.client")
+class CachedLLMResponseTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        response_cache.clear()
+        self.user = UserModel.objects.create_user(username="owner", password="pass")
+        self.device = Device.objects.create(
+            name="Pico",
+            owner=self.user,
+            data={"components": [{"name": "LED", "actions": ["on", "off"]}]},
+        )
+        self.messages = [{"role": "user", "content": "What devices do I have?"}]
+        patcher = mock.patch("homelink.llm.prompt_time", return_value=NOW)
+        self.prompt_time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_question_is_answered_from_cache(self, client):
+        parse = client.beta.chat.completions.parse
+        parse.return_value = parsed(
+            ModelResponse(
+                text="You have Pico.",
+                commands_to_execute=[],
+                device_data_to_override=None,
+            )
+        )
+
+        first = get_structured_response(self.messages, user=self.user)
+        second = get_structured_response(
+            [{"role": "user", "content": "what devices do i have?"}], user=self.user
+        )
+
+        self.assertEqual(first, second)
+        parse.assert_called_once()
+        self.assertEqual(response_cache.stats()["hits"], 1)
+
+    def test_answers_are_not_reused_after_the_prompt_time_changed(self, client):
+        parse = client.beta.chat.completions.parse
+        parse.return_value = parsed(
+            ModelResponse(
+                text="It is noon.",
+                commands_to_execute=[],
+                device_data_to_override=None,
+            )
+        )
+        messages = [{"role": "user", "content": "What time is it?"}]
+
+        get_structured_response(messages, user=self.user)
+        self.prompt_time.return_value = NOW + timedelta(minutes=1)
+        get_structured_response(messages, user=self.user)
+
+        self.assertEqual(parse.call_count, 2)
+        self.assertIn(
+            f"Current time is: {NOW + timedelta(minutes=1)}.",
+            parse.call_args.kwargs["messages"][0]["content"],
+        )
+
+    def test_answers_with_side_effects_are_not_cached(self, client):
+        parse = client.beta.chat.completions.parse
+        parse.return_value = parsed(
+            ModelResponse(
+                text="Done.",
+                commands_to_execute=[
+                    CommandClass(
+                        device_id=self.device.id,
+                        data=CommandData(name="LED", action="on"),
+                        scheduled_at=None,
+                        repeat_interval=None,
+                    )
+                ],
+                device_data_to_override=None,
+            )
+        )
+        messages = [{"role": "user", "content": "Turn on the LED"}]
+
+        get_structured_response(messages, user=self.user)
+        get_structured_response(messages, user=self.user)
+
+        self.assertEqual(parse.call_count, 2)
+        self.assertEqual(Command.objects.count(), 2)
+
+    def test_link_suggestions_are_cached_until_devices_change(self, client):
+        parse = client.beta.chat.completions.parse
+        parse.return_value = parsed(LinkResponse(links=[]))
+
+        generate_suggested_links_for_user(self.user)
+        generate_suggested_links_for_user(self.user)
+        self.assertEqual(parse.call_count, 1)
+
+        self.device.name = "Kitchen Pico"
+        self.device.save()
+        generate_suggested_links_for_user(self.user)
+
+        self.assertEqual(parse.call_count, 2)
@@ -1,9 +1,17 @@
 from django.urls import path, include
 from django.contrib import admin
 from rest_framework.authtoken import views
-from .views import CreateUserView, ChatGPTView, GenerateLinksView
+from .views import (
+    CreateUserView,
+    ChatGPTView,
+    ChatStreamView,
+    ConversationViewSet,
+    GenerateLinksView,
+    ResponseCacheStatsView,
+)
 
 from rest_framework import permissions
+from rest_framework.routers import SimpleRouter
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
@@ -17,12 +25,18 @@ schema_view = get_schema_view(
     public=True,
     permission_classes=(permissions.AllowAny,),
 )
+router = SimpleRouter()
+router.register("conversations", ConversationViewSet, basename="conversations")
+
 urlpatterns = [
     path("login/", views.obtain_auth_token),
     path("register/", CreateUserView.as_view(), name="create-user"),
     path("admin/", admin.site.urls),
     path("api/chat/", ChatGPTView.as_view(), name="chat-gpt"),
+    path("api/chat/stream/", ChatStreamView.as_view(), name="chat-stream"),
     path("api/generate-links/", GenerateLinksView.as_view(), name="generate-links"),
+    path("api/chat/cache/", ResponseCacheStatsView.as_view(), name="chat-cache-stats"),
+    path("api/", include(router.urls)),
     path("api/", include("database.urls")),
     path(
         "swagger/",
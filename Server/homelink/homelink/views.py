@@ -1,12 +1,31 @@
-from rest_framework import permissions, status
+import json
+
+from asgiref.sync import sync_to_async
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.generics import CreateAPIView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 
+from .async_llm import chat_pipeline
+from .conversations import conversation_prompt
+from .response_cache import response_cache
 from .serializers import UserSerializer
-from .llm import get_structured_response, generate_suggested_links_for_user
+from database.async_views import authenticate
+from database.authentication import make_device_key
+from database.models.models import Conversation, ConversationMessage
+from database.pagination import KeysetPagination
+from database.serializers import ConversationMessageSerializer, ConversationSerializer
+from .llm import (
+    execute_simple_command,
+    get_structured_response,
+    generate_suggested_links_for_user,
+)
 
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -25,19 +44,41 @@ class CreateUserView(CreateAPIView):
         token, _ = Token.objects.get_or_create(
             user=get_user_model().objects.get(username=serializer.data["username"])
         )
+        data = {**serializer.data, "token": token.key}
         if request.data.get("user"):
             created = serializer.instance
             created.owner = get_user_model().objects.get(username=request.data["user"])
             created.is_device = True
             created.save()
+            data["device_key"] = make_device_key(created)
 
         return Response(
-            {**serializer.data, "token": token.key},
+            data,
             status=status.HTTP_201_CREATED,
             headers=headers,
         )
 
 
+def to_model_messages(messages):
+    """Converts the chat of the mobile app to the messages of the model."""
+    return [
+        (
+            {"role": "system", "content": x["content"]}
+            if x["author"] == "Author.llm"
+            else {"role": "user", "content": x["content"]}
+        )
+        for x in messages
+    ]
+
+
+def answer_chat(messages, user):
+    if settings.INTENT_FAST_PATH and messages[-1]["role"] == "user":
+        response = execute_simple_command(messages[-1]["content"], user)
+        if response is not None:
+            return response
+    return get_structured_response(messages, user=user)
+
+
 class ChatGPTView(APIView):
     def post(self, request):
         messages = request.data
@@ -46,19 +87,10 @@ class ChatGPTView(APIView):
                 {"error": "Prompt is required"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        messages = [
-            (
-                {"role": "system", "content": x["content"]}
-                if x["author"] == "Author.llm"
-                else {"role": "user", "content": x["content"]}
-            )
-            for x in messages
-        ]
+        messages = to_model_messages(messages)
 
         try:
-            response = get_structured_response(
-                messages, devices=request.user.get_user_devices(), user=request.user
-            )
+            response = answer_chat(messages, request.user)
             return Response(
                 {"response": response},
                 status=status.HTTP_200_OK,
@@ -70,6 +102,122 @@ class ChatGPTView(APIView):
             )
 
 
+class ConversationViewSet(viewsets.ModelViewSet):
+    """Chats kept on the server.
+
+    `POST /api/conversations/<id>/messages/` with `{"content": ...}` sends only
+    the new message. The history sent to the model is taken from the
+    conversation and kept under CHAT_HISTORY_TOKENS (see
+    homelink/conversations.py).
+    """
+
+    serializer_class = ConversationSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Conversation.objects.filter(owner=self.request.user).order_by("-id")
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+    @action(detail=True, methods=["get", "post"])
+    def messages(self, request, pk=None):
+        conversation = self.get_object()
+        if request.method == "GET":
+            messages = conversation.messages.all()
+            page = self.paginate_queryset(messages)
+            if page is not None:
+                return self.get_paginated_response(
+                    ConversationMessageSerializer(page, many=True).data
+                )
+            return Response(
+                ConversationMessageSerializer(messages.order_by("id"), many=True).data
+            )
+
+        serializer = ConversationMessageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        message = conversation.add_message(
+            ConversationMessage.USER, serializer.validated_data["content"]
+        )
+        try:
+            # may ask the LLM to summarize older messages
+            prompt = conversation_prompt(conversation)
+            response = answer_chat(prompt, request.user)
+        except Exception as e:
+            # the client sends the message again
+            message.delete()
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        conversation.add_message(ConversationMessage.ASSISTANT, response)
+        return Response(
+            {"response": response},
+            status=status.HTTP_200_OK,
+            content_type="application/json; charset=utf-8",
+        )
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChatStreamView(View):
+    """Streaming counterpart of `POST /api/chat/` for ASGI deployments.
+
+    The answer is sent as server-sent events: `delta` events with pieces of
+    the text while the model generates it, then a `done` event with the whole
+    response (or an `error` event). Model calls go through the async
+    `chat_pipeline`, which bounds how many run at once.
+    """
+
+    async def post(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=401,
+            )
+        try:
+            messages = to_model_messages(json.loads(request.body))
+        except (ValueError, TypeError, KeyError):
+            messages = None
+        if not messages:
+            return JsonResponse({"error": "Prompt is required"}, status=400)
+
+        response = StreamingHttpResponse(
+            self.events(messages, user), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def events(self, messages, user):
+        if settings.INTENT_FAST_PATH and messages[-1]["role"] == "user":
+            text = await sync_to_async(execute_simple_command)(
+                messages[-1]["content"], user
+            )
+            if text is not None:
+                yield sse("done", {"response": text})
+                return
+
+        text = ""
+        try:
+            async for chunk in chat_pipeline.stream(messages, user):
+                text += chunk
+                yield sse("delta", {"text": chunk})
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+        else:
+            yield sse("done", {"response": text})
+
+
 class GenerateLinksView(APIView):
     def get(self, request):
         return Response(generate_suggested_links_for_user(request.user))
+
+
+class ResponseCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache.stats())